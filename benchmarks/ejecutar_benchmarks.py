@@ -0,0 +1,445 @@
+"""
+Escenarios cronometrados del procesamiento de facturas, sin clave de OpenAI ni
+Tesseract: genera facturas sintéticas (generar_facturas.py), levanta la API
+simulada (servidor_openai_simulado.py) y usa el Tesseract simulado
+(tesseract_simulado.py). Cada escenario mide el rendimiento de una etapa:
+
+    extraccion_digital    texto nativo de los PDFs digitales (pool de procesos)
+    extraccion_escaneada  OCR de los PDFs escaneados (pool de procesos)
+    llm                   una solicitud a OpenAI por factura (hilos)
+    llm_lote              varias facturas por solicitud (--modo-lote)
+    plantillas            extracción local con las plantillas aprendidas del LLM
+    insercion_bd          escritura por bloques en SQLite (EscritorSQLite)
+    reporte               lectura por bloques y renderizado del reporte HTML
+    pipeline              ejecución completa de las tres etapas sobre la carpeta
+
+Los resultados se escriben en JSON (--salida) para comparar versiones; con
+--comparar se informa y se sale con código 1 si algún escenario perdió más de
+--tolerancia de su rendimiento respecto de un resultado anterior. También se
+sale con código 1 si un escenario informa errores de verificación (por ejemplo,
+proveedores frecuentes para los que no se aprendió ninguna plantilla).
+
+Uso:
+    python benchmarks/ejecutar_benchmarks.py --cantidad 300 --salida resultados.json
+    python benchmarks/ejecutar_benchmarks.py --cantidad 300 --comparar resultados.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import collections
+import datetime
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Los módulos del proyecto están en la carpeta superior
+DIRECTORIO_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+RAIZ_REPOSITORIO = os.path.dirname(DIRECTORIO_BENCHMARKS)
+sys.path.insert(0, RAIZ_REPOSITORIO)
+sys.path.insert(0, DIRECTORIO_BENCHMARKS)
+
+import generar_facturas
+import servidor_openai_simulado
+
+
+# Escenarios disponibles, en el orden en que se ejecutan
+ESCENARIOS = ('extraccion_digital', 'extraccion_escaneada', 'llm', 'llm_lote', 'plantillas', 'insercion_bd',
+              'reporte', 'pipeline')
+
+# Facturas sintéticas a generar por defecto
+CANTIDAD_FACTURAS = 200
+
+# Filas del escenario insercion_bd (y del reporte que se genera a partir de ellas)
+FILAS_BASE_DATOS = 20000
+
+# Facturas de un proveedor a partir de las cuales el escenario plantillas exige que
+# alguna se haya extraído localmente (la plantilla necesita coincidir varias veces
+# con el LLM antes de usarse, ver UMBRAL_CONFIANZA_PLANTILLA)
+MIN_FACTURAS_PLANTILLA = 10
+
+# Latencias simuladas por defecto, en milisegundos
+LATENCIA_OPENAI_MS = 300
+LATENCIA_OCR_MS = 200
+
+# Pérdida de rendimiento a partir de la cual --comparar informa una regresión
+TOLERANCIA_REGRESION = 0.10
+
+
+@contextlib.contextmanager
+def silenciar_salida(activo=True):
+    """
+    Descarta la salida estándar (también la de los procesos hijos que se creen
+    dentro del bloque) para que los mensajes de procesar_facturas.py no se
+    mezclen con los resultados.
+    """
+    if not activo:
+        yield
+        return
+    sys.stdout.flush()
+    descriptor_original = os.dup(1)
+    with open(os.devnull, 'w') as nulo:
+        os.dup2(nulo.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(nulo):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(descriptor_original, 1)
+            os.close(descriptor_original)
+
+
+def crear_tesseract_simulado(carpeta):
+    """
+    Crea en 'carpeta' un ejecutable 'tesseract' que llama a tesseract_simulado.py
+    con el intérprete actual, y retorna su ruta.
+    """
+    ruta = os.path.join(carpeta, 'tesseract')
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(DIRECTORIO_BENCHMARKS, "tesseract_simulado.py")}" "$@"\n')
+    os.chmod(ruta, 0o755)
+    return ruta
+
+
+def version_repositorio():
+    """
+    Retorna la descripción git de la versión medida, o None fuera de un repositorio.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ_REPOSITORIO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resultado(elementos, segundos, **extras):
+    """
+    Retorna el resultado de un escenario con su rendimiento en elementos por segundo.
+    """
+    return dict(elementos=elementos, segundos=round(segundos, 4),
+                por_segundo=round(elementos / segundos, 3) if segundos > 0 else None, **extras)
+
+
+def _exactitud(pf, datos_por_nombre, facturas):
+    # Fracción de facturas digitales cuyo total extraído coincide con el del manifiesto
+    digitales = [factura for factura in facturas if not factura['escaneada'] and factura['nombre_archivo'] in datos_por_nombre]
+    if not digitales:
+        return None
+    aciertos = sum(1 for factura in digitales
+                   if (datos_por_nombre[factura['nombre_archivo']] or {}).get('total') is not None
+                   and pf.a_centavos(datos_por_nombre[factura['nombre_archivo']]['total']) == pf.a_centavos(factura['total']))
+    return round(aciertos / len(digitales), 4)
+
+
+class Benchmarks:
+    """
+    Prepara los datos compartidos por los escenarios (facturas, textos y base de
+    datos) y ejecuta cada uno.
+    """
+
+    def __init__(self, pf, modulo_reporte, args, carpeta, facturas, tesseract_cmd, servidor, directorio_temporal):
+        self.pf = pf
+        self.modulo_reporte = modulo_reporte
+        self.args = args
+        self.carpeta = carpeta
+        self.facturas = facturas
+        self.tesseract_cmd = tesseract_cmd
+        self.servidor = servidor
+        self.temporal = directorio_temporal
+        self.textos = {}
+        self.ruta_bd = os.path.join(directorio_temporal, 'benchmark.db')
+
+    def _rutas(self, escaneadas):
+        return [os.path.join(self.carpeta, factura['nombre_archivo'])
+                for factura in self.facturas if factura['escaneada'] == escaneadas]
+
+    def _extraer(self, escaneadas):
+        rutas = self._rutas(escaneadas)
+        if not rutas:
+            return resultado(0, 0.0)
+        inicio = time.perf_counter()
+        pool = self.pf.crear_pool_extraccion(self.args.trabajadores_extraccion)
+        try:
+            textos = list(pool.map(self.pf.extraer_texto_de_pdf, rutas,
+                                   [self.pf.UMBRAL_CARACTERES_POR_PAGINA] * len(rutas),
+                                   [self.tesseract_cmd] * len(rutas)))
+        finally:
+            pool.shutdown()
+        segundos = time.perf_counter() - inicio
+        for ruta, texto in zip(rutas, textos):
+            if texto:
+                self.textos[os.path.basename(ruta)] = texto
+        return resultado(len(rutas), segundos, con_texto=sum(1 for texto in textos if texto),
+                         caracteres=sum(len(texto or "") for texto in textos))
+
+    def extraccion_digital(self):
+        return self._extraer(escaneadas=False)
+
+    def extraccion_escaneada(self):
+        return self._extraer(escaneadas=True)
+
+    def _textos_para_llm(self):
+        # Si no se corrieron los escenarios de extracción, usa el texto nativo de los PDFs digitales
+        if not self.textos:
+            for ruta in self._rutas(escaneadas=False):
+                self.textos[os.path.basename(ruta)] = self.pf.extraer_texto_de_pdf(
+                    ruta, self.pf.UMBRAL_CARACTERES_POR_PAGINA, self.tesseract_cmd)
+        return {nombre: texto for nombre, texto in self.textos.items() if texto}
+
+    def _medir_llm(self, funcion):
+        # Como en el pipeline, a OpenAI se envía el texto compactado
+        textos = {nombre: self.pf.compactar_texto_factura(texto) for nombre, texto in self._textos_para_llm().items()}
+        antes = self.servidor.resumen()
+        inicio = time.perf_counter()
+        datos_por_nombre = funcion(textos)
+        segundos = time.perf_counter() - inicio
+        despues = self.servidor.resumen()
+        return resultado(len(textos), segundos,
+                         con_datos=sum(1 for datos in datos_por_nombre.values() if datos),
+                         exactitud_total=_exactitud(self.pf, datos_por_nombre, self.facturas),
+                         **{clave: despues[clave] - antes[clave] for clave in despues})
+
+    def llm(self):
+        def _extraer(textos):
+            with ThreadPoolExecutor(max_workers=self.args.trabajadores_llm) as hilos:
+                datos = hilos.map(lambda texto: self.pf.extraer_datos_con_openai(texto, self.pf.MODELO_OPENAI),
+                                  textos.values())
+                return dict(zip(textos, datos))
+        return self._medir_llm(_extraer)
+
+    def llm_lote(self):
+        def _extraer(textos):
+            # Un grupo de facturas por hilo, cada uno enviado en lotes
+            nombres = list(textos)
+            grupos = [nombres[i::self.args.trabajadores_llm] for i in range(self.args.trabajadores_llm)]
+            resultados = {}
+            with ThreadPoolExecutor(max_workers=self.args.trabajadores_llm) as hilos:
+                for parcial in hilos.map(lambda grupo: self.pf.extraer_datos_con_openai_lote(
+                        {nombre: textos[nombre] for nombre in grupo}, self.pf.MODELO_OPENAI), grupos):
+                    resultados.update(parcial)
+            return resultados
+        return self._medir_llm(_extraer)
+
+    def plantillas(self):
+        # Como en el pipeline: las facturas sin plantilla confiable se envían al LLM (aquí,
+        # los datos que devolvería el servidor simulado) y su resultado entrena la plantilla
+        textos = self._textos_para_llm()
+        ruta_bd = os.path.join(self.temporal, 'plantillas.db')
+        if os.path.exists(ruta_bd):
+            os.remove(ruta_bd)
+        conn, cursor = self.pf.configurar_base_datos(ruta_bd)
+        plantillas = self.pf.PlantillasProveedor()
+        locales = {}
+        inicio = time.perf_counter()
+        for nombre, texto in textos.items():
+            datos = plantillas.extraer_si_confiable(texto)
+            if datos is not None:
+                locales[nombre] = datos
+            else:
+                plantillas.aprender(cursor, texto, servidor_openai_simulado.extraer_campos(texto))
+        conn.commit()
+        segundos = time.perf_counter() - inicio
+        conn.close()
+
+        # Verificación: cada proveedor con suficientes facturas debe terminar extrayéndose localmente
+        proveedor_por_nombre = {factura['nombre_archivo']: factura['proveedor'] for factura in self.facturas}
+        facturas_por_proveedor = collections.Counter(proveedor_por_nombre[nombre] for nombre in textos)
+        con_extraccion_local = {proveedor_por_nombre[nombre] for nombre in locales}
+        errores = [f"No se aprendió una plantilla usable para '{proveedor}' ({cantidad} facturas)."
+                   for proveedor, cantidad in sorted(facturas_por_proveedor.items())
+                   if cantidad >= MIN_FACTURAS_PLANTILLA and proveedor not in con_extraccion_local]
+        return resultado(len(textos), segundos, plantillas=len(plantillas), extracciones_locales=len(locales),
+                         exactitud_total=_exactitud(self.pf, locales, self.facturas), errores=errores)
+
+    def insercion_bd(self):
+        if os.path.exists(self.ruta_bd):
+            os.remove(self.ruta_bd)
+        conn, _ = self.pf.configurar_base_datos(self.ruta_bd)
+        filas = self.args.filas_bd
+        inicio = time.perf_counter()
+        escritor = self.pf.EscritorSQLite(conn)
+        for indice in range(filas):
+            factura = self.facturas[indice % len(self.facturas)]
+            datos = {campo: factura.get(campo) for campo in self.pf.CAMPOS_FACTURA}
+            # Cada fila es una factura distinta (otro número y total), no un duplicado que detectar
+            datos['numero_factura'] = f"{indice:08d}-{datos['numero_factura']}"
+            datos['total'] = round(datos['total'] + indice / 100, 2)
+            escritor.agregar_factura(f"{indice:08d}_{factura['nombre_archivo']}", datos, f"hash-{indice}")
+            escritor.vaciar_si_corresponde()
+        escritor.vaciar()
+        segundos = time.perf_counter() - inicio
+        conn.close()
+        return resultado(filas, segundos, tamano_bd_bytes=os.path.getsize(self.ruta_bd))
+
+    def reporte(self):
+        if not os.path.exists(self.ruta_bd):
+            self.insercion_bd()
+        salida = os.path.join(self.temporal, 'reporte.html')
+        inicio = time.perf_counter()
+        self.modulo_reporte.render_report_html(self.modulo_reporte.HTML_TEMPLATE, salida,
+                                        self.modulo_reporte.stream_invoice_data(self.ruta_bd),
+                                        self.modulo_reporte.fetch_summary_data(self.ruta_bd))
+        segundos = time.perf_counter() - inicio
+        with contextlib.closing(sqlite3.connect(self.ruta_bd)) as conn:
+            filas = conn.execute("SELECT COUNT(*) FROM facturas").fetchone()[0]
+        return resultado(filas, segundos, tamano_html_bytes=os.path.getsize(salida))
+
+    def pipeline(self):
+        ruta_bd = os.path.join(self.temporal, 'pipeline.db')
+        if os.path.exists(ruta_bd):
+            os.remove(ruta_bd)
+        nombres = [factura['nombre_archivo'] for factura in self.facturas]
+        antes = self.servidor.resumen()
+        inicio = time.perf_counter()
+        conn, cursor = self.pf.configurar_base_datos(ruta_bd)
+        archivos = self.pf.planificar_archivos(conn, cursor, nombres, carpeta=self.carpeta)
+        self.pf.ejecutar_pipeline(conn, cursor, archivos, self.tesseract_cmd,
+                                  trabajadores_extraccion=self.args.trabajadores_extraccion,
+                                  trabajadores_llm=self.args.trabajadores_llm,
+                                  plantillas=self.pf.PlantillasProveedor())
+        segundos = time.perf_counter() - inicio
+        guardadas = cursor.execute("SELECT COUNT(*) FROM facturas").fetchone()[0]
+        conn.close()
+        despues = self.servidor.resumen()
+        return resultado(len(nombres), segundos, guardadas=guardadas,
+                         **{clave: despues[clave] - antes[clave] for clave in despues})
+
+
+def comparar(actual, anterior, tolerancia):
+    """
+    Retorna las líneas de la comparación del rendimiento de cada escenario y si
+    alguno empeoró más que 'tolerancia'.
+    """
+    lineas = []
+    hay_regresion = False
+    for nombre, medicion in actual['escenarios'].items():
+        previa = anterior.get('escenarios', {}).get(nombre)
+        if not previa or not previa.get('por_segundo') or not medicion.get('por_segundo'):
+            continue
+        cambio = medicion['por_segundo'] / previa['por_segundo'] - 1
+        regresion = cambio < -tolerancia
+        hay_regresion |= regresion
+        lineas.append(f"  {nombre:<22} {previa['por_segundo']:>10.2f} -> {medicion['por_segundo']:>10.2f} /s "
+                      f"({cambio:+.1%}){'  REGRESIÓN' if regresion else ''}")
+    return lineas, hay_regresion
+
+
+def crear_parser_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmarks del procesamiento de facturas con servicios simulados.")
+    parser.add_argument("--escenarios", nargs='+', choices=ESCENARIOS, default=list(ESCENARIOS),
+                        help="Escenarios a ejecutar (por defecto: todos).")
+    parser.add_argument("--cantidad", type=int, default=CANTIDAD_FACTURAS,
+                        help=f"Facturas sintéticas a generar (por defecto: {CANTIDAD_FACTURAS}).")
+    parser.add_argument("--proporcion-escaneadas", type=float, default=0.3,
+                        help="Fracción de facturas escaneadas (por defecto: 0.3).")
+    parser.add_argument("--carpeta", help="Carpeta de facturas a usar; si no tiene manifiesto se generan en ella.")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de las facturas y de los errores simulados.")
+    parser.add_argument("--filas-bd", type=int, default=FILAS_BASE_DATOS,
+                        help=f"Filas del escenario insercion_bd (por defecto: {FILAS_BASE_DATOS}).")
+    parser.add_argument("--trabajadores-extraccion", type=int, default=os.cpu_count() or 1,
+                        help="Procesos de extracción de texto/OCR (por defecto: uno por CPU).")
+    parser.add_argument("--trabajadores-llm", type=int, default=4, help="Llamadas simultáneas a OpenAI (por defecto: 4).")
+    parser.add_argument("--latencia-openai-ms", type=float, default=LATENCIA_OPENAI_MS,
+                        help=f"Latencia media de la API simulada (por defecto: {LATENCIA_OPENAI_MS}).")
+    parser.add_argument("--tasa-errores", type=float, default=0.0,
+                        help="Fracción de solicitudes a la API simulada que fallan con 429 o 500 (por defecto: 0).")
+    parser.add_argument("--latencia-ocr-ms", type=float, default=LATENCIA_OCR_MS,
+                        help=f"Latencia por página del Tesseract simulado (por defecto: {LATENCIA_OCR_MS}).")
+    parser.add_argument("--tesseract-real", action="store_true",
+                        help="Usar el Tesseract instalado en lugar del simulado.")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados (por defecto se imprimen).")
+    parser.add_argument("--comparar", help="Resultados JSON anteriores con los que comparar el rendimiento.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_REGRESION,
+                        help=f"Pérdida de rendimiento tolerada al comparar (por defecto: {TOLERANCIA_REGRESION}).")
+    parser.add_argument("--detallado", action="store_true", help="Mostrar los mensajes de procesar_facturas.py.")
+    return parser
+
+
+def main(argv=None):
+    args = crear_parser_argumentos().parse_args(argv)
+    if min(args.cantidad, args.filas_bd, args.trabajadores_extraccion, args.trabajadores_llm) < 1:
+        print("Error: La cantidad, las filas y el número de trabajadores deben ser al menos 1.")
+        sys.exit(1)
+
+    directorio_temporal = tempfile.mkdtemp(prefix="benchmark_facturas_")
+    servidor = servidor_openai_simulado.iniciar_en_segundo_plano(
+        latencia_ms=args.latencia_openai_ms, tasa_errores=args.tasa_errores, semilla=args.semilla)
+    try:
+        # Configuración que leen procesar_facturas.py (al llamar a OpenAI) y los procesos de extracción
+        os.environ['OPENAI_API_KEY'] = 'benchmark'
+        os.environ['OPENAI_BASE_URL'] = servidor.url_base
+        os.environ['TESSERACT_SIMULADO_LATENCIA_MS'] = str(args.latencia_ocr_ms)
+        tesseract_cmd = 'tesseract' if args.tesseract_real else crear_tesseract_simulado(directorio_temporal)
+        with silenciar_salida(not args.detallado):
+            import procesar_facturas as pf
+            import generar_reporte_html as modulo_reporte
+        pf.configurar_registro('INFO' if args.detallado else 'ERROR')
+
+        carpeta = args.carpeta or os.path.join(directorio_temporal, 'facturas')
+        ruta_manifiesto = os.path.join(carpeta, generar_facturas.NOMBRE_MANIFIESTO)
+        if os.path.exists(ruta_manifiesto):
+            with open(ruta_manifiesto, encoding='utf-8') as archivo:
+                facturas = json.load(archivo)
+            print(f"Usando {len(facturas)} facturas de '{carpeta}'.", file=sys.stderr)
+        else:
+            inicio = time.perf_counter()
+            facturas = generar_facturas.generar_facturas(carpeta, args.cantidad, args.proporcion_escaneadas, args.semilla)
+            print(f"Generadas {len(facturas)} facturas en {time.perf_counter() - inicio:.1f} s.", file=sys.stderr)
+
+        benchmarks = Benchmarks(pf, modulo_reporte, args, carpeta, facturas, tesseract_cmd, servidor, directorio_temporal)
+        resultados = {
+            'version': version_repositorio(),
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parametros': {clave: valor for clave, valor in vars(args).items()
+                           if clave not in ('salida', 'comparar', 'detallado')},
+            'escenarios': {},
+        }
+        hay_errores = False
+        for nombre in ESCENARIOS:
+            if nombre not in args.escenarios:
+                continue
+            print(f"Escenario {nombre}...", file=sys.stderr)
+            with silenciar_salida(not args.detallado):
+                medicion = getattr(benchmarks, nombre)()
+            resultados['escenarios'][nombre] = medicion
+            print(f"  {medicion['elementos']} elementos en {medicion['segundos']:.2f} s "
+                  f"({medicion['por_segundo'] or 0:.2f}/s)", file=sys.stderr)
+            for error in medicion.get('errores', []):
+                print(f"  Error: {error}", file=sys.stderr)
+                hay_errores = True
+        resultados['metricas'] = pf.METRICAS.indicadores()
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    texto_json = json.dumps(resultados, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto_json + "\n")
+        print(f"Resultados guardados en '{args.salida}'.", file=sys.stderr)
+    else:
+        print(texto_json)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            anterior = json.load(archivo)
+        lineas, hay_regresion = comparar(resultados, anterior, args.tolerancia)
+        print(f"Comparación con {anterior.get('version') or args.comparar}:", file=sys.stderr)
+        print("\n".join(lineas) or "  Sin escenarios en común.", file=sys.stderr)
+        if hay_regresion:
+            sys.exit(1)
+    if hay_errores:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
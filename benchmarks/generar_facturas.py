@@ -0,0 +1,212 @@
+"""
+Genera facturas PDF sintéticas para los benchmarks: digitales (con texto nativo)
+y escaneadas (la página se rasteriza y se guarda solo como imagen, así que
+procesar_facturas.py tiene que aplicarles OCR).
+
+Las facturas imitan los formatos de las de ejemplo (encabezado del proveedor,
+número, fecha, cliente, tabla de artículos y totales), con varios diseños y
+proveedores que se repiten para que también se ejerciten las plantillas.
+Junto a los PDFs se escribe 'manifiesto.json' con los datos de cada factura.
+
+Uso:
+    python benchmarks/generar_facturas.py --cantidad 2000 --proporcion-escaneadas 0.3 --salida /tmp/facturas
+"""
+import os
+import sys
+import json
+import random
+import datetime
+import argparse
+
+import fitz  # PyMuPDF (se importa como fitz)
+
+
+# Carpeta de salida por defecto
+CARPETA_SALIDA = 'facturas_sinteticas'
+
+# Nombre del archivo con los datos esperados de cada factura
+NOMBRE_MANIFIESTO = 'manifiesto.json'
+
+# Resolución con la que se rasterizan las facturas "escaneadas"
+DPI_ESCANEO = 100
+
+# Proveedores ficticios: (razón social, identificación fiscal, moneda, diseño)
+PROVEEDORES = (
+    ("WELT MUSIK S.A.", "N.I.T 971014567-2", "COP", "colombia"),
+    ("Distribuidora Andina Ltda.", "N.I.T 900123456-7", "COP", "colombia"),
+    ("PROLUX COMSER S.A.", "CUIT 30-71234567-8", "ARS", "argentina"),
+    ("Ferretería El Tornillo S.R.L.", "CUIT 30-70987654-3", "ARS", "argentina"),
+    ("Papelera Rioplatense S.A.", "CUIT 33-65432109-9", "ARS", "argentina"),
+    ("Acme Supplies Inc.", "EIN 12-3456789", "USD", "simple"),
+)
+
+CLIENTES = ("Express-arte Ltda.", "Jorge Pérez", "Comercial Los Andes", "María Gómez",
+            "Servicios Integrales S.A.", "Tienda La Esquina", "Constructora del Sur S.A.")
+
+ARTICULOS = ("Llaveros", "Posters", "Almohadas", "CD música variada", "Camisetas", "Resmas A4",
+             "Tornillos 3/8", "Cable unipolar", "Lámpara LED", "Cuadernos", "Tóner negro", "Silla de oficina")
+
+MESES = ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio',
+         'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre')
+
+# Fracción de facturas largas (de varias páginas) y su número de artículos
+PROPORCION_LARGAS = 0.05
+ARTICULOS_FACTURA_LARGA = (40, 120)
+
+# Tamaño de letra y posición inicial del texto en la página (en puntos)
+TAMANO_LETRA = 10
+MARGEN = 50
+
+
+def formatear_monto(valor, separador_miles='.', separador_decimal=','):
+    """
+    Formatea un monto con los separadores indicados ('1.234,56' o '1,234.56').
+    """
+    entero, decimales = f"{valor:,.2f}".split('.')
+    return entero.replace(',', separador_miles) + separador_decimal + decimales
+
+
+def crear_factura(indice, generador):
+    """
+    Retorna un diccionario con los datos de una factura aleatoria, incluyendo
+    sus artículos, el proveedor y el diseño con el que se dibuja.
+    """
+    proveedor, identificacion, moneda, diseno = generador.choice(PROVEEDORES)
+    articulos = []
+    larga = generador.random() < PROPORCION_LARGAS
+    for _ in range(generador.randint(*ARTICULOS_FACTURA_LARGA) if larga else generador.randint(1, 12)):
+        cantidad = generador.randint(1, 100)
+        precio = round(generador.uniform(1, 500), 2)
+        articulos.append((generador.choice(ARTICULOS), cantidad, precio, round(cantidad * precio, 2)))
+    subtotal = round(sum(articulo[3] for articulo in articulos), 2)
+    impuestos = round(subtotal * 0.21, 2)
+    fecha = datetime.date(2023, 1, 1) + datetime.timedelta(days=generador.randint(0, 900))
+    return {
+        'nombre_archivo': f"Factura_sintetica_{indice:06d}.pdf",
+        'numero_factura': f"{generador.randint(1, 20):05d}-{indice:08d}",
+        'fecha_emision': fecha.isoformat(),
+        'proveedor': proveedor,
+        'identificacion': identificacion,
+        'cliente': generador.choice(CLIENTES),
+        'moneda': moneda,
+        'diseno': diseno,
+        'articulos': articulos,
+        'subtotal': subtotal,
+        'impuestos': impuestos,
+        'total': round(subtotal + impuestos, 2),
+    }
+
+
+def lineas_factura(factura):
+    """
+    Retorna las líneas de texto de la factura según su diseño.
+    """
+    fecha = datetime.date.fromisoformat(factura['fecha_emision'])
+    if factura['diseno'] == 'colombia':
+        monto = lambda valor: f"$ {formatear_monto(valor)}"
+        encabezado = [factura['proveedor'], factura['identificacion'], "Dirección: Carrera 77L N° 65 J 73 Sur", "",
+                      "FACTURA DE VENTA", f"No. {factura['numero_factura']}",
+                      f"CLIENTE: {factura['cliente']}",
+                      f"FECHA: {fecha.day:02d} de {MESES[fecha.month - 1].capitalize()} de {fecha.year}", "",
+                      "ARTICULO Y/O SERVICIO    CANTIDAD    V/R UNITARIO    V/R TOTAL"]
+        pie = ["", f"SUBTOTAL: {monto(factura['subtotal'])}", f"IVA: {monto(factura['impuestos'])}",
+               f"TOTAL: {monto(factura['total'])}"]
+    elif factura['diseno'] == 'argentina':
+        monto = lambda valor: f"$ {formatear_monto(valor)}"
+        punto_venta, comprobante = factura['numero_factura'].split('-')
+        encabezado = ["FACTURA  B", f"Razón Social: {factura['proveedor']}", factura['identificacion'],
+                      f"Punto de Venta: {punto_venta}   Comp. Nro: {comprobante}",
+                      f"Fecha de Emisión: {fecha.strftime('%d/%m/%Y')}",
+                      f"Apellido y Nombre / Razón Social: {factura['cliente']}", "",
+                      "Producto / Servicio    Cantidad    Precio Unit.    Subtotal"]
+        pie = ["", f"Subtotal: {monto(factura['subtotal'])}", f"IVA 21%: {monto(factura['impuestos'])}",
+               f"Importe Total: {monto(factura['total'])}"]
+    else:
+        monto = lambda valor: f"{factura['moneda']} {formatear_monto(valor, ',', '.')}"
+        encabezado = [factura['proveedor'], factura['identificacion'], "", f"INVOICE # {factura['numero_factura']}",
+                      f"Date: {fecha.isoformat()}", f"Bill to: {factura['cliente']}", "",
+                      "Description    Qty    Unit price    Amount"]
+        pie = ["", f"Subtotal: {monto(factura['subtotal'])}", f"Tax: {monto(factura['impuestos'])}",
+               f"TOTAL: {monto(factura['total'])}"]
+
+    detalle = [f"{nombre}    {cantidad}    {monto(precio)}    {monto(importe)}"
+               for nombre, cantidad, precio, importe in factura['articulos']]
+    return encabezado + detalle + pie
+
+
+def dibujar_factura(factura):
+    """
+    Dibuja la factura en un documento PDF nuevo (una página por cada bloque de
+    líneas que entra en una hoja carta) y lo retorna.
+    """
+    documento = fitz.open()
+    alto_linea = TAMANO_LETRA * 1.6
+    lineas = lineas_factura(factura)
+    por_pagina = int((792 - 2 * MARGEN) // alto_linea)
+    for inicio in range(0, len(lineas), por_pagina):
+        pagina = documento.new_page(width=612, height=792)
+        pagina.set_cropbox(pagina.rect) # Como los PDFs reales; pdfplumber avisa si falta
+        texto = "\n".join(lineas[inicio:inicio + por_pagina])
+        pagina.insert_text((MARGEN, MARGEN), texto, fontsize=TAMANO_LETRA, lineheight=1.6)
+    return documento
+
+
+def rasterizar(documento, dpi=DPI_ESCANEO):
+    """
+    Retorna un documento nuevo en el que cada página es solo la imagen de la
+    página original, como si la factura se hubiera escaneado.
+    """
+    escaneado = fitz.open()
+    for pagina in documento:
+        pix = pagina.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        nueva = escaneado.new_page(width=pagina.rect.width, height=pagina.rect.height)
+        nueva.set_cropbox(nueva.rect)
+        nueva.insert_image(nueva.rect, stream=pix.tobytes("png"))
+    return escaneado
+
+
+def generar_facturas(carpeta, cantidad, proporcion_escaneadas=0.3, semilla=0):
+    """
+    Escribe 'cantidad' facturas en 'carpeta' (una fracción 'proporcion_escaneadas'
+    de ellas rasterizadas) junto con el manifiesto de datos esperados.
+    Retorna la lista de facturas generadas.
+    """
+    generador = random.Random(semilla)
+    os.makedirs(carpeta, exist_ok=True)
+    facturas = []
+    for indice in range(1, cantidad + 1):
+        factura = crear_factura(indice, generador)
+        factura['escaneada'] = generador.random() < proporcion_escaneadas
+        documento = dibujar_factura(factura)
+        if factura['escaneada']:
+            original, documento = documento, rasterizar(documento)
+            original.close()
+        documento.save(os.path.join(carpeta, factura['nombre_archivo']), garbage=3, deflate=True)
+        documento.close()
+        factura.pop('articulos')
+        facturas.append(factura)
+
+    with open(os.path.join(carpeta, NOMBRE_MANIFIESTO), 'w', encoding='utf-8') as archivo:
+        json.dump(facturas, archivo, ensure_ascii=False, indent=1)
+    return facturas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera facturas PDF sintéticas para los benchmarks.")
+    parser.add_argument("--cantidad", type=int, default=1000, help="Facturas a generar (por defecto: 1000).")
+    parser.add_argument("--proporcion-escaneadas", type=float, default=0.3,
+                        help="Fracción de facturas rasterizadas, sin texto nativo (por defecto: 0.3).")
+    parser.add_argument("--salida", default=CARPETA_SALIDA, help=f"Carpeta de salida (por defecto: {CARPETA_SALIDA}).")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla aleatoria, para repetir el mismo conjunto.")
+    args = parser.parse_args(argv)
+    if args.cantidad < 1 or not 0 <= args.proporcion_escaneadas <= 1:
+        print("Error: La cantidad debe ser al menos 1 y la proporción de escaneadas estar entre 0 y 1.")
+        sys.exit(1)
+
+    facturas = generar_facturas(args.salida, args.cantidad, args.proporcion_escaneadas, args.semilla)
+    escaneadas = sum(factura['escaneada'] for factura in facturas)
+    print(f"Generadas {len(facturas)} facturas en '{args.salida}' ({escaneadas} escaneadas).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Servidor local que imita el endpoint de chat completions de OpenAI para los
+benchmarks, sin clave ni costo. Responde a los prompts individuales y por lotes
+de procesar_facturas.py extrayendo los campos con expresiones regulares sobre
+los diseños de generar_facturas.py, con una latencia y una tasa de errores
+(429 con Retry-After y 500) configurables.
+
+Uso:
+    python benchmarks/servidor_openai_simulado.py --puerto 8765 --latencia-ms 400 --tasa-errores 0.05
+    OPENAI_API_KEY=x OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python procesar_facturas.py
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Dirección y puerto por defecto
+HOST_SERVIDOR = '127.0.0.1'
+PUERTO_SERVIDOR = 8765
+
+# Ruta del endpoint que usa el cliente de OpenAI (con OPENAI_BASE_URL terminado en /v1)
+RUTA_CHAT = '/v1/chat/completions'
+
+# Latencia por defecto de cada respuesta, en milisegundos
+LATENCIA_MS = 300
+VARIACION_LATENCIA_MS = 100
+
+# Espera que se indica en la cabecera retry-after-ms de los errores simulados
+ESPERA_REINTENTO_MS = 100
+
+# Caracteres por token para calcular el uso informado (igual que procesar_facturas.py)
+CARACTERES_POR_TOKEN = 4
+
+# Campos de cada diseño de factura: (campo, expresión regular)
+PATRONES_CAMPOS = (
+    ('numero_factura', r'(?:No\.|INVOICE #|N° FACTURA)\s*(\S+)'),
+    ('fecha_emision', r'(?:FECHA|Fecha de Emisión|Date):\s*(.+)'),
+    ('proveedor', r'Razón Social:\s*(.+)'),
+    ('cliente', r'(?:CLIENTE|Apellido y Nombre / Razón Social|Bill to):\s*(.+)'),
+    ('total', r'(?:^TOTAL|Importe Total):\s*(.+)'),
+    ('impuestos', r'(?:IVA(?: 21%)?|Tax):\s*(.+)'),
+)
+
+
+def extraer_campos(texto):
+    """
+    Retorna los campos de factura que se encuentran en 'texto', con null en los
+    que faltan, como los devolvería el modelo.
+    """
+    datos = {}
+    for campo, patron in PATRONES_CAMPOS:
+        coincidencia = re.search(patron, texto, re.MULTILINE)
+        datos[campo] = coincidencia.group(1).strip() if coincidencia else None
+
+    comprobante = re.search(r'Punto de Venta:\s*(\d+)\s+Comp\. Nro:\s*(\d+)', texto)
+    if comprobante:
+        datos['numero_factura'] = f"{comprobante.group(1)}-{comprobante.group(2)}"
+    if datos['proveedor'] is None:
+        # Sin etiqueta, el proveedor es la primera línea del encabezado
+        datos['proveedor'] = next((linea.strip() for linea in texto.splitlines() if linea.strip()), None)
+    for campo in ('total', 'impuestos'):
+        monto = re.search(r'\d[\d.,]*', datos[campo] or "")
+        datos[campo] = monto.group(0) if monto else None
+
+    moneda = re.search(r'\b(USD|EUR)\b', texto)
+    datos['moneda'] = moneda.group(1) if moneda else 'ARS' if 'CUIT' in texto else 'COP' if 'N.I.T' in texto else None
+    return datos
+
+
+def responder_prompt(prompt):
+    """
+    Retorna el contenido JSON que respondería el modelo: un objeto con los campos
+    o, para los prompts por lotes, {"facturas": [...]} con el ID de cada una.
+    """
+    bloques = re.findall(r'^\s*ID: (\S+)\s*\n\s*---\n(.*?)\n\s*---', prompt, re.MULTILINE | re.DOTALL)
+    if bloques:
+        return json.dumps({'facturas': [dict(extraer_campos(texto), id=id_factura) for id_factura, texto in bloques]},
+                          ensure_ascii=False)
+    texto = re.search(r'Texto de la factura:\s*\n\s*---\n(.*)\n\s*---', prompt, re.DOTALL)
+    return json.dumps(extraer_campos(texto.group(1) if texto else prompt), ensure_ascii=False)
+
+
+class ServidorOpenAISimulado(ThreadingHTTPServer):
+    """
+    Servidor HTTP con la configuración de latencia y errores, y contadores de
+    solicitudes y errores simulados que pueden consultarse al terminar.
+    """
+    daemon_threads = True
+
+    def __init__(self, direccion, latencia_ms=LATENCIA_MS, variacion_latencia_ms=VARIACION_LATENCIA_MS,
+                 tasa_errores=0.0, espera_reintento_ms=ESPERA_REINTENTO_MS, semilla=None):
+        super().__init__(direccion, ManejadorOpenAISimulado)
+        self.latencia_ms = latencia_ms
+        self.variacion_latencia_ms = variacion_latencia_ms
+        self.tasa_errores = tasa_errores
+        self.espera_reintento_ms = espera_reintento_ms
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.solicitudes = 0
+        self.errores_simulados = 0
+        self.tokens_prompt = 0
+
+    @property
+    def url_base(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def sortear(self):
+        """
+        Registra una solicitud y retorna (segundos de latencia, código de error o None).
+        """
+        with self._lock:
+            self.solicitudes += 1
+            latencia = max(0.0, self._aleatorio.gauss(self.latencia_ms, self.variacion_latencia_ms)) / 1000
+            error = None
+            if self._aleatorio.random() < self.tasa_errores:
+                self.errores_simulados += 1
+                error = self._aleatorio.choice((429, 500))
+            return latencia, error
+
+    def resumen(self):
+        return {'solicitudes': self.solicitudes, 'errores_simulados': self.errores_simulados,
+                'tokens_prompt': self.tokens_prompt}
+
+
+class ManejadorOpenAISimulado(BaseHTTPRequestHandler):
+    """
+    Atiende POST /v1/chat/completions con una respuesta compatible con la API.
+    """
+
+    def do_POST(self):
+        if self.path.rstrip('/') != RUTA_CHAT:
+            self._enviar_json(404, {'error': {'message': f"Ruta desconocida: {self.path}"}})
+            return
+        try:
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            prompt = cuerpo['messages'][-1]['content']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self._enviar_json(400, {'error': {'message': f"Solicitud inválida: {e}"}})
+            return
+
+        latencia, error = self.server.sortear()
+        time.sleep(latencia)
+        if error == 429:
+            self._enviar_json(429, {'error': {'message': "Rate limit simulado", 'type': 'rate_limit_exceeded'}},
+                              {'retry-after-ms': str(self.server.espera_reintento_ms)})
+            return
+        if error == 500:
+            self._enviar_json(500, {'error': {'message': "Error simulado del servidor", 'type': 'server_error'}},
+                              {'retry-after-ms': str(self.server.espera_reintento_ms)})
+            return
+
+        contenido = responder_prompt(prompt)
+        tokens_prompt = len(prompt) // CARACTERES_POR_TOKEN + 1
+        tokens_respuesta = len(contenido) // CARACTERES_POR_TOKEN + 1
+        with self.server._lock:
+            self.server.tokens_prompt += tokens_prompt
+        self._enviar_json(200, {
+            'id': f"chatcmpl-simulado-{self.server.solicitudes}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': cuerpo.get('model', 'simulado'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': contenido}}],
+            'usage': {'prompt_tokens': tokens_prompt, 'completion_tokens': tokens_respuesta,
+                      'total_tokens': tokens_prompt + tokens_respuesta},
+        })
+
+    def _enviar_json(self, estado, datos, cabeceras=None):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass # Sin una línea por solicitud
+
+
+def iniciar_en_segundo_plano(host=HOST_SERVIDOR, puerto=0, **opciones):
+    """
+    Inicia el servidor en un hilo (con puerto 0 se elige uno libre) y lo retorna.
+    Se detiene con servidor.shutdown().
+    """
+    servidor = ServidorOpenAISimulado((host, puerto), **opciones)
+    threading.Thread(target=servidor.serve_forever, name="openai-simulado", daemon=True).start()
+    return servidor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que simula la API de OpenAI para los benchmarks.")
+    parser.add_argument("--host", default=HOST_SERVIDOR, help=f"Dirección del servidor (por defecto: {HOST_SERVIDOR}).")
+    parser.add_argument("--puerto", type=int, default=PUERTO_SERVIDOR, help=f"Puerto (por defecto: {PUERTO_SERVIDOR}).")
+    parser.add_argument("--latencia-ms", type=float, default=LATENCIA_MS,
+                        help=f"Latencia media de cada respuesta (por defecto: {LATENCIA_MS}).")
+    parser.add_argument("--variacion-latencia-ms", type=float, default=VARIACION_LATENCIA_MS,
+                        help=f"Desviación estándar de la latencia (por defecto: {VARIACION_LATENCIA_MS}).")
+    parser.add_argument("--tasa-errores", type=float, default=0.0,
+                        help="Fracción de solicitudes que responden 429 o 500 (por defecto: 0).")
+    parser.add_argument("--espera-reintento-ms", type=int, default=ESPERA_REINTENTO_MS,
+                        help=f"Valor de retry-after-ms en los errores (por defecto: {ESPERA_REINTENTO_MS}).")
+    args = parser.parse_args(argv)
+    if not 0 <= args.tasa_errores <= 1:
+        print("Error: La tasa de errores debe estar entre 0 y 1.")
+        sys.exit(1)
+
+    servidor = ServidorOpenAISimulado((args.host, args.puerto), args.latencia_ms, args.variacion_latencia_ms,
+                                      args.tasa_errores, args.espera_reintento_ms)
+    print(f"API de OpenAI simulada en {servidor.url_base} (Ctrl+C para detener).")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nServidor detenido. {servidor.resumen()}")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Reemplazo del ejecutable de Tesseract para los benchmarks: acepta los mismos
+argumentos que usa pytesseract, espera una latencia configurable (variable de
+entorno TESSERACT_SIMULADO_LATENCIA_MS) y escribe un texto de factura cuyo
+número y montos dependen del contenido de la imagen, para que cada página
+escaneada produzca un texto distinto.
+
+ejecutar_benchmarks.py lo usa a través de un envoltorio ejecutable llamado
+'tesseract'; para usarlo a mano (en sistemas tipo Unix):
+    printf '#!/bin/sh\\nexec python3 %s "$@"\\n' "$PWD/benchmarks/tesseract_simulado.py" > /tmp/bin/tesseract
+    chmod +x /tmp/bin/tesseract && PATH=/tmp/bin:$PATH python procesar_facturas.py
+"""
+import os
+import sys
+import time
+import hashlib
+
+
+# Latencia por página, en milisegundos, si no se indica en el entorno
+LATENCIA_MS = 300
+
+# Versión que se informa con --version (pytesseract la consulta)
+VERSION = "tesseract 5.3.0 (simulado)"
+
+
+def texto_para_imagen(ruta_imagen):
+    """
+    Retorna un texto de factura determinista a partir del hash de la imagen.
+    """
+    with open(ruta_imagen, 'rb') as archivo:
+        resumen = hashlib.sha256(archivo.read()).hexdigest()
+    numero = int(resumen[:8], 16)
+    subtotal = numero % 100000 + (numero % 100) / 100
+    impuestos = round(subtotal * 0.21, 2)
+    return (f"FACTURA  B\n"
+            f"Razón Social: Proveedor Escaneado {numero % 7} S.A.\n"
+            f"CUIT 30-7{numero % 10000000:07d}-1\n"
+            f"Punto de Venta: {numero % 20 + 1:05d}   Comp. Nro: {numero % 100000000:08d}\n"
+            f"Fecha de Emisión: {numero % 28 + 1:02d}/{numero % 12 + 1:02d}/2024\n"
+            f"Apellido y Nombre / Razón Social: Cliente {numero % 13}\n"
+            f"Subtotal: $ {subtotal:.2f}\n"
+            f"IVA 21%: $ {impuestos:.2f}\n"
+            f"Importe Total: $ {subtotal + impuestos:.2f}\n")
+
+
+def main(argv):
+    if '--version' in argv or '-v' in argv:
+        print(VERSION)
+        return 0
+    if '--list-langs' in argv:
+        print("List of available languages (2):\neng\nspa")
+        return 0
+    if len(argv) < 2:
+        print("Uso: tesseract imagen salida [opciones...]", file=sys.stderr)
+        return 1
+
+    time.sleep(float(os.environ.get('TESSERACT_SIMULADO_LATENCIA_MS', LATENCIA_MS)) / 1000)
+    texto = texto_para_imagen(argv[0])
+    if argv[1] == 'stdout':
+        sys.stdout.write(texto)
+    else:
+        with open(argv[1] + '.txt', 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
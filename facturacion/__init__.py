@@ -0,0 +1,22 @@
+"""
+Procesamiento de facturas PDF: extrae el texto (con OCR si hace falta), obtiene
+los datos clave con OpenAI o con plantillas por proveedor y los guarda en SQLite.
+
+Uso: python -m facturacion [opciones] (ver facturacion/cli.py).
+
+Módulos:
+    configuracion  Valores por defecto (rutas, modelo, OCR, pipeline...).
+    registro       Registro de mensajes y métricas.
+    normalizacion  Normalización de montos, fechas, monedas y proveedores.
+    base_datos     Esquema SQLite, planificación por hash y escritura por bloques.
+    duplicados     Detección de facturas duplicadas (claves de bloqueo y MinHash).
+    extraccion     Texto nativo y OCR de los PDFs, página a página y con límites por documento.
+    llm            Prompts, caché y llamadas a OpenAI.
+    plantillas     Extracción local con plantillas por proveedor.
+    pipeline       Pipeline por etapas y modo vigilancia.
+    cli            Argumentos de línea de comandos y función principal.
+    exportacion    Exportación a Parquet, Arrow o CSV (python -m facturacion.exportacion).
+
+Las bibliotecas pesadas (PyMuPDF, pdfplumber, Pillow, pytesseract, openai y
+python-dotenv) se importan solo en la etapa que las usa.
+"""
@@ -0,0 +1,7 @@
+"""
+Permite ejecutar el procesamiento con 'python -m facturacion'.
+"""
+from .cli import main
+
+if __name__ == "__main__":
+    main()
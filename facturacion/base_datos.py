@@ -0,0 +1,883 @@
+"""
+Base de datos SQLite: esquema y migraciones, planificación de los archivos a
+procesar por hash y escritura por bloques (EscritorSQLite), con la detección de
+duplicados de cada factura guardada.
+"""
+import os
+import re
+import json
+import math
+import time
+import decimal
+import hashlib
+import sqlite3
+import logging
+import datetime
+import unicodedata
+
+from .configuracion import CACHE_SQLITE_KB, CARPETA_FACTURAS, FILAS_POR_BLOQUE, SEGUNDOS_POR_BLOQUE
+from .registro import METRICAS
+from .normalizacion import (a_centavos, normalizar_fecha, normalizar_moneda, normalizar_numero_factura,
+                            normalizar_proveedor)
+from .duplicados import detectar_duplicados, firma_texto
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['VERSION_ESQUEMA', 'TABLAS_RESUMEN', 'MIGRACIONES_ESQUEMA', 'migrar_esquema',
+           'configurar_base_datos', 'calcular_hash_archivo', 'obtener_hash_archivo', 'resumen_trabajos',
+           'planificar_archivos', 'SQL_GUARDAR_DOCUMENTO', 'SQL_REGISTRAR_PROVEEDOR',
+           'SQL_INSERTAR_FACTURA', 'guardar_documento', 'insertar_en_sqlite', 'SQL_ACTUALIZAR_TRABAJO',
+           'EscritorSQLite']
+
+
+# Paso 2: Configuración de la Base de Datos
+
+# Versión del esquema que espera este script. Se guarda en 'PRAGMA user_version'
+# y configurar_base_datos aplica en orden las migraciones pendientes.
+VERSION_ESQUEMA = 11
+
+
+# Conversión de las filas de la versión 0 a la 1, congelada tal como era al crear
+# esa migración: no usa las funciones de normalizacion.py, que pueden cambiar. Si
+# cambian, una migración nueva recalcula las columnas afectadas (como la versión 8).
+_MESES_V1 = {'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+             'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12}
+_FORMATOS_FECHA_V1 = ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d-%m-%y', '%d/%m/%y', '%d.%m.%y')
+
+
+def _fecha_v1(valor):
+    # Fecha ISO, o None si no se puede interpretar
+    texto = " ".join(str(valor or "").split()).lower()
+    if not texto:
+        return None
+    coincidencia = re.fullmatch(r'(\d{1,2})\s+de\s+([a-záéíóú]+)\s+(?:del?\s+)?(\d{4})', texto)
+    if coincidencia:
+        mes = _MESES_V1.get(coincidencia.group(2))
+        try:
+            return datetime.date(int(coincidencia.group(3)), mes, int(coincidencia.group(1))).isoformat() if mes else None
+        except ValueError:
+            return None
+    for formato in _FORMATOS_FECHA_V1:
+        try:
+            return datetime.datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _clave_proveedor_v1(nombre):
+    # Sin acentos, en minúsculas, sin puntos ni signos y con los espacios colapsados
+    descompuesto = unicodedata.normalize('NFKD', str(nombre or ""))
+    sin_acentos = "".join(caracter for caracter in descompuesto if not unicodedata.combining(caracter))
+    return " ".join(re.sub(r'[\W_]+', ' ', sin_acentos.casefold().replace('.', '')).split()) or None
+
+
+def _fila_factura_v1(id_factura, fecha_procesamiento, nombre_archivo, numero_factura, fecha_emision,
+                     proveedor, cliente, total, hash_contenido):
+    """
+    Convierte una fila de 'facturas' de la versión 0 (total REAL, fecha en texto libre)
+    a los valores de 'facturas_v1', más la clave del proveedor para buscar su id.
+    La versión 0 guardaba el total como número redondeado a centavos, o NULL.
+    """
+    fecha_iso = _fecha_v1(fecha_emision)
+    if fecha_emision and fecha_iso is None:
+        log.warning(f"Fecha de emisión no válida en {nombre_archivo}: '{fecha_emision}'. Se guarda sin fecha.")
+    proveedor = (proveedor or "").strip() or None
+    total_centavos = None
+    if isinstance(total, (int, float)):
+        total_centavos = int((decimal.Decimal(str(total)) * 100).quantize(decimal.Decimal(1),
+                                                                         rounding=decimal.ROUND_HALF_UP))
+    return (id_factura, fecha_procesamiento, nombre_archivo, numero_factura, fecha_iso, proveedor,
+            _clave_proveedor_v1(proveedor), cliente, total_centavos, hash_contenido)
+
+
+def _migrar_esquema_v1(cursor):
+    """
+    Versión 1: esquema tipado de 'facturas'. Fechas ISO validadas, importes en
+    centavos enteros, moneda e impuestos, y proveedores normalizados en su propia
+    tabla. Reconstruye la tabla convirtiendo las filas existentes con _fila_factura_v1;
+    las fechas que no se pueden interpretar quedan en NULL.
+    """
+    cursor.execute('''
+        CREATE TABLE proveedores (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,                    -- Nombre tal como apareció la primera vez
+            nombre_normalizado TEXT NOT NULL UNIQUE  -- Ver normalizar_proveedor
+        )
+    ''')
+
+    # SQLite no permite cambiar el tipo de una columna: se crea la tabla nueva y se copian los datos
+    cursor.execute('''
+        CREATE TABLE facturas_v1 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre_archivo TEXT UNIQUE,
+            numero_factura TEXT,
+            fecha_emision TEXT               -- YYYY-MM-DD ('+0 days' normaliza días inexistentes como el 30 de febrero)
+                CHECK (fecha_emision IS NULL OR date(fecha_emision, '+0 days') IS fecha_emision),
+            proveedor TEXT,                  -- Nombre del proveedor tal como figura en la factura
+            proveedor_id INTEGER REFERENCES proveedores (id),
+            cliente TEXT,
+            total_centavos INTEGER CHECK (typeof(total_centavos) IN ('integer', 'null')),
+            impuestos_centavos INTEGER CHECK (typeof(impuestos_centavos) IN ('integer', 'null')),
+            moneda TEXT CHECK (moneda IS NULL OR (length(moneda) = 3 AND moneda = upper(moneda))), -- ISO 4217
+            total REAL GENERATED ALWAYS AS (total_centavos / 100.0) VIRTUAL, -- Compatibilidad con lectores anteriores
+            hash_contenido TEXT,
+            fecha_procesamiento DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    filas = [_fila_factura_v1(*fila) for fila in cursor.execute('''
+        SELECT id, fecha_procesamiento, nombre_archivo, numero_factura, fecha_emision, proveedor,
+               cliente, total, hash_contenido
+        FROM facturas
+    ''').fetchall()]
+
+    cursor.executemany("INSERT INTO proveedores (nombre, nombre_normalizado) VALUES (?, ?) "
+                       "ON CONFLICT(nombre_normalizado) DO NOTHING",
+                       [(fila[5], fila[6]) for fila in filas if fila[6]])
+    cursor.executemany('''
+        INSERT INTO facturas_v1 (id, fecha_procesamiento, nombre_archivo, numero_factura, fecha_emision,
+                                 proveedor, proveedor_id, cliente, total_centavos, hash_contenido)
+        VALUES (?, ?, ?, ?, ?, ?, (SELECT id FROM proveedores WHERE nombre_normalizado = ?), ?, ?, ?)
+    ''', filas)
+
+    cursor.execute("DROP TABLE facturas")
+    cursor.execute("ALTER TABLE facturas_v1 RENAME TO facturas")
+    cursor.execute("CREATE INDEX idx_facturas_hash ON facturas (hash_contenido)")
+    cursor.execute("CREATE INDEX idx_facturas_proveedor_fecha ON facturas (proveedor, fecha_emision)")
+    cursor.execute("CREATE INDEX idx_facturas_numero ON facturas (numero_factura)")
+    cursor.execute("CREATE INDEX idx_facturas_cliente ON facturas (cliente)")
+    log.info(f"{len(filas)} facturas convertidas al esquema tipado.")
+
+
+def _migrar_esquema_v2(cursor):
+    """
+    Versión 2: índices sin distinción de mayúsculas para la búsqueda por prefijo
+    del reporte servido (generar_reporte_html.py --servir). Con ellos, SQLite
+    resuelve "columna LIKE 'texto%'" recorriendo solo el rango del índice.
+    """
+    for columna in ('nombre_archivo', 'numero_factura', 'proveedor', 'cliente'):
+        cursor.execute(f"CREATE INDEX idx_facturas_busqueda_{columna} ON facturas ({columna} COLLATE NOCASE)")
+
+
+# Tablas de resumen que mantienen los triggers de 'facturas': nombre -> columnas
+# de agrupación con la expresión que las calcula a partir de la fila ({fila} es
+# NEW u OLD). Los importes se suman por moneda para no mezclar divisas.
+TABLAS_RESUMEN = {
+    'resumen_proveedor_mes': (('proveedor_id', "IFNULL({fila}.proveedor_id, 0)"),
+                              ('mes', "IFNULL(substr({fila}.fecha_emision, 1, 7), '')"),
+                              ('moneda', "IFNULL({fila}.moneda, '')")),
+    'resumen_cliente_mes': (('cliente', "IFNULL({fila}.cliente, '')"),
+                            ('mes', "IFNULL(substr({fila}.fecha_emision, 1, 7), '')"),
+                            ('moneda', "IFNULL({fila}.moneda, '')")),
+    'resumen_diario': (('fecha', "IFNULL({fila}.fecha_emision, '')"),
+                       ('moneda', "IFNULL({fila}.moneda, '')")),
+}
+
+
+def _sql_acumular_resumen(tabla, columnas, fila, signo):
+    # Suma (signo '+') o resta (signo '-') la fila NEW u OLD en su grupo de 'tabla'
+    claves = ", ".join(nombre for nombre, _ in columnas)
+    valores = ", ".join(expresion.format(fila=fila) for _, expresion in columnas)
+    sql = f'''
+        INSERT INTO {tabla} ({claves}, cantidad, total_centavos, impuestos_centavos)
+        VALUES ({valores}, {signo}1, {signo}IFNULL({fila}.total_centavos, 0), {signo}IFNULL({fila}.impuestos_centavos, 0))
+        ON CONFLICT({claves}) DO UPDATE SET
+            cantidad = cantidad + excluded.cantidad,
+            total_centavos = total_centavos + excluded.total_centavos,
+            impuestos_centavos = impuestos_centavos + excluded.impuestos_centavos;
+    '''
+    if signo == '-':
+        # Los grupos que se quedan sin facturas se eliminan
+        condicion = " AND ".join(f"{nombre} = {expresion.format(fila=fila)}" for nombre, expresion in columnas)
+        sql += f"DELETE FROM {tabla} WHERE {condicion} AND cantidad = 0;\n"
+    return sql
+
+
+def _migrar_esquema_v3(cursor):
+    """
+    Versión 3: tablas de resumen por proveedor y mes, por cliente y mes, y por día,
+    para que el reporte muestre totales sin recorrer todas las facturas. Triggers
+    sobre 'facturas' las actualizan en cada inserción, actualización o borrado.
+    """
+    for tabla, columnas in TABLAS_RESUMEN.items():
+        definicion_claves = ", ".join(f"{nombre} {'INTEGER' if nombre == 'proveedor_id' else 'TEXT'} NOT NULL"
+                                      for nombre, _ in columnas)
+        claves = ", ".join(nombre for nombre, _ in columnas)
+        cursor.execute(f'''
+            CREATE TABLE {tabla} (
+                {definicion_claves},
+                cantidad INTEGER NOT NULL,
+                total_centavos INTEGER NOT NULL,
+                impuestos_centavos INTEGER NOT NULL,
+                PRIMARY KEY ({claves})
+            )
+        ''')
+
+        # Carga inicial con las facturas ya guardadas
+        expresiones = ", ".join(expresion.format(fila='facturas') for _, expresion in columnas)
+        cursor.execute(f'''
+            INSERT INTO {tabla} ({claves}, cantidad, total_centavos, impuestos_centavos)
+            SELECT {expresiones}, COUNT(*), IFNULL(SUM(total_centavos), 0), IFNULL(SUM(impuestos_centavos), 0)
+            FROM facturas GROUP BY {expresiones}
+        ''')
+
+        cursor.execute(f'''
+            CREATE TRIGGER {tabla}_insertar AFTER INSERT ON facturas BEGIN
+                {_sql_acumular_resumen(tabla, columnas, 'NEW', '+')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {tabla}_borrar AFTER DELETE ON facturas BEGIN
+                {_sql_acumular_resumen(tabla, columnas, 'OLD', '-')}
+            END
+        ''')
+        # También se dispara con el 'ON CONFLICT ... DO UPDATE' de SQL_INSERTAR_FACTURA
+        cursor.execute(f'''
+            CREATE TRIGGER {tabla}_actualizar
+            AFTER UPDATE OF proveedor_id, cliente, fecha_emision, moneda, total_centavos, impuestos_centavos
+            ON facturas BEGIN
+                {_sql_acumular_resumen(tabla, columnas, 'OLD', '-')}
+                {_sql_acumular_resumen(tabla, columnas, 'NEW', '+')}
+            END
+        ''')
+
+
+def _migrar_esquema_v4(cursor):
+    """
+    Versión 4: cola persistente del modo vigilancia (--vigilar), con los archivos
+    detectados que todavía no terminaron de procesarse.
+    """
+    cursor.execute('''
+        CREATE TABLE cola_vigilancia (
+            nombre_archivo TEXT PRIMARY KEY,
+            fecha_deteccion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migrar_esquema_v5(cursor):
+    """
+    Versión 5: tabla 'trabajos' con el estado de cada archivo en el pipeline, para
+    retomar una ejecución interrumpida desde la última etapa completada:
+    'en_cola' -> 'texto_extraido' -> 'llm_completado' -> 'guardado', o 'fallido'
+    con el error. Las facturas ya guardadas se registran como 'guardado'.
+    """
+    cursor.execute('''
+        CREATE TABLE trabajos (
+            nombre_archivo TEXT PRIMARY KEY,
+            hash_contenido TEXT NOT NULL,     -- Contenido al que corresponde el estado
+            estado TEXT NOT NULL
+                CHECK (estado IN ('en_cola', 'texto_extraido', 'llm_completado', 'guardado', 'fallido')),
+            error TEXT,                       -- Motivo del último fallo
+            intentos INTEGER NOT NULL DEFAULT 0,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX idx_trabajos_estado ON trabajos (estado)")
+    cursor.execute('''
+        INSERT INTO trabajos (nombre_archivo, hash_contenido, estado, intentos)
+        SELECT nombre_archivo, hash_contenido, 'guardado', 1 FROM facturas
+        WHERE nombre_archivo IS NOT NULL AND hash_contenido IS NOT NULL
+    ''')
+
+
+def _migrar_esquema_v6(cursor):
+    """
+    Versión 6: índice por fecha de procesamiento, para que las exportaciones
+    incrementales (facturacion/exportacion.py) lean solo las filas nuevas.
+    """
+    cursor.execute("CREATE INDEX idx_facturas_fecha_procesamiento ON facturas (fecha_procesamiento)")
+
+
+def _migrar_esquema_v7(cursor):
+    """
+    Versión 7: detección de facturas duplicadas (ver facturacion/duplicados.py).
+    Número de factura normalizado, índices para las dos claves de bloqueo, firma
+    MinHash del texto de cada documento y tabla de posibles duplicados. Las firmas
+    de los documentos ya guardados se calculan cuando se necesitan.
+    """
+    cursor.execute("ALTER TABLE facturas ADD COLUMN numero_normalizado TEXT")
+    cursor.executemany("UPDATE facturas SET numero_normalizado = ? WHERE id = ?", [
+        (normalizar_numero_factura(numero), id_factura) for id_factura, numero
+        in cursor.execute("SELECT id, numero_factura FROM facturas WHERE numero_factura IS NOT NULL").fetchall()])
+    cursor.execute("CREATE INDEX idx_facturas_proveedor_numero ON facturas (proveedor_id, numero_normalizado)")
+    cursor.execute("CREATE INDEX idx_facturas_proveedor_total_fecha "
+                   "ON facturas (proveedor_id, total_centavos, fecha_emision)")
+    cursor.execute("ALTER TABLE documentos ADD COLUMN firma_texto BLOB")
+    cursor.execute('''
+        CREATE TABLE posibles_duplicados (
+            factura_id INTEGER NOT NULL,   -- Factura guardada después (facturas.id)
+            original_id INTEGER NOT NULL,  -- Factura guardada antes con la que coincide
+            motivo TEXT NOT NULL CHECK (motivo IN ('numero', 'importe_fecha')), -- Clave de bloqueo que coincidió
+            similitud REAL,                -- Similitud estimada de los textos (0 a 1), NULL si falta alguno
+            fecha_deteccion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (factura_id, original_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX idx_posibles_duplicados_original ON posibles_duplicados (original_id)")
+
+
+def _migrar_esquema_v8(cursor):
+    """
+    Versión 8: los números normalizados separan sus grupos con '-' (antes se
+    unían, y '1 12345' y '11-2345' coincidían). Se recalculan y se descartan los
+    posibles duplicados por número que ya no coinciden, o que sin similitud de
+    texto tienen distinto total.
+    """
+    cursor.executemany("UPDATE facturas SET numero_normalizado = ? WHERE id = ?", [
+        (normalizar_numero_factura(numero), id_factura) for id_factura, numero
+        in cursor.execute("SELECT id, numero_factura FROM facturas WHERE numero_factura IS NOT NULL").fetchall()])
+    cursor.execute('''
+        DELETE FROM posibles_duplicados WHERE motivo = 'numero' AND EXISTS (
+            SELECT 1 FROM facturas f JOIN facturas o ON o.id = posibles_duplicados.original_id
+            WHERE f.id = posibles_duplicados.factura_id
+              AND (f.numero_normalizado IS NOT o.numero_normalizado
+                   OR (posibles_duplicados.similitud IS NULL
+                       AND (f.total_centavos IS NULL OR f.total_centavos IS NOT o.total_centavos))))
+    ''')
+
+
+def _migrar_esquema_v9(cursor):
+    """
+    Versión 9: estado 'reintentable' en 'trabajos' para los archivos cuya solicitud
+    a OpenAI agotó los reintentos por un error transitorio (429, timeout, 5xx):
+    se vuelven a procesar en la próxima ejecución hasta MAX_INTENTOS_TRANSITORIOS.
+    """
+    # SQLite no permite cambiar una restricción CHECK: se crea la tabla nueva y se copian los datos
+    cursor.execute('''
+        CREATE TABLE trabajos_v9 (
+            nombre_archivo TEXT PRIMARY KEY,
+            hash_contenido TEXT NOT NULL,     -- Contenido al que corresponde el estado
+            estado TEXT NOT NULL
+                CHECK (estado IN ('en_cola', 'texto_extraido', 'llm_completado', 'guardado',
+                                  'reintentable', 'fallido')),
+            error TEXT,                       -- Motivo del último fallo
+            intentos INTEGER NOT NULL DEFAULT 0,
+            fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("INSERT INTO trabajos_v9 SELECT nombre_archivo, hash_contenido, estado, error, intentos, "
+                   "fecha_actualizacion FROM trabajos")
+    cursor.execute("DROP TABLE trabajos")
+    cursor.execute("ALTER TABLE trabajos_v9 RENAME TO trabajos")
+    cursor.execute("CREATE INDEX idx_trabajos_estado ON trabajos (estado)")
+
+
+def _migrar_esquema_v10(cursor):
+    """
+    Versión 10: momento (UTC) a partir del cual se puede volver a procesar un
+    archivo 'reintentable', para espaciar los intentos tras un error transitorio.
+    """
+    cursor.execute("ALTER TABLE trabajos ADD COLUMN reintentar_desde DATETIME")
+
+
+def _migrar_esquema_v11(cursor):
+    """
+    Versión 11: origen de los datos de cada documento ('llm' o 'plantilla'), para
+    que --aprender-plantillas aprenda solo de respuestas del LLM. Si todavía no hay
+    plantillas, los datos ya guardados solo pueden venir del LLM; si no, su origen
+    queda desconocido (NULL) y no se usan para aprender.
+    """
+    cursor.execute("ALTER TABLE documentos ADD COLUMN origen_datos TEXT "
+                   "CHECK (origen_datos IN ('llm', 'plantilla'))")
+    if cursor.execute("SELECT COUNT(*) FROM plantillas_proveedor").fetchone()[0] == 0:
+        cursor.execute("UPDATE documentos SET origen_datos = 'llm' WHERE datos_json IS NOT NULL")
+
+
+# Migraciones por versión de destino
+MIGRACIONES_ESQUEMA = {
+    1: _migrar_esquema_v1,
+    2: _migrar_esquema_v2,
+    3: _migrar_esquema_v3,
+    4: _migrar_esquema_v4,
+    5: _migrar_esquema_v5,
+    6: _migrar_esquema_v6,
+    7: _migrar_esquema_v7,
+    8: _migrar_esquema_v8,
+    9: _migrar_esquema_v9,
+    10: _migrar_esquema_v10,
+    11: _migrar_esquema_v11,
+}
+
+
+def migrar_esquema(conn, cursor):
+    """
+    Lleva la base de datos a VERSION_ESQUEMA aplicando, cada una en su propia
+    transacción, las migraciones pendientes. Si una falla, la base queda en la
+    última versión completa y se propaga el error.
+    """
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version > VERSION_ESQUEMA:
+        raise RuntimeError(f"La base de datos tiene el esquema versión {version}, "
+                           f"más nuevo que el que admite este script ({VERSION_ESQUEMA}).")
+
+    for destino in range(version + 1, VERSION_ESQUEMA + 1):
+        log.info(f"Migrando la base de datos al esquema versión {destino}...")
+        cursor.execute("BEGIN") # Sin BEGIN explícito, sqlite3 confirmaría cada CREATE/DROP por separado
+        try:
+            MIGRACIONES_ESQUEMA[destino](cursor)
+            cursor.execute(f"PRAGMA user_version = {destino}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def configurar_base_datos(nombre_bd):
+    """
+    Configura la conexión a la base de datos SQLite y crea la tabla 'facturas' si no existe.
+    Retorna el objeto de conexión y el cursor, o None si falla.
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(nombre_bd)
+        cursor = conn.cursor()
+        log.info(f"Conectado a la base de datos: {nombre_bd}")
+
+        # WAL permite que otros procesos (como generar_reporte_html.py) lean la base
+        # mientras se insertan facturas. Con WAL, 'synchronous=NORMAL' sigue siendo
+        # seguro ante caídas del proceso y evita sincronizar el disco en cada commit.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{CACHE_SQLITE_KB}")
+
+        # Crea la tabla 'facturas' si no existe, con el esquema original (versión 0).
+        # migrar_esquema la lleva luego al esquema tipado actual.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS facturas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, -- ID único para cada registro
+                nombre_archivo TEXT UNIQUE, -- Nombre del archivo original, UNIQUE para evitar duplicados
+                numero_factura TEXT,        -- Número de factura (texto, ya que puede contener letras/caracteres)
+                fecha_emision TEXT,         -- Fecha de emisión (texto, idealmente YYYY-MM-DD)
+                proveedor TEXT,             -- Nombre del proveedor
+                cliente TEXT,               -- Nombre del cliente
+                total REAL,                 -- Monto total (REAL para números decimales)
+                fecha_procesamiento DATETIME DEFAULT CURRENT_TIMESTAMP -- Marca de tiempo de cuándo se procesó
+                -- Puedes añadir más columnas aquí según los datos que extraigas (ej: direccion_proveedor, impuestos, etc.)
+            )
+        ''')
+
+        # Columna con el hash SHA-256 del PDF (se añade si la tabla es de una versión anterior)
+        columnas = [fila[1] for fila in cursor.execute("PRAGMA table_info(facturas)")]
+        if 'hash_contenido' not in columnas:
+            cursor.execute("ALTER TABLE facturas ADD COLUMN hash_contenido TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_facturas_hash ON facturas (hash_contenido)")
+
+        # Texto extraído y respuesta del LLM por contenido del PDF, para que
+        # renombrar o reprocesar un archivo no repita el OCR ni la llamada a OpenAI.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS documentos (
+                hash_contenido TEXT PRIMARY KEY, -- SHA-256 del PDF
+                texto TEXT,                      -- Texto extraído (nativo u OCR)
+                datos_json TEXT,                 -- Datos extraídos (LLM o plantilla), en JSON
+                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Último tamaño/fecha de modificación conocidos de cada archivo. Si no
+        # cambiaron, se reutiliza el hash guardado sin volver a leer el PDF.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archivos_vistos (
+                nombre_archivo TEXT PRIMARY KEY,
+                tamano INTEGER,
+                mtime REAL,
+                hash_contenido TEXT
+            )
+        ''')
+
+        # Plantillas de extracción local por proveedor, aprendidas de resultados del LLM
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plantillas_proveedor (
+                proveedor TEXT PRIMARY KEY,     -- Nombre del proveedor tal como lo devolvió el LLM
+                patrones_json TEXT NOT NULL,    -- Expresiones regulares por campo, en JSON
+                aciertos INTEGER DEFAULT 0,     -- Veces que la plantilla coincidió con el LLM
+                fallos INTEGER DEFAULT 0,       -- Veces que no coincidió
+                fecha_actualizacion DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Guardar los cambios en la estructura de la base de datos
+        conn.commit()
+        migrar_esquema(conn, cursor)
+        log.info("Tabla 'facturas' verificada/creada.")
+        return conn, cursor
+    except Exception as e:
+        log.error(f"Error al conectar o crear la base de datos: {e}")
+        if conn:
+            conn.close()
+        return None, None
+
+
+
+# Paso 3: Funciones de Procesamiento
+
+def calcular_hash_archivo(ruta_archivo, tamano_bloque=1024 * 1024):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques.
+    """
+    sha256 = hashlib.sha256()
+    with open(ruta_archivo, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            sha256.update(bloque)
+    return sha256.hexdigest()
+
+
+def obtener_hash_archivo(cursor, nombre_archivo, ruta_archivo):
+    """
+    Retorna el hash SHA-256 de un archivo. Si su tamaño y fecha de modificación
+    coinciden con los registrados en 'archivos_vistos', reutiliza el hash guardado
+    sin leer el archivo.
+    """
+    estado = os.stat(ruta_archivo)
+    cursor.execute("SELECT tamano, mtime, hash_contenido FROM archivos_vistos WHERE nombre_archivo = ?",
+                   (nombre_archivo,))
+    fila = cursor.fetchone()
+    if fila and fila[0] == estado.st_size and fila[1] == estado.st_mtime:
+        return fila[2]
+
+    hash_contenido = calcular_hash_archivo(ruta_archivo)
+    cursor.execute('''
+        INSERT OR REPLACE INTO archivos_vistos (nombre_archivo, tamano, mtime, hash_contenido)
+        VALUES (?, ?, ?, ?)
+    ''', (nombre_archivo, estado.st_size, estado.st_mtime, hash_contenido))
+    return hash_contenido
+
+
+def resumen_trabajos(cursor):
+    """
+    Retorna un texto con cuántos archivos hay en cada estado de la tabla 'trabajos'.
+    """
+    cursor.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado ORDER BY estado")
+    conteos = ", ".join(f"{estado}: {cantidad}" for estado, cantidad in cursor.fetchall())
+    return f"Estado de los trabajos: {conteos or 'sin trabajos'}."
+
+
+def planificar_archivos(conn, cursor, lista_facturas_pdf, solo_fallidos=False, carpeta=CARPETA_FACTURAS):
+    """
+    Calcula el hash de cada PDF de 'carpeta' y descarta los que ya están en la
+    tabla 'facturas' (aunque tengan otro nombre), antes de gastar en OCR o en OpenAI.
+    También descarta los que fallaron en una ejecución anterior sin cambiar de
+    contenido; con 'solo_fallidos', en cambio, planifica únicamente esos. Los
+    'reintentable' se planifican cuando pasó su espera ('reintentar_desde').
+    Retorna una lista de diccionarios con los archivos a procesar, incluyendo el
+    texto y los datos ya guardados en 'documentos' para ese contenido, si existen,
+    y registra cada uno en 'trabajos' con la última etapa completada y el número
+    de intento ('intentos', que vuelve a 1 si cambió el contenido o si había fallado).
+    """
+    pendientes = []
+    hashes_vistos = set()
+    fallidos_omitidos = 0
+    en_espera = 0
+    retomados = {'texto_extraido': 0, 'llm_completado': 0}
+    for nombre_archivo in lista_facturas_pdf:
+        ruta_completa_archivo = os.path.join(carpeta, nombre_archivo)
+        try:
+            hash_contenido = obtener_hash_archivo(cursor, nombre_archivo, ruta_completa_archivo)
+        except OSError as e:
+            log.error(f"Error al leer {nombre_archivo} para calcular su hash: {e}. Saltando.")
+            continue
+
+        if hash_contenido in hashes_vistos:
+            log.warning(f"{nombre_archivo} tiene el mismo contenido que otro archivo de esta ejecución. Saltando.")
+            continue
+        hashes_vistos.add(hash_contenido)
+
+        cursor.execute("SELECT nombre_archivo FROM facturas WHERE hash_contenido = ? LIMIT 1", (hash_contenido,))
+        registrada = cursor.fetchone()
+        if registrada:
+            if registrada[0] != nombre_archivo:
+                log.warning(f"{nombre_archivo} ya fue procesado como {registrada[0]} (mismo contenido). Saltando.")
+            continue
+
+        # Filas de versiones anteriores (sin hash): se asume que corresponden al archivo
+        # actual y se completa el hash en lugar de volver a procesarlo.
+        cursor.execute("UPDATE facturas SET hash_contenido = ? WHERE nombre_archivo = ? AND hash_contenido IS NULL",
+                       (hash_contenido, nombre_archivo))
+        if cursor.rowcount:
+            continue
+
+        cursor.execute('''
+            SELECT hash_contenido, estado, intentos, reintentar_desde > CURRENT_TIMESTAMP
+            FROM trabajos WHERE nombre_archivo = ?
+        ''', (nombre_archivo,))
+        trabajo = cursor.fetchone()
+        mismo_contenido = trabajo is not None and trabajo[0] == hash_contenido
+        fallido = mismo_contenido and trabajo[1] == 'fallido'
+        if fallido != solo_fallidos:
+            fallidos_omitidos += fallido
+            continue
+        if mismo_contenido and trabajo[1] == 'reintentable' and trabajo[3]:
+            en_espera += 1 # Todavía no pasó la espera tras un error transitorio
+            continue
+
+        cursor.execute("SELECT texto, datos_json FROM documentos WHERE hash_contenido = ?", (hash_contenido,))
+        documento = cursor.fetchone()
+
+        # La etapa ya completada se deduce de lo guardado para este contenido
+        if documento and documento[1]:
+            estado = 'llm_completado'
+        elif documento and documento[0]:
+            estado = 'texto_extraido'
+        else:
+            estado = 'en_cola'
+        if estado in retomados and not fallido:
+            retomados[estado] += 1
+        # Con --reintentar-fallidos los intentos vuelven a empezar
+        intentos = trabajo[2] + 1 if mismo_contenido and not fallido else 1
+        cursor.execute('''
+            INSERT INTO trabajos (nombre_archivo, hash_contenido, estado, intentos) VALUES (?, ?, ?, ?)
+            ON CONFLICT(nombre_archivo) DO UPDATE SET
+                intentos = excluded.intentos, hash_contenido = excluded.hash_contenido,
+                estado = excluded.estado, error = NULL, reintentar_desde = NULL,
+                fecha_actualizacion = CURRENT_TIMESTAMP
+        ''', (nombre_archivo, hash_contenido, estado, intentos))
+
+        pendientes.append({
+            'nombre_archivo': nombre_archivo,
+            'ruta': ruta_completa_archivo,
+            'hash_contenido': hash_contenido,
+            'texto': documento[0] if documento else None,
+            'datos': json.loads(documento[1]) if documento and documento[1] else None,
+            'origen': 'bd' if documento and documento[1] else None, # De dónde vienen los datos
+            'intentos': intentos,
+        })
+
+    conn.commit()
+    if any(retomados.values()):
+        log.info(f"Se retoman archivos desde su última etapa: {retomados['texto_extraido']} con el texto ya extraído, "
+                 f"{retomados['llm_completado']} con los datos ya extraídos.")
+    if en_espera:
+        log.info(f"{en_espera} archivos esperan para reintentarse tras un error transitorio de OpenAI.")
+    if fallidos_omitidos:
+        log.warning(f"{fallidos_omitidos} archivos fallaron en ejecuciones anteriores y se omiten "
+                    f"(usa --reintentar-fallidos para volver a procesarlos).")
+    return pendientes
+
+
+SQL_GUARDAR_DOCUMENTO = '''
+    INSERT INTO documentos (hash_contenido, texto, datos_json, origen_datos, firma_texto) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(hash_contenido) DO UPDATE SET
+        texto = COALESCE(excluded.texto, texto),
+        datos_json = COALESCE(excluded.datos_json, datos_json),
+        origen_datos = COALESCE(excluded.origen_datos, origen_datos),
+        firma_texto = COALESCE(excluded.firma_texto, firma_texto),
+        fecha_actualizacion = CURRENT_TIMESTAMP
+'''
+
+SQL_REGISTRAR_PROVEEDOR = '''
+    INSERT INTO proveedores (nombre, nombre_normalizado) VALUES (?, ?)
+    ON CONFLICT(nombre_normalizado) DO NOTHING
+'''
+
+# Si ya existe una fila con el mismo nombre de archivo (el PDF fue modificado y
+# su hash no coincidió al planificar), se actualizan sus datos.
+SQL_INSERTAR_FACTURA = '''
+    INSERT INTO facturas (nombre_archivo, numero_factura, fecha_emision, proveedor, proveedor_id, cliente,
+                          total_centavos, impuestos_centavos, moneda, hash_contenido, numero_normalizado)
+    VALUES (?, ?, ?, ?, (SELECT id FROM proveedores WHERE nombre_normalizado = ?), ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(nombre_archivo) DO UPDATE SET
+        numero_factura = excluded.numero_factura, fecha_emision = excluded.fecha_emision,
+        proveedor = excluded.proveedor, proveedor_id = excluded.proveedor_id, cliente = excluded.cliente,
+        total_centavos = excluded.total_centavos, impuestos_centavos = excluded.impuestos_centavos,
+        moneda = excluded.moneda, hash_contenido = excluded.hash_contenido,
+        numero_normalizado = excluded.numero_normalizado, fecha_procesamiento = CURRENT_TIMESTAMP
+'''
+
+
+def _fila_documento(hash_contenido, texto, datos_extraidos, origen_datos=None):
+    """
+    Prepara los valores de SQL_GUARDAR_DOCUMENTO para un documento, con la firma
+    de su texto para la detección de duplicados. 'origen_datos' ('llm' o
+    'plantilla') es None si los datos no son nuevos, y conserva el guardado.
+    """
+    datos_json = json.dumps(datos_extraidos, ensure_ascii=False) if datos_extraidos else None
+    return (hash_contenido, texto, datos_json, origen_datos if datos_json else None, firma_texto(texto))
+
+
+def _fila_factura(nombre_archivo, datos_extraidos, hash_contenido):
+    """
+    Prepara los valores de SQL_INSERTAR_FACTURA para una factura: fecha en ISO
+    (o None si no es una fecha válida), importes en centavos, moneda ISO 4217 y
+    número normalizado (ver normalizar_numero_factura).
+    """
+    fecha_original = datos_extraidos.get('fecha_emision')
+    fecha_emision = normalizar_fecha(fecha_original)
+    if fecha_original and fecha_emision is None:
+        log.warning(f"Fecha de emisión no válida en {nombre_archivo}: '{fecha_original}'. Se guarda sin fecha.")
+
+    proveedor = (datos_extraidos.get('proveedor') or "").strip() or None
+    return (nombre_archivo,
+            datos_extraidos.get('numero_factura'),
+            fecha_emision,
+            proveedor,
+            normalizar_proveedor(proveedor), # Para buscar el proveedor_id
+            datos_extraidos.get('cliente'),
+            a_centavos(datos_extraidos.get('total')),
+            a_centavos(datos_extraidos.get('impuestos')),
+            normalizar_moneda(datos_extraidos.get('moneda')),
+            hash_contenido,
+            normalizar_numero_factura(datos_extraidos.get('numero_factura')))
+
+
+def _ejecutar_insercion_facturas(conexion, filas):
+    """
+    Registra los proveedores de 'filas' (ver _fila_factura), inserta las facturas
+    y busca sus posibles duplicados. 'conexion' puede ser una conexión o un cursor.
+    """
+    conexion.executemany(SQL_REGISTRAR_PROVEEDOR, [(fila[3], fila[4]) for fila in filas if fila[4]])
+    conexion.executemany(SQL_INSERTAR_FACTURA, filas)
+    detectar_duplicados(conexion, [fila[0] for fila in filas])
+
+
+def guardar_documento(conn, cursor, hash_contenido, texto, datos_extraidos, origen_datos=None):
+    """
+    Guarda el texto extraído y los datos del LLM asociados al hash del PDF,
+    para reutilizarlos si el mismo contenido vuelve a procesarse.
+    """
+    try:
+        cursor.execute(SQL_GUARDAR_DOCUMENTO, _fila_documento(hash_contenido, texto, datos_extraidos, origen_datos))
+        conn.commit()
+    except Exception as e:
+        log.error(f"Error al guardar el documento {hash_contenido[:12]} en la base de datos: {e}")
+        conn.rollback()
+
+
+def insertar_en_sqlite(conn, cursor, nombre_archivo, datos_extraidos, hash_contenido=None):
+    """
+    Inserta (o actualiza) los datos extraídos de una factura en la base de datos SQLite.
+    Para guardar muchas facturas, EscritorSQLite las agrupa en una sola transacción.
+    """
+    try:
+        _ejecutar_insercion_facturas(cursor, [_fila_factura(nombre_archivo, datos_extraidos, hash_contenido)])
+        conn.commit()
+        log.info(f"Datos de {nombre_archivo} guardados correctamente en la base de datos.")
+    except Exception as e:
+        log.error(f"Error al insertar datos de {nombre_archivo}: {e}")
+        conn.rollback()
+
+
+# Registra la etapa alcanzada por un archivo (ver _migrar_esquema_v5)
+SQL_ACTUALIZAR_TRABAJO = '''
+    UPDATE trabajos SET estado = ?, error = ?, reintentar_desde = datetime('now', '+' || ? || ' seconds'),
+                        fecha_actualizacion = CURRENT_TIMESTAMP
+    WHERE nombre_archivo = ?
+'''
+
+
+class EscritorSQLite:
+    """
+    Acumula documentos, facturas y estados de trabajos en memoria y los guarda con 'executemany' en
+    una sola transacción cada 'filas_por_bloque' filas o 'segundos_por_bloque'
+    segundos. Las sentencias que otros ejecuten sobre 'conn' sin confirmar (por
+    ejemplo, las plantillas aprendidas) se confirman en el mismo bloque.
+    No es seguro entre hilos: debe usarlo solo el dueño de la conexión.
+    """
+
+    def __init__(self, conn, filas_por_bloque=FILAS_POR_BLOQUE, segundos_por_bloque=SEGUNDOS_POR_BLOQUE):
+        self._conn = conn
+        self.filas_por_bloque = filas_por_bloque
+        self.segundos_por_bloque = segundos_por_bloque
+        self._documentos = []
+        self._facturas = []
+        self._trabajos = []
+        self._ultimo_vaciado = time.monotonic()
+        self.facturas_guardadas = 0
+
+    def __len__(self):
+        return len(self._documentos) + len(self._facturas) + len(self._trabajos)
+
+    def agregar_documento(self, hash_contenido, texto, datos_extraidos, origen_datos=None):
+        """
+        Encola el texto y los datos de un documento para el próximo bloque.
+        """
+        self._documentos.append(_fila_documento(hash_contenido, texto, datos_extraidos, origen_datos))
+
+    def agregar_factura(self, nombre_archivo, datos_extraidos, hash_contenido=None):
+        """
+        Encola los datos de una factura para el próximo bloque.
+        """
+        self._facturas.append(_fila_factura(nombre_archivo, datos_extraidos, hash_contenido))
+
+    def actualizar_trabajo(self, nombre_archivo, estado, error=None, espera_reintento=None):
+        """
+        Encola el nuevo estado del trabajo de un archivo para el próximo bloque.
+        Se guarda después de los documentos y facturas del mismo bloque. Con
+        'espera_reintento' (segundos), el archivo no se vuelve a planificar antes.
+        """
+        espera = None if espera_reintento is None else int(math.ceil(espera_reintento))
+        self._trabajos.append((estado, error, espera, nombre_archivo))
+
+    def segundos_hasta_vaciado(self):
+        """
+        Retorna cuántos segundos faltan para que el bloque actual deba guardarse.
+        """
+        return max(0.0, self._ultimo_vaciado + self.segundos_por_bloque - time.monotonic())
+
+    def vaciar_si_corresponde(self):
+        """
+        Guarda el bloque si alcanzó 'filas_por_bloque' filas o venció su plazo.
+        """
+        if len(self) >= self.filas_por_bloque or self.segundos_hasta_vaciado() == 0:
+            self.vaciar()
+
+    def vaciar(self):
+        """
+        Guarda todas las filas acumuladas en una transacción. Si el bloque falla,
+        lo reintenta fila por fila para que un dato inválido no descarte al resto.
+        """
+        documentos, facturas, trabajos = self._documentos, self._facturas, self._trabajos
+        self._documentos, self._facturas, self._trabajos = [], [], []
+        self._ultimo_vaciado = time.monotonic()
+        if not documentos and not facturas and not trabajos:
+            if self._conn.in_transaction:
+                self._conn.commit()
+            return
+
+        inicio = time.perf_counter()
+        try:
+            with self._conn: # Confirma al salir o revierte si hay un error
+                self._conn.executemany(SQL_GUARDAR_DOCUMENTO, documentos)
+                _ejecutar_insercion_facturas(self._conn, facturas)
+                self._conn.executemany(SQL_ACTUALIZAR_TRABAJO, trabajos)
+            guardadas = len(facturas)
+        except sqlite3.Error as e:
+            log.error(f"Error al guardar un bloque de {len(facturas)} facturas ({e}). Reintentando una por una.")
+            METRICAS.incrementar('facturas_escritura_errores_total')
+            guardadas = self._guardar_fila_por_fila(documentos, facturas, trabajos)
+
+        METRICAS.observar('facturas_escritura_bloque_duracion_segundos', time.perf_counter() - inicio)
+        METRICAS.incrementar('facturas_escritura_filas_total', guardadas, tabla='facturas')
+        METRICAS.incrementar('facturas_escritura_filas_total', len(documentos), tabla='documentos')
+        self.facturas_guardadas += guardadas
+        log.info(f"{guardadas} facturas y {len(documentos)} documentos guardados en la base de datos.")
+
+    def _guardar_fila_por_fila(self, documentos, facturas, trabajos):
+        """
+        Guarda cada fila en su propia transacción e informa las que fallan. Los
+        trabajos de las facturas que no se pudieron guardar quedan como 'fallido'.
+        Retorna el número de facturas guardadas.
+        """
+        for fila in documentos:
+            try:
+                with self._conn:
+                    self._conn.execute(SQL_GUARDAR_DOCUMENTO, fila)
+            except sqlite3.Error as e:
+                log.error(f"Error al guardar el documento {fila[0][:12]} en la base de datos: {e}")
+        guardadas = 0
+        for fila in facturas:
+            try:
+                with self._conn:
+                    _ejecutar_insercion_facturas(self._conn, [fila])
+                guardadas += 1
+            except sqlite3.Error as e:
+                log.error(f"Error al insertar datos de {fila[0]}: {e}")
+                trabajos.append(('fallido', f"Error al guardar la factura: {e}", None, fila[0]))
+        for fila in trabajos:
+            try:
+                with self._conn:
+                    self._conn.execute(SQL_ACTUALIZAR_TRABAJO, fila)
+            except sqlite3.Error as e:
+                log.error(f"Error al actualizar el trabajo de {fila[3]}: {e}")
+        return guardadas
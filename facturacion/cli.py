@@ -0,0 +1,228 @@
+"""
+Línea de comandos del procesamiento de facturas (python -m facturacion).
+"""
+import os
+import sys
+import argparse
+import logging
+
+from .configuracion import (CARPETA_FACTURAS, ESPERA_ESTABILIDAD_SEGUNDOS, FILAS_POR_BLOQUE,
+                            INTERVALO_SONDEO_SEGUNDOS, LIMITE_SOLICITUDES_POR_MINUTO, LIMITE_TOKENS_POR_MINUTO,
+                            MAX_SOLICITUDES_EN_VUELO, NIVEL_REGISTRO, NOMBRE_BD, RUTA_CACHE_LLM,
+                            SEGUNDOS_POR_BLOQUE, TAMANO_COLA, TAMANO_MAXIMO_CACHE_LLM_MB, TESSERACT_CMD,
+                            TRABAJADORES_EXTRACCION, TRABAJADORES_LLM)
+from .registro import METRICAS, configurar_registro, exportar_metricas
+from .base_datos import configurar_base_datos, planificar_archivos, resumen_trabajos
+from .llm import CacheLLM, LIMITADOR_OPENAI, MAX_FACTURAS_POR_LOTE, MAX_TOKENS_TEXTO_LLM, PRESUPUESTO_TOKENS_LOTE
+from .plantillas import PlantillasProveedor
+from .pipeline import ejecutar_pipeline, vigilar_carpeta
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['crear_parser_argumentos', 'cargar_clave_api', 'main']
+
+
+# Paso 5: Función Principal de Ejecución
+
+def crear_parser_argumentos():
+    """
+    Define los argumentos de línea de comandos del script.
+    """
+    parser = argparse.ArgumentParser(description="Extrae datos de facturas PDF y los guarda en SQLite.")
+    parser.add_argument("--trabajadores-extraccion", type=int, default=TRABAJADORES_EXTRACCION,
+                        help=f"Procesos para extracción de texto/OCR (por defecto: {TRABAJADORES_EXTRACCION}).")
+    parser.add_argument("--trabajadores-llm", type=int, default=TRABAJADORES_LLM,
+                        help=f"Llamadas simultáneas a OpenAI (por defecto: {TRABAJADORES_LLM}).")
+    parser.add_argument("--tamano-cola", type=int, default=TAMANO_COLA,
+                        help=f"Capacidad de las colas entre etapas (por defecto: {TAMANO_COLA}).")
+    parser.add_argument("--sin-cache-llm", action="store_true",
+                        help="No consultar ni guardar respuestas en la caché de OpenAI.")
+    parser.add_argument("--solo-cache", "--cache-only", action="store_true",
+                        help="No llamar a OpenAI: usar solo los datos guardados, la caché y las plantillas. "
+                             "Los archivos sin respuesta en la caché quedan pendientes. No requiere la clave de OpenAI.")
+    parser.add_argument("--cache-llm-mb", type=int, default=TAMANO_MAXIMO_CACHE_LLM_MB,
+                        help=f"Tamaño máximo de la caché de OpenAI en MB (por defecto: {TAMANO_MAXIMO_CACHE_LLM_MB}).")
+    parser.add_argument("--modo-lote", action="store_true",
+                        help="Enviar varias facturas por solicitud a OpenAI.")
+    parser.add_argument("--presupuesto-tokens-lote", type=int, default=PRESUPUESTO_TOKENS_LOTE,
+                        help=f"Tokens máximos estimados por solicitud en modo por lotes (por defecto: {PRESUPUESTO_TOKENS_LOTE}).")
+    parser.add_argument("--max-facturas-lote", type=int, default=MAX_FACTURAS_POR_LOTE,
+                        help=f"Facturas máximas por solicitud en modo por lotes (por defecto: {MAX_FACTURAS_POR_LOTE}).")
+    parser.add_argument("--max-tokens-texto", type=int, default=MAX_TOKENS_TEXTO_LLM,
+                        help=f"Tokens estimados máximos del texto de cada factura en el prompt; los textos más largos "
+                             f"se reducen a las regiones con datos clave (por defecto: {MAX_TOKENS_TEXTO_LLM}).")
+    parser.add_argument("--sin-limite-texto", action="store_true",
+                        help="Enviar el texto completo de cada factura (solo con los espacios colapsados).")
+    parser.add_argument("--cliente-async", action="store_true",
+                        help="Usar un cliente asíncrono de OpenAI en lugar de hilos.")
+    parser.add_argument("--max-solicitudes-en-vuelo", type=int, default=MAX_SOLICITUDES_EN_VUELO,
+                        help=f"Solicitudes simultáneas a OpenAI en modo asíncrono (por defecto: {MAX_SOLICITUDES_EN_VUELO}).")
+    parser.add_argument("--limite-solicitudes-minuto", type=int, default=LIMITE_SOLICITUDES_POR_MINUTO,
+                        help="Solicitudes por minuto permitidas por la cuenta de OpenAI (por defecto se toman de las cabeceras).")
+    parser.add_argument("--limite-tokens-minuto", type=int, default=LIMITE_TOKENS_POR_MINUTO,
+                        help="Tokens por minuto permitidos por la cuenta de OpenAI (por defecto se toman de las cabeceras).")
+    parser.add_argument("--sin-plantillas", action="store_true",
+                        help="No usar la extracción local con plantillas por proveedor.")
+    parser.add_argument("--aprender-plantillas", action="store_true",
+                        help="Aprender plantillas de las facturas ya guardadas antes de procesar.")
+    parser.add_argument("--filas-por-bloque", type=int, default=FILAS_POR_BLOQUE,
+                        help=f"Filas que se guardan juntas en una transacción (por defecto: {FILAS_POR_BLOQUE}).")
+    parser.add_argument("--segundos-por-bloque", type=float, default=SEGUNDOS_POR_BLOQUE,
+                        help=f"Segundos máximos entre escrituras en la base de datos (por defecto: {SEGUNDOS_POR_BLOQUE}).")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="No terminar: procesar los PDFs nuevos o modificados a medida que llegan a la carpeta.")
+    parser.add_argument("--espera-estabilidad", type=float, default=ESPERA_ESTABILIDAD_SEGUNDOS,
+                        help=f"Segundos sin cambios antes de procesar un PDF en modo vigilancia (por defecto: {ESPERA_ESTABILIDAD_SEGUNDOS}).")
+    parser.add_argument("--intervalo-sondeo", type=float, default=INTERVALO_SONDEO_SEGUNDOS,
+                        help=f"Segundos entre revisiones de la carpeta si no hay notificaciones del sistema (por defecto: {INTERVALO_SONDEO_SEGUNDOS}).")
+    parser.add_argument("--reintentar-fallidos", "--retry-failed", action="store_true",
+                        help="Procesar solo los archivos que fallaron en ejecuciones anteriores.")
+    parser.add_argument("--nivel-registro", default=NIVEL_REGISTRO, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help=f"Nivel mínimo de los mensajes (por defecto: {NIVEL_REGISTRO}).")
+    parser.add_argument("--registro-json", action="store_true",
+                        help="Escribir los mensajes como líneas JSON (registro estructurado).")
+    parser.add_argument("--metricas-json", metavar="RUTA",
+                        help="Guardar las métricas de la ejecución en un archivo JSON.")
+    parser.add_argument("--metricas-prometheus", metavar="RUTA",
+                        help="Guardar las métricas en el formato de texto de Prometheus (en modo vigilancia, tras cada ciclo).")
+    return parser
+
+
+def cargar_clave_api():
+    """
+    Carga las variables del archivo .env (si existe) en el entorno y retorna la
+    clave de OpenAI, o None si no está configurada.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("OPENAI_API_KEY")
+
+
+def main(argv=None):
+    """
+    Función principal que coordina la configuración, procesamiento de archivos
+    y almacenamiento en la base de datos.
+    """
+    args = crear_parser_argumentos().parse_args(argv)
+    configurar_registro(args.nivel_registro, args.registro_json)
+    if min(args.trabajadores_extraccion, args.trabajadores_llm, args.tamano_cola, args.max_solicitudes_en_vuelo,
+           args.filas_por_bloque, args.max_tokens_texto) < 1:
+        log.error("Error: El número de trabajadores, el tamaño de las colas, las filas por bloque y los tokens "
+                  "del texto deben ser al menos 1.")
+        sys.exit(1)
+    if args.vigilar and args.reintentar_fallidos:
+        log.error("Error: --reintentar-fallidos no se puede combinar con --vigilar.")
+        sys.exit(1)
+    if args.solo_cache and args.sin_cache_llm:
+        log.error("Error: --solo-cache no se puede combinar con --sin-cache-llm.")
+        sys.exit(1)
+
+    # La clave de OpenAI solo es necesaria si se puede llamar a la API
+    if not args.solo_cache and not cargar_clave_api():
+        log.critical("Error Crítico: La variable de entorno OPENAI_API_KEY no está configurada.")
+        log.critical("Por favor, asegúrate de tener un archivo .env con tu clave o configurarla en tu sistema.")
+        sys.exit(1) # Salir con código de error
+
+    # Configura la base de datos
+    conn, cursor = configurar_base_datos(NOMBRE_BD)
+    if conn is None:
+        sys.exit(1) # Sale si la conexión a la BD falla
+
+    # Verifica si la carpeta de facturas existe
+    if not os.path.isdir(CARPETA_FACTURAS):
+        log.error(f"Error: La carpeta de facturas '{CARPETA_FACTURAS}' no fue encontrada.")
+        log.error("Por favor, verifica la ruta.")
+        conn.close() # Cierra la conexión antes de salir
+        sys.exit(1)
+
+    # Obtiene la lista de archivos PDF en la carpeta (en modo vigilancia la revisa vigilar_carpeta)
+    if not args.vigilar:
+        try:
+            archivos_en_carpeta = os.listdir(CARPETA_FACTURAS)
+            lista_facturas_pdf = [archivo for archivo in archivos_en_carpeta if archivo.lower().endswith('.pdf')]
+            log.info(f"Encontrados {len(lista_facturas_pdf)} archivos PDF en '{CARPETA_FACTURAS}'.")
+
+            if not lista_facturas_pdf:
+                log.info("No se encontraron archivos PDF para procesar.")
+                conn.close()
+                sys.exit(0) # Sale si no hay archivos
+
+        except Exception as e:
+            log.error(f"Error al listar archivos en '{CARPETA_FACTURAS}': {e}")
+            conn.close()
+            sys.exit(1)
+
+
+        # Descarta por hash los archivos cuyo contenido ya está en la base de datos
+        archivos_pendientes = planificar_archivos(conn, cursor, lista_facturas_pdf,
+                                                  solo_fallidos=args.reintentar_fallidos)
+        log.info(f"{len(archivos_pendientes)} archivos nuevos o modificados; "
+                 f"{len(lista_facturas_pdf) - len(archivos_pendientes)} ya procesados.")
+
+    # Procesa los archivos PDF pendientes con el pipeline por etapas
+    # Ruta configurada de Tesseract (ver TESSERACT_CMD)
+    tesseract_config_cmd = TESSERACT_CMD
+
+    LIMITADOR_OPENAI.configurar(args.limite_solicitudes_minuto, args.limite_tokens_minuto)
+
+    plantillas = None
+    if not args.sin_plantillas:
+        plantillas = PlantillasProveedor()
+        plantillas.cargar(cursor)
+        if args.aprender_plantillas:
+            plantillas.aprender_de_historial(conn, cursor)
+        log.info(f"Plantillas de proveedor cargadas: {len(plantillas)}.")
+
+    cache_llm = None
+    if not args.sin_cache_llm:
+        cache_llm = CacheLLM(RUTA_CACHE_LLM, args.cache_llm_mb * 1024 * 1024)
+
+    llamadas_simultaneas = args.max_solicitudes_en_vuelo if args.cliente_async else args.trabajadores_llm
+    if args.solo_cache:
+        descripcion_llm = "sin llamadas a OpenAI (solo caché)"
+    else:
+        descripcion_llm = (f"{llamadas_simultaneas} llamadas simultáneas a OpenAI"
+                           f"{' (cliente asíncrono)' if args.cliente_async else ''}")
+    log.info(f"Pipeline: {args.trabajadores_extraccion} procesos de extracción, {descripcion_llm}, "
+             f"colas de {args.tamano_cola} elementos.")
+    opciones_pipeline = dict(trabajadores_extraccion=args.trabajadores_extraccion,
+                             trabajadores_llm=args.trabajadores_llm,
+                             tamano_cola=args.tamano_cola,
+                             cache_llm=cache_llm,
+                             modo_lote=args.modo_lote,
+                             presupuesto_tokens=args.presupuesto_tokens_lote,
+                             max_por_lote=args.max_facturas_lote,
+                             plantillas=plantillas,
+                             max_tokens_texto=None if args.sin_limite_texto else args.max_tokens_texto,
+                             cliente_async=args.cliente_async,
+                             max_en_vuelo=args.max_solicitudes_en_vuelo,
+                             filas_por_bloque=args.filas_por_bloque,
+                             segundos_por_bloque=args.segundos_por_bloque,
+                             solo_cache=args.solo_cache)
+    exportar = lambda: exportar_metricas(args.metricas_json, args.metricas_prometheus)
+    if args.vigilar:
+        vigilar_carpeta(conn, cursor, CARPETA_FACTURAS, tesseract_config_cmd, opciones_pipeline,
+                        espera_estabilidad=args.espera_estabilidad,
+                        intervalo_sondeo=args.intervalo_sondeo,
+                        al_terminar_ciclo=exportar)
+    else:
+        ejecutar_pipeline(conn, cursor, archivos_pendientes, tesseract_config_cmd, **opciones_pipeline)
+
+    if plantillas is not None:
+        log.info(f"Facturas extraídas localmente con plantillas: {plantillas.usos}.")
+
+    if cache_llm is not None:
+        log.info(cache_llm.resumen())
+        cache_llm.cerrar()
+
+    log.info(resumen_trabajos(cursor))
+    log.info(METRICAS.resumen())
+    exportar()
+
+
+    # Paso 6: Finalizar y Cerrar Conexiones
+    
+    conn.close()
+    log.info("Procesamiento de todas las facturas completado.")
+    log.info(f"Base de datos {NOMBRE_BD} cerrada.")
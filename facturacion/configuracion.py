@@ -0,0 +1,200 @@
+"""
+Configuración del procesamiento de facturas: rutas, modelo de OpenAI, OCR,
+pipeline, escritura en SQLite, detección de duplicados, modo vigilancia, registro,
+métricas y exportación.
+Ajusta aquí los valores por defecto; la mayoría también se puede cambiar con
+los argumentos de línea de comandos (python -m facturacion --help).
+"""
+import os
+import re
+
+
+# --- Configuración de Variables ---
+
+# Ruta a la carpeta que contiene las facturas
+CARPETA_FACTURAS = r'./Facturas-comprobantes' 
+
+# Nombre del archivo de la base de datos SQLite
+NOMBRE_BD = 'facturas_analizadas.db'
+
+# Configuración de OpenAI. La clave se lee de la variable de entorno OPENAI_API_KEY
+# (o de un archivo .env) al ejecutar el script, y solo se exige si hay que llamar a la API.
+MODELO_OPENAI = "gpt-4o-mini"
+
+# --- Control de tasa y reintentos de OpenAI ---
+
+# Reintentos ante errores transitorios (429, timeouts, errores 5xx, conexión)
+REINTENTOS_OPENAI = 5
+ESPERA_BASE_REINTENTO = 1.0 # Segundos; se duplica en cada intento, con jitter
+ESPERA_MAXIMA_REINTENTO = 60.0
+
+# Ejecuciones en las que se vuelve a procesar un archivo cuya solicitud a OpenAI agotó
+# los reintentos por errores transitorios; después queda como 'fallido'
+MAX_INTENTOS_TRANSITORIOS = 3
+# Espera mínima antes de volver a procesarlo (se duplica en cada intento; si OpenAI
+# indicó Retry-After y es mayor, se usa ese valor)
+ESPERA_REINTENTABLE_SEGUNDOS = 60
+
+# Límites iniciales de solicitudes y tokens por minuto (None = sin límite hasta que
+# las cabeceras de las respuestas de OpenAI informen los de la cuenta)
+LIMITE_SOLICITUDES_POR_MINUTO = None
+LIMITE_TOKENS_POR_MINUTO = None
+
+# Tokens de respuesta que se suman a la estimación de cada solicitud
+TOKENS_RESPUESTA_ESTIMADOS = 200
+
+# Modo asíncrono: solicitudes simultáneas máximas a OpenAI
+MAX_SOLICITUDES_EN_VUELO = 16
+
+# Caché persistente de respuestas de OpenAI (archivo SQLite independiente de NOMBRE_BD,
+# así sobrevive aunque se borre la base de datos de facturas)
+RUTA_CACHE_LLM = 'cache_llm.db'
+TAMANO_MAXIMO_CACHE_LLM_MB = 256 # Al superarlo se eliminan las respuestas usadas hace más tiempo
+
+# Ejecutable de Tesseract OCR: un nombre a buscar en el PATH o la ruta completa.
+# Ajústalo si Tesseract no está en el PATH.
+TESSERACT_CMD = 'tesseract'
+# TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe' # Ejemplo para Windows
+# TESSERACT_CMD = r'/usr/bin/tesseract' # Ejemplo para Linux (puede variar)
+
+# Umbral para detección de texto escaso (para decidir si usar OCR)
+UMBRAL_CARACTERES_POR_PAGINA = 100 # Ajusta este valor si es necesario
+
+# --- Extracción local con plantillas por proveedor ---
+
+# Confianza mínima (0 a 1) para aceptar los datos de una plantilla sin llamar a OpenAI.
+# La confianza combina los campos encontrados con el historial de aciertos de la
+# plantilla: con 0.8, una plantilla necesita coincidir 3 veces con el LLM antes de usarse.
+UMBRAL_CONFIANZA_PLANTILLA = 0.8
+
+# --- Configuración del OCR ---
+
+# Resolución a la que se renderiza cada página para el OCR (Tesseract rinde mejor entre 200 y 300)
+DPI_OCR = 200
+
+# Hilos de OCR de páginas en paralelo, repartidos entre los procesos de extracción
+# (ver extraccion.configurar_proceso_extraccion). Cada página se procesa con su propia
+# llamada a Tesseract, así que en total hay como mucho un Tesseract por núcleo.
+TRABAJADORES_OCR_PAGINAS = os.cpu_count() or 1
+
+# Motor de OCR: 'pytesseract' (lanza un proceso de tesseract por página) o
+# 'tesserocr' (usa la biblioteca de Tesseract en el mismo proceso, si está instalada)
+MOTOR_OCR = 'pytesseract'
+
+# Idioma y opciones adicionales de Tesseract ('--oem 1' usa solo el motor LSTM)
+IDIOMA_OCR = 'spa'
+CONFIG_TESSERACT = '--oem 1 --psm 3'
+
+# Si es True, el OCR se detiene en cuanto se encontraron el encabezado y el total
+# de la factura, sin procesar el resto de las páginas
+PARADA_TEMPRANA_OCR = False
+PATRON_ENCABEZADO_FACTURA = re.compile(r'factura|invoice|n[°º]\s*\d', re.IGNORECASE)
+PATRON_TOTAL_FACTURA = re.compile(r'total[^\n]*\d', re.IGNORECASE)
+
+# Separador que se añade tras el texto de cada página procesada con OCR
+SEPARADOR_PAGINA_OCR = "\n--- Fin de página ---\n"
+
+# Separador que se añade tras el texto nativo de cada página: un salto de página
+# (form feed, como pdftotext). Permite reconocer los encabezados y pies repetidos
+# en cada página al compactar el texto (ver llm.compactar_texto_factura).
+SEPARADOR_PAGINA_NATIVA = "\n\f"
+
+# Píxeles máximos (en millones) de la imagen de una página para OCR. Las páginas más
+# grandes (a 200 ppp, más que un A2) se renderizan a menor resolución para acotar la memoria.
+MAX_MEGAPIXELES_PAGINA_OCR = 16
+
+# --- Límites por Documento ---
+
+# Un PDF muy grande (por ejemplo, un extracto de cientos de páginas) se trunca al
+# alcanzar cualquiera de estos límites, conservando el texto extraído hasta ese
+# momento; así un solo archivo no puede agotar la memoria ni bloquear el lote.
+# None desactiva el límite.
+MAX_PAGINAS_DOCUMENTO = 300 # Se procesan las primeras y la última, donde suele estar el total
+MAX_BYTES_TEXTO_DOCUMENTO = 4 * 1024 * 1024
+MAX_SEGUNDOS_DOCUMENTO = 600
+MAX_MEMORIA_DOCUMENTO_MB = 1024 # Aumento de la memoria residente del proceso (solo en Linux)
+
+# --- Configuración del Pipeline ---
+
+# Número de procesos para la extracción de texto y OCR (trabajo intensivo en CPU)
+TRABAJADORES_EXTRACCION = os.cpu_count() or 1
+
+# Número máximo de llamadas simultáneas a OpenAI (trabajo limitado por la red)
+TRABAJADORES_LLM = 4
+
+# Capacidad de las colas que conectan las etapas. Limita la memoria usada cuando
+# una etapa es más rápida que la siguiente.
+TAMANO_COLA = 16
+
+# --- Configuración de la Escritura en SQLite ---
+
+# La etapa de escritura acumula filas y las guarda en una sola transacción cada
+# FILAS_POR_BLOQUE filas o cada SEGUNDOS_POR_BLOQUE segundos, lo que ocurra antes
+FILAS_POR_BLOQUE = 200
+SEGUNDOS_POR_BLOQUE = 2.0
+
+# Caché de páginas de SQLite en KiB (los valores negativos de cache_size son KiB)
+CACHE_SQLITE_KB = 64 * 1024
+
+# --- Detección de Facturas Duplicadas ---
+
+# Al guardar una factura se buscan otras del mismo proveedor con el mismo número, o
+# con el mismo total y una fecha de emisión a no más de DIAS_TOLERANCIA_DUPLICADOS días
+DIAS_TOLERANCIA_DUPLICADOS = 3
+
+# Similitud mínima (0 a 1) entre los textos de dos facturas candidatas para marcarlas
+# como posibles duplicados. El mismo PDF escaneado dos veces suele superar 0.8; facturas
+# distintas del mismo proveedor comparten el diseño y rondan 0.3.
+UMBRAL_SIMILITUD_DUPLICADO = 0.6
+
+# --- Configuración del Modo Vigilancia (--vigilar) ---
+
+# Segundos que el tamaño y la fecha de modificación de un PDF deben mantenerse
+# sin cambios antes de procesarlo (evita leer archivos que se están copiando)
+ESPERA_ESTABILIDAD_SEGUNDOS = 2.0
+
+# Intervalo entre revisiones de la carpeta cuando no se dispone de notificaciones
+# del sistema (la biblioteca opcional watchdog usa inotify en Linux)
+INTERVALO_SONDEO_SEGUNDOS = 5.0
+
+# Archivos máximos por ciclo del pipeline en modo vigilancia
+MAX_ARCHIVOS_POR_CICLO = 200
+
+
+# --- Configuración de la Exportación (python -m facturacion.exportacion) ---
+
+# Carpeta de destino y formato por defecto ('parquet', 'arrow' o 'csv')
+CARPETA_EXPORTACION = 'exportacion'
+FORMATO_EXPORTACION = 'parquet'
+
+# Filas que se leen de SQLite y se escriben de una vez (en Parquet, un grupo de filas)
+FILAS_POR_LOTE_EXPORTACION = 50_000
+
+# Las filas procesadas en los últimos segundos se dejan para la próxima exportación,
+# ya que un bloque del escritor podría confirmarse después con una marca de tiempo anterior
+MARGEN_MARCA_AGUA_SEGUNDOS = 60
+
+# Compresión de los archivos Parquet
+COMPRESION_PARQUET = 'zstd'
+
+
+# --- Configuración del Registro y las Métricas ---
+
+# Formato de los mensajes en texto (con --registro-json se escribe una línea JSON por mensaje)
+FORMATO_REGISTRO = "%(asctime)s %(levelname)-7s [%(processName)s/%(threadName)s] %(message)s"
+NIVEL_REGISTRO = 'INFO'
+
+# Límites superiores (en segundos) de las cubetas de los histogramas de duración
+LIMITES_HISTOGRAMA_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Precio en USD por millón de tokens (entrada, salida) de cada modelo, para estimar
+# el costo a partir de 'response.usage'. Los modelos que no figuran no suman costo.
+PRECIOS_MODELOS_USD = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1': (2.00, 8.00),
+}
+
+# API pública del módulo (la que reexporta procesar_facturas.py): las constantes de configuración
+__all__ = [nombre for nombre in dict(globals()) if nombre.isupper()]
@@ -0,0 +1,201 @@
+"""
+Detección de facturas duplicadas que no comparten el archivo: la misma factura
+escaneada dos veces con otro nombre, o recibida por correo y también escaneada.
+
+Al guardar una factura se buscan candidatas por dos claves de bloqueo con índice
+(ver _migrar_esquema_v7): mismo proveedor y número de factura normalizado, o mismo
+proveedor y total con una fecha de emisión cercana. La comprobación final compara
+las firmas MinHash de los textos extraídos; si falta el texto de alguna, se exige
+el mismo número y el mismo total. Los posibles duplicados se registran
+en la tabla 'posibles_duplicados'; las facturas no se modifican ni se borran.
+"""
+import re
+import zlib
+import struct
+import logging
+
+from .configuracion import DIAS_TOLERANCIA_DUPLICADOS, UMBRAL_SIMILITUD_DUPLICADO
+from .registro import METRICAS
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['CARACTERES_POR_FRAGMENTO', 'CUBETAS_FIRMA_TEXTO', 'firma_texto', 'similitud_firmas',
+           'SQL_CLAVES_FACTURA', 'MAX_CANDIDATAS_DUPLICADO', 'SQL_CANDIDATAS_DUPLICADO',
+           'SQL_REGISTRAR_DUPLICADO', 'MOTIVOS_DUPLICADO', 'detectar_duplicados']
+
+
+# --- Firmas MinHash del texto ---
+
+# El texto normalizado se divide en fragmentos solapados de este número de caracteres.
+# Con fragmentos de caracteres (y no de palabras), los errores del OCR solo alteran
+# los fragmentos que tocan.
+CARACTERES_POR_FRAGMENTO = 5
+
+# Cubetas de la firma (MinHash de una sola permutación): cada fragmento se asigna a
+# una cubeta según su hash y se conserva el mínimo de cada una. Más cubetas dan una
+# estimación más precisa con firmas más grandes (4 bytes por cubeta).
+CUBETAS_FIRMA_TEXTO = 128
+
+# Valor de las cubetas sin fragmentos
+_CUBETA_VACIA = 0xFFFFFFFF
+
+# Multiplicador impar de 64 bits que mezcla los bits del CRC-32 de cada fragmento
+_MEZCLA_HASH = 0x9E3779B97F4A7C15
+
+_BITS_CUBETA = CUBETAS_FIRMA_TEXTO.bit_length() - 1
+
+
+def firma_texto(texto):
+    """
+    Retorna la firma MinHash del texto de una factura (bytes, para guardar en
+    SQLite), o None si no hay texto. Antes de dividirlo en fragmentos se pasan
+    a minúsculas y se quitan los signos y los espacios repetidos.
+    """
+    normalizado = " ".join(re.sub(r'[\W_]+', ' ', (texto or "").casefold()).split())
+    if not normalizado:
+        return None
+    minimos = [_CUBETA_VACIA] * CUBETAS_FIRMA_TEXTO
+    fragmentos = {normalizado[inicio:inicio + CARACTERES_POR_FRAGMENTO]
+                  for inicio in range(max(1, len(normalizado) - CARACTERES_POR_FRAGMENTO + 1))}
+    for fragmento in fragmentos:
+        valor = (zlib.crc32(fragmento.encode('utf-8')) * _MEZCLA_HASH) & 0xFFFFFFFFFFFFFFFF
+        cubeta = valor >> (64 - _BITS_CUBETA)
+        valor &= 0xFFFFFFFF
+        if valor < minimos[cubeta]:
+            minimos[cubeta] = valor
+    return struct.pack(f'<{CUBETAS_FIRMA_TEXTO}I', *minimos)
+
+
+def similitud_firmas(firma_a, firma_b):
+    """
+    Estima la similitud de Jaccard (0 a 1) entre los fragmentos de dos textos a
+    partir de sus firmas: la fracción de cubetas ocupadas con el mismo mínimo.
+    """
+    if len(firma_a) != len(firma_b):
+        return 0.0 # Firmas calculadas con otro número de cubetas
+    cantidad = len(firma_a) // 4
+    ocupadas = iguales = 0
+    for a, b in zip(struct.unpack(f'<{cantidad}I', firma_a), struct.unpack(f'<{cantidad}I', firma_b)):
+        if a != _CUBETA_VACIA or b != _CUBETA_VACIA:
+            ocupadas += 1
+            iguales += a == b
+    return iguales / ocupadas if ocupadas else 0.0
+
+
+# --- Búsqueda de duplicados ---
+
+# Datos de la factura recién guardada que forman las claves de bloqueo
+SQL_CLAVES_FACTURA = '''
+    SELECT id, proveedor_id, numero_normalizado, total_centavos, fecha_emision, hash_contenido
+    FROM facturas WHERE nombre_archivo = ?
+'''
+
+# Candidatas máximas por clave de bloqueo (las más recientes), para acotar el costo
+# si muchas facturas comparten una clave
+MAX_CANDIDATAS_DUPLICADO = 20
+
+# Candidatas por cada clave de bloqueo; cada consulta recorre solo su índice
+SQL_CANDIDATAS_DUPLICADO = '''
+    SELECT * FROM (
+        SELECT id, nombre_archivo, hash_contenido, total_centavos, 'numero' FROM facturas
+        WHERE proveedor_id = :proveedor_id AND numero_normalizado = :numero AND id != :id
+        ORDER BY id DESC LIMIT :limite)
+    UNION ALL
+    SELECT * FROM (
+        SELECT id, nombre_archivo, hash_contenido, total_centavos, 'importe_fecha' FROM facturas
+        WHERE proveedor_id = :proveedor_id AND total_centavos = :total
+          AND fecha_emision BETWEEN date(:fecha, :antes) AND date(:fecha, :despues) AND id != :id
+        ORDER BY id DESC LIMIT :limite)
+'''
+
+SQL_REGISTRAR_DUPLICADO = '''
+    INSERT INTO posibles_duplicados (factura_id, original_id, motivo, similitud) VALUES (?, ?, ?, ?)
+    ON CONFLICT(factura_id, original_id) DO UPDATE SET
+        motivo = excluded.motivo, similitud = excluded.similitud, fecha_deteccion = CURRENT_TIMESTAMP
+'''
+
+# Descripción de cada motivo para los mensajes
+MOTIVOS_DUPLICADO = {
+    'numero': "mismo proveedor y número de factura",
+    'importe_fecha': "mismo proveedor y total, fecha de emisión cercana",
+}
+
+
+def _firma_documento(conexion, hash_contenido, firmas):
+    """
+    Retorna la firma del texto guardado para un contenido, calculándola (y
+    guardándola) si el documento es anterior a las firmas. 'firmas' es una caché
+    por hash para la búsqueda en curso.
+    """
+    if hash_contenido not in firmas:
+        fila = conexion.execute("SELECT firma_texto, texto FROM documentos WHERE hash_contenido = ?",
+                                (hash_contenido,)).fetchone()
+        firma = None
+        if fila:
+            firma = fila[0]
+            if firma is None and fila[1]:
+                firma = firma_texto(fila[1])
+                conexion.execute("UPDATE documentos SET firma_texto = ? WHERE hash_contenido = ?",
+                                 (firma, hash_contenido))
+        firmas[hash_contenido] = firma
+    return firmas[hash_contenido]
+
+
+def detectar_duplicados(conexion, nombres_archivo, dias_tolerancia=DIAS_TOLERANCIA_DUPLICADOS,
+                        umbral_similitud=UMBRAL_SIMILITUD_DUPLICADO):
+    """
+    Busca posibles duplicados de las facturas recién guardadas con esos nombres
+    de archivo y los registra en 'posibles_duplicados' (la factura más antigua
+    queda como original). Si ambos textos están guardados, la similitud debe
+    alcanzar 'umbral_similitud'; sin texto, solo se marcan las coincidencias de
+    número con el mismo total. Debe ejecutarse en la misma transacción que la inserción; 'conexion'
+    puede ser una conexión o un cursor. Retorna el número de duplicados registrados.
+    """
+    # Los datos pueden haber cambiado al reprocesar un archivo: se vuelven a evaluar sus pares
+    facturas = []
+    for nombre_archivo in nombres_archivo:
+        claves = conexion.execute(SQL_CLAVES_FACTURA, (nombre_archivo,)).fetchone()
+        if claves is not None:
+            conexion.execute("DELETE FROM posibles_duplicados WHERE factura_id = ? OR original_id = ?",
+                             (claves[0], claves[0]))
+            facturas.append((nombre_archivo,) + claves)
+
+    registrados = 0
+    firmas = {}
+    evaluados = set() # Pares ya comparados, si ambas facturas se guardaron juntas
+    for nombre_archivo, id_factura, proveedor_id, numero, total, fecha, hash_contenido in facturas:
+        if proveedor_id is None:
+            continue
+
+        candidatas = {}
+        for id_candidata, nombre_candidata, hash_candidata, total_candidata, motivo in conexion.execute(
+                SQL_CANDIDATAS_DUPLICADO, {
+                'id': id_factura, 'proveedor_id': proveedor_id, 'numero': numero, 'total': total, 'fecha': fecha,
+                'antes': f"-{dias_tolerancia} days", 'despues': f"+{dias_tolerancia} days",
+                'limite': MAX_CANDIDATAS_DUPLICADO}).fetchall():
+            # Si coinciden ambas claves, prevalece el número
+            candidatas.setdefault(id_candidata, (nombre_candidata, hash_candidata, total_candidata, motivo))
+
+        for id_candidata, (nombre_candidata, hash_candidata, total_candidata, motivo) in candidatas.items():
+            par = (max(id_factura, id_candidata), min(id_factura, id_candidata))
+            if par in evaluados:
+                continue
+            evaluados.add(par)
+            firma = _firma_documento(conexion, hash_contenido, firmas)
+            firma_candidata = _firma_documento(conexion, hash_candidata, firmas)
+            if firma is not None and firma_candidata is not None:
+                similitud = round(similitud_firmas(firma, firma_candidata), 3)
+                if similitud < umbral_similitud:
+                    continue
+            elif motivo == 'numero' and total is not None and total == total_candidata:
+                similitud = None # Sin textos que comparar, el total sirve de segunda clave
+            else:
+                continue
+
+            conexion.execute(SQL_REGISTRAR_DUPLICADO, par + (motivo, similitud))
+            registrados += 1
+            METRICAS.incrementar('facturas_duplicados_total', motivo=motivo)
+            log.warning(f"Posible factura duplicada: {nombre_archivo} y {nombre_candidata} ({MOTIVOS_DUPLICADO[motivo]}"
+                        + (f"; similitud del texto {similitud:.2f})." if similitud is not None else ")."))
+    return registrados
@@ -0,0 +1,296 @@
+"""
+Exportación de la tabla 'facturas' a Parquet, Arrow IPC o CSV para análisis con
+motores columnares (DuckDB, Polars, pandas, Spark...).
+
+Las filas se leen por lotes y se escriben particionadas por mes de emisión, con
+el formato de carpetas 'mes=YYYY-MM' que reconocen esos motores. La exportación
+es incremental: un archivo de estado en la carpeta de destino guarda la marca de
+agua de 'fecha_procesamiento' y cada ejecución agrega solo las filas procesadas
+desde entonces. Una factura reprocesada se vuelve a exportar, así que al leer la
+exportación hay que quedarse con la fila más reciente de cada 'id'.
+
+Uso: python -m facturacion.exportacion --formato parquet --destino exportacion
+
+Parquet y Arrow requieren la biblioteca opcional pyarrow (pip install pyarrow);
+CSV no requiere dependencias.
+"""
+import os
+import csv
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+import logging
+
+from .configuracion import (CARPETA_EXPORTACION, COMPRESION_PARQUET, FILAS_POR_LOTE_EXPORTACION,
+                            FORMATO_EXPORTACION, MARGEN_MARCA_AGUA_SEGUNDOS, NIVEL_REGISTRO, NOMBRE_BD)
+from .registro import configurar_registro
+
+# Con 'python -m' __name__ es '__main__'; el registro se configura para el paquete
+log = logging.getLogger(__spec__.name)
+
+
+# --- Exportación columnar ---
+
+# Columnas exportadas y su tipo. Los importes van en centavos enteros, exactos;
+# 'total' se incluye en unidades por comodidad.
+COLUMNAS_EXPORTACION = (
+    ('id', 'entero'),
+    ('nombre_archivo', 'texto'),
+    ('numero_factura', 'texto'),
+    ('fecha_emision', 'fecha'),
+    ('proveedor', 'texto'),
+    ('proveedor_id', 'entero'),
+    ('cliente', 'texto'),
+    ('total_centavos', 'entero'),
+    ('impuestos_centavos', 'entero'),
+    ('total', 'real'),
+    ('moneda', 'texto'),
+    ('hash_contenido', 'texto'),
+    ('fecha_procesamiento', 'fecha_hora'),
+)
+
+# Extensión de los archivos de cada formato
+EXTENSIONES_EXPORTACION = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+
+# Archivo con el estado de la exportación (formato y marca de agua) dentro del destino
+NOMBRE_ESTADO_EXPORTACION = '_estado_exportacion.json'
+
+# Partición de las facturas sin fecha de emisión
+PARTICION_SIN_FECHA = 'sin_fecha'
+
+
+def importar_pyarrow():
+    """
+    Importa pyarrow y sus módulos de Parquet e IPC, o lanza ImportError con
+    instrucciones si no está instalado.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Los formatos 'parquet' y 'arrow' requieren pyarrow (pip install pyarrow). "
+                          "Usa --formato csv para exportar sin dependencias.") from e
+    return pyarrow
+
+
+def _esquema_arrow(pa):
+    tipos = {'entero': pa.int64(), 'texto': pa.string(), 'real': pa.float64(),
+             'fecha': pa.date32(), 'fecha_hora': pa.timestamp('s')}
+    return pa.schema([(nombre, tipos[tipo]) for nombre, tipo in COLUMNAS_EXPORTACION])
+
+
+def _tabla_arrow(pa, esquema, filas):
+    """
+    Convierte una lista de filas de SQLite en una tabla de Arrow. Las fechas
+    llegan como texto ISO y las convierte Arrow, sin pasar por objetos de Python.
+    """
+    columnas = list(zip(*filas))
+    arreglos = []
+    for indice, campo in enumerate(esquema):
+        if pa.types.is_date(campo.type) or pa.types.is_timestamp(campo.type):
+            arreglos.append(pa.array(columnas[indice], type=pa.string()).cast(campo.type))
+        else:
+            arreglos.append(pa.array(columnas[indice], type=campo.type))
+    return pa.Table.from_arrays(arreglos, schema=esquema)
+
+
+class _EscritorParticion:
+    """
+    Escribe las filas de una partición en un archivo temporal del formato
+    indicado; 'confirmar' le da su nombre definitivo y 'descartar' lo borra.
+    """
+
+    def __init__(self, ruta, formato, pa=None):
+        self.ruta = ruta
+        self.ruta_temporal = ruta + '.tmp'
+        self.formato = formato
+        self.pa = pa
+        self.filas = 0
+        if formato == 'csv':
+            self._archivo = open(self.ruta_temporal, 'w', encoding='utf-8', newline='')
+            self._csv = csv.writer(self._archivo)
+            self._csv.writerow(nombre for nombre, _ in COLUMNAS_EXPORTACION)
+        else:
+            self._esquema = _esquema_arrow(pa)
+            if formato == 'parquet':
+                self._escritor = pa.parquet.ParquetWriter(self.ruta_temporal, self._esquema,
+                                                          compression=COMPRESION_PARQUET)
+            else:
+                self._escritor = pa.ipc.new_file(self.ruta_temporal, self._esquema)
+
+    def escribir(self, filas):
+        if self.formato == 'csv':
+            self._csv.writerows(filas)
+        else:
+            self._escritor.write_table(_tabla_arrow(self.pa, self._esquema, filas))
+        self.filas += len(filas)
+
+    def cerrar(self):
+        if self.formato == 'csv':
+            self._archivo.close()
+        else:
+            self._escritor.close()
+
+    def confirmar(self):
+        os.replace(self.ruta_temporal, self.ruta)
+
+    def descartar(self):
+        try:
+            self.cerrar()
+        except Exception:
+            pass
+        if os.path.exists(self.ruta_temporal):
+            os.remove(self.ruta_temporal)
+
+
+def _particion(fecha_emision):
+    """
+    Retorna el nombre de la carpeta de la partición ('mes=YYYY-MM') de una fecha ISO.
+    """
+    return f"mes={fecha_emision[:7] if fecha_emision else PARTICION_SIN_FECHA}"
+
+
+def leer_estado_exportacion(destino):
+    """
+    Retorna el estado guardado en la carpeta de destino, o None si todavía no
+    se exportó nada en ella.
+    """
+    ruta = os.path.join(destino, NOMBRE_ESTADO_EXPORTACION)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def _guardar_estado_exportacion(destino, estado):
+    ruta = os.path.join(destino, NOMBRE_ESTADO_EXPORTACION)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(estado, archivo, ensure_ascii=False, indent=1)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def exportar_facturas(conn, destino=CARPETA_EXPORTACION, formato=FORMATO_EXPORTACION,
+                      filas_por_lote=FILAS_POR_LOTE_EXPORTACION, margen_segundos=MARGEN_MARCA_AGUA_SEGUNDOS):
+    """
+    Exporta a 'destino' las facturas procesadas desde la última exportación (todas
+    la primera vez), un archivo por mes de emisión en 'mes=YYYY-MM/'. Las filas se
+    leen de a 'filas_por_lote', ordenadas por fecha de emisión, así que solo hay un
+    archivo abierto a la vez. La marca de agua avanza solo si todo se escribió.
+    Retorna el número de filas exportadas.
+    """
+    if formato not in EXTENSIONES_EXPORTACION:
+        raise ValueError(f"Formato de exportación desconocido: '{formato}'.")
+    pa = importar_pyarrow() if formato != 'csv' else None
+
+    estado = leer_estado_exportacion(destino)
+    if estado and estado['formato'] != formato:
+        raise ValueError(f"La carpeta '{destino}' ya contiene una exportación en formato '{estado['formato']}'. "
+                         "Usa otra carpeta para cambiar de formato.")
+    desde = estado['marca_agua'] if estado else None
+
+    # Ventana [desde, hasta): 'hasta' es la próxima marca de agua, en el mismo
+    # formato que CURRENT_TIMESTAMP (UTC, resolución de segundos)
+    hasta = conn.execute("SELECT datetime('now', ?)", (f"-{margen_segundos} seconds",)).fetchone()[0]
+    if desde is not None and hasta <= desde:
+        log.info("No hay filas nuevas para exportar.")
+        return 0
+    if desde is None:
+        condicion, parametros = "fecha_procesamiento < ? OR fecha_procesamiento IS NULL", (hasta,)
+    else:
+        condicion, parametros = "fecha_procesamiento >= ? AND fecha_procesamiento < ?", (desde, hasta)
+    columnas = ", ".join(nombre for nombre, _ in COLUMNAS_EXPORTACION)
+    cursor = conn.execute(f"SELECT {columnas} FROM facturas WHERE {condicion} ORDER BY fecha_emision, id",
+                          parametros)
+
+    log.info(f"Exportando a '{destino}' en formato {formato} las facturas procesadas "
+             f"{f'desde {desde} ' if desde else ''}hasta {hasta} (UTC)...")
+    nombre_parte = f"facturas-{hasta.replace('-', '').replace(':', '').replace(' ', 'T')}"
+    indice_fecha = [nombre for nombre, _ in COLUMNAS_EXPORTACION].index('fecha_emision')
+    escritores = []
+    actual = None
+    try:
+        while True:
+            filas = cursor.fetchmany(filas_por_lote)
+            if not filas:
+                break
+            # Un lote ordenado por fecha se reparte en tramos consecutivos de un mismo mes
+            inicio = 0
+            while inicio < len(filas):
+                particion = _particion(filas[inicio][indice_fecha])
+                fin = inicio + 1
+                while fin < len(filas) and _particion(filas[fin][indice_fecha]) == particion:
+                    fin += 1
+                ruta = os.path.join(destino, particion, nombre_parte + EXTENSIONES_EXPORTACION[formato])
+                if actual is None or actual.ruta != ruta:
+                    if actual is not None:
+                        actual.cerrar()
+                    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                    actual = _EscritorParticion(ruta, formato, pa)
+                    escritores.append(actual)
+                actual.escribir(filas[inicio:fin])
+                inicio = fin
+        if actual is not None:
+            actual.cerrar()
+    except BaseException:
+        for escritor in escritores:
+            escritor.descartar()
+        raise
+
+    for escritor in escritores:
+        escritor.confirmar()
+    total_filas = sum(escritor.filas for escritor in escritores)
+    os.makedirs(destino, exist_ok=True)
+    _guardar_estado_exportacion(destino, {
+        'formato': formato,
+        'marca_agua': hasta,
+        'filas_ultima_exportacion': total_filas,
+        'fecha_ultima_exportacion': datetime.datetime.now().isoformat(timespec='seconds'),
+    })
+    log.info(f"Exportadas {total_filas} facturas en {len(escritores)} particiones. Marca de agua: {hasta} (UTC).")
+    return total_filas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Exporta la tabla 'facturas' a Parquet, Arrow IPC o CSV, particionada por mes de emisión. "
+                    "Cada ejecución agrega solo las facturas procesadas desde la anterior.")
+    parser.add_argument("--formato", choices=sorted(EXTENSIONES_EXPORTACION), default=FORMATO_EXPORTACION,
+                        help=f"Formato de los archivos (por defecto: {FORMATO_EXPORTACION}). "
+                             "'parquet' y 'arrow' requieren pyarrow.")
+    parser.add_argument("--destino", default=CARPETA_EXPORTACION,
+                        help=f"Carpeta de la exportación (por defecto: {CARPETA_EXPORTACION}). "
+                             "Usa una carpeta nueva para exportar todo desde el principio.")
+    parser.add_argument("--bd", default=NOMBRE_BD, help=f"Base de datos SQLite (por defecto: {NOMBRE_BD}).")
+    parser.add_argument("--filas-por-lote", type=int, default=FILAS_POR_LOTE_EXPORTACION,
+                        help=f"Filas leídas y escritas de una vez (por defecto: {FILAS_POR_LOTE_EXPORTACION}).")
+    parser.add_argument("--margen-segundos", type=int, default=MARGEN_MARCA_AGUA_SEGUNDOS,
+                        help="Las facturas procesadas en los últimos segundos se dejan para la próxima "
+                             f"exportación (por defecto: {MARGEN_MARCA_AGUA_SEGUNDOS}).")
+    parser.add_argument("--nivel-registro", default=NIVEL_REGISTRO,
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help=f"Nivel mínimo de los mensajes (por defecto: {NIVEL_REGISTRO}).")
+    args = parser.parse_args(argv)
+    configurar_registro(args.nivel_registro)
+    if args.filas_por_lote < 1 or args.margen_segundos < 0:
+        log.error("Error: Las filas por lote deben ser al menos 1 y el margen no puede ser negativo.")
+        sys.exit(1)
+    if not os.path.exists(args.bd):
+        log.error(f"Error: La base de datos '{args.bd}' no fue encontrada.")
+        sys.exit(1)
+
+    # Solo lectura: la exportación puede correr mientras se procesan facturas (modo WAL)
+    conn = sqlite3.connect(f"file:{args.bd}?mode=ro", uri=True)
+    try:
+        exportar_facturas(conn, args.destino, args.formato, args.filas_por_lote, args.margen_segundos)
+    except (ImportError, ValueError) as e:
+        log.error(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
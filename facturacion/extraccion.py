@@ -0,0 +1,460 @@
+"""
+Extracción del texto de los PDFs: texto nativo con PyMuPDF o pdfplumber y OCR
+con Tesseract solo para las páginas que lo necesitan. Las páginas se recorren
+una a una, con límites de páginas, texto, tiempo y memoria por documento.
+
+PyMuPDF, pdfplumber, Pillow y pytesseract se importan al usarse por primera
+vez, así que importar este módulo no los carga.
+"""
+import io
+import os
+import math
+import time
+import shutil
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .configuracion import (CONFIG_TESSERACT, DPI_OCR, IDIOMA_OCR, MAX_BYTES_TEXTO_DOCUMENTO,
+                            MAX_MEGAPIXELES_PAGINA_OCR, MAX_MEMORIA_DOCUMENTO_MB, MAX_PAGINAS_DOCUMENTO,
+                            MAX_SEGUNDOS_DOCUMENTO, MOTOR_OCR, PARADA_TEMPRANA_OCR, PATRON_ENCABEZADO_FACTURA,
+                            PATRON_TOTAL_FACTURA, SEPARADOR_PAGINA_NATIVA, SEPARADOR_PAGINA_OCR,
+                            TRABAJADORES_OCR_PAGINAS)
+from .registro import METRICAS
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['configurar_proceso_extraccion', 'renderizar_pagina_ocr', 'unir_textos_paginas',
+           'comprobar_tesseract', 'DocumentoPDF', 'EXTRACTORES_NATIVOS', 'MARCA_PAGINAS_OMITIDAS',
+           'PresupuestoDocumento', 'iterar_textos_paginas', 'extraer_texto_de_pdf',
+           'extraer_texto_con_metricas']
+
+
+_ocr_local = threading.local()
+
+# Hilos de OCR por documento en este proceso (ver configurar_proceso_extraccion)
+_hilos_ocr_paginas = TRABAJADORES_OCR_PAGINAS
+
+
+def configurar_proceso_extraccion(trabajadores_extraccion=1):
+    """
+    Prepara el proceso actual para extraer texto en paralelo con otros
+    'trabajadores_extraccion' procesos: les reparte los TRABAJADORES_OCR_PAGINAS
+    hilos de OCR y limita Tesseract a un hilo por página (OMP_THREAD_LIMIT, salvo
+    que ya esté configurado), para no lanzar más Tesseract que núcleos.
+    """
+    global _hilos_ocr_paginas
+    _hilos_ocr_paginas = max(1, TRABAJADORES_OCR_PAGINAS // max(1, trabajadores_extraccion))
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def _ocr_imagen(imagen):
+    """
+    Aplica OCR a una imagen con el motor configurado.
+    Retorna el texto y los segundos que tardó.
+    """
+    inicio = time.perf_counter()
+    if MOTOR_OCR == 'tesserocr':
+        # Una instancia de la API por hilo: evita lanzar un proceso por página
+        api = getattr(_ocr_local, 'api', None)
+        if api is None:
+            import tesserocr
+            api = _ocr_local.api = tesserocr.PyTessBaseAPI(lang=IDIOMA_OCR)
+        api.SetImage(imagen)
+        texto = api.GetUTF8Text()
+    else:
+        import pytesseract
+        texto = pytesseract.image_to_string(imagen, lang=IDIOMA_OCR, config=CONFIG_TESSERACT) # Especifica el idioma
+    return texto, time.perf_counter() - inicio
+
+
+def _ocr_pixmap(pix):
+    """
+    Aplica OCR a un pixmap en escala de grises. La imagen de Pillow usa la memoria
+    del pixmap sin copiarla; ambos se liberan al terminar.
+    Retorna el texto y los segundos que tardó.
+    """
+    from PIL import Image
+    imagen = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+    try:
+        return _ocr_imagen(imagen)
+    finally:
+        imagen.close() # Antes que el pixmap, cuya memoria comparte
+
+
+def renderizar_pagina_ocr(pagina, dpi=DPI_OCR, max_megapixeles=MAX_MEGAPIXELES_PAGINA_OCR):
+    """
+    Renderiza una página de fitz en escala de grises para OCR, reduciendo la
+    resolución si la imagen superaría 'max_megapixeles' millones de píxeles.
+    """
+    import fitz  # PyMuPDF (se importa como fitz)
+    megapixeles = (pagina.rect.width / 72 * dpi) * (pagina.rect.height / 72 * dpi) / 1e6
+    if max_megapixeles and megapixeles > max_megapixeles:
+        dpi = max(1, int(dpi * math.sqrt(max_megapixeles / megapixeles)))
+    pix = pagina.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    # La imagen escaneada decodificada no se vuelve a usar: sin esto, la caché de
+    # MuPDF crece con cada página hasta su límite (256 MB)
+    fitz.TOOLS.store_shrink(100)
+    return pix
+
+
+def unir_textos_paginas(textos):
+    """
+    Une los textos de OCR por página (diccionario número -> texto) en orden,
+    con un separador tras cada página.
+    """
+    return "".join(textos[pagina_num] + SEPARADOR_PAGINA_OCR for pagina_num in sorted(textos))
+
+
+# Resultado de la comprobación de Tesseract en este proceso (None = aún no comprobado)
+_tesseract_disponible = None
+
+
+def comprobar_tesseract(tesseract_cmd=None):
+    """
+    Comprueba una sola vez por proceso que el motor de OCR está disponible.
+    'tesseract_cmd' puede ser una ruta o un nombre a buscar en el PATH; si se
+    encuentra, se configura en pytesseract (los procesos hijos no heredan esa
+    configuración). Retorna True si se puede realizar OCR.
+    """
+    global _tesseract_disponible
+    if _tesseract_disponible is not None:
+        return _tesseract_disponible
+
+    if MOTOR_OCR == 'tesserocr':
+        try:
+            import tesserocr # noqa: F401
+            _tesseract_disponible = True
+        except ImportError:
+            log.error("Error: MOTOR_OCR es 'tesserocr' pero la biblioteca tesserocr no está instalada.")
+            _tesseract_disponible = False
+        return _tesseract_disponible
+
+    import pytesseract
+    if tesseract_cmd:
+        ruta_tesseract = tesseract_cmd if os.path.exists(tesseract_cmd) else shutil.which(tesseract_cmd)
+        if not ruta_tesseract:
+            log.error(f"Error: La ruta al ejecutable de Tesseract OCR no es válida: {tesseract_cmd}")
+            log.error("No se puede realizar el OCR.")
+            _tesseract_disponible = False
+            return False
+        pytesseract.pytesseract.tesseract_cmd = ruta_tesseract
+
+    try:
+        pytesseract.get_tesseract_version()
+        _tesseract_disponible = True
+    except pytesseract.TesseractNotFoundError:
+        log.error("Error: Motor Tesseract OCR no encontrado en el PATH del sistema.")
+        log.error("Instálalo o configura la ruta en TESSERACT_CMD (facturacion/configuracion.py).")
+        _tesseract_disponible = False
+    return _tesseract_disponible
+
+
+class DocumentoPDF:
+    """
+    Un PDF abierto una sola vez con PyMuPDF. El documento de pdfplumber se abre
+    solo si algún extractor lo necesita.
+    """
+
+    def __init__(self, ruta_archivo):
+        import fitz  # PyMuPDF (se importa como fitz)
+        self.ruta_archivo = ruta_archivo
+        self.doc_fitz = fitz.open(ruta_archivo)
+        self._pdf_pdfplumber = None
+
+    @property
+    def numero_paginas(self):
+        return self.doc_fitz.page_count
+
+    @property
+    def pdf_pdfplumber(self):
+        if self._pdf_pdfplumber is None:
+            import pdfplumber
+            self._pdf_pdfplumber = pdfplumber.open(self.ruta_archivo)
+        return self._pdf_pdfplumber
+
+    def cerrar(self):
+        if self._pdf_pdfplumber is not None:
+            self._pdf_pdfplumber.close()
+        self.doc_fitz.close()
+
+
+def _texto_nativo_fitz(documento, pagina_num):
+    return documento.doc_fitz.load_page(pagina_num).get_text()
+
+
+def _texto_nativo_pdfplumber(documento, pagina_num):
+    pagina = documento.pdf_pdfplumber.pages[pagina_num]
+    try:
+        return pagina.extract_text() or ""
+    finally:
+        pagina.close() # pdfplumber conserva los objetos de cada página leída hasta cerrarla
+
+
+# Extractores de texto nativo, en orden de preferencia. Cada uno recibe un
+# DocumentoPDF y un número de página y retorna el texto de esa página. Se prueban
+# en orden hasta que una página alcanza el umbral de caracteres; las que no lo
+# alcanzan con ninguno pasan al OCR.
+EXTRACTORES_NATIVOS = (
+    ('PyMuPDF', _texto_nativo_fitz),      # Rápido: la mayoría de las páginas digitales terminan aquí
+    ('pdfplumber', _texto_nativo_pdfplumber),
+)
+
+# Línea que reemplaza a las páginas no procesadas de un documento truncado
+MARCA_PAGINAS_OMITIDAS = "[... {paginas} páginas omitidas ...]\n"
+
+
+def _memoria_residente_mb():
+    """
+    Retorna la memoria residente del proceso en MB, o None si el sistema no la
+    informa (se lee de /proc, así que solo está disponible en Linux).
+    """
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class PresupuestoDocumento:
+    """
+    Límites de texto, tiempo y memoria para extraer el texto de un documento.
+    El límite de páginas lo aplica _paginas_a_procesar antes de empezar.
+    """
+
+    # Descripción de cada límite para los mensajes
+    DESCRIPCIONES = {
+        'paginas': "páginas",
+        'bytes': "tamaño del texto",
+        'tiempo': "tiempo",
+        'memoria': "memoria",
+    }
+
+    def __init__(self, max_bytes=MAX_BYTES_TEXTO_DOCUMENTO, max_segundos=MAX_SEGUNDOS_DOCUMENTO,
+                 max_memoria_mb=MAX_MEMORIA_DOCUMENTO_MB):
+        self.max_bytes = max_bytes
+        self.max_segundos = max_segundos
+        self.max_memoria_mb = max_memoria_mb
+        self.bytes_texto = 0
+        self.motivo_truncado = None # Lo registra iterar_textos_paginas al detenerse
+        self._inicio = time.monotonic()
+        self._memoria_inicial = _memoria_residente_mb() if max_memoria_mb is not None else None
+
+    def sumar_texto(self, texto):
+        self.bytes_texto += len(texto.encode('utf-8'))
+
+    def agotado(self):
+        """
+        Retorna el primer límite alcanzado ('bytes', 'tiempo' o 'memoria'), o None.
+        """
+        if self.max_bytes is not None and self.bytes_texto >= self.max_bytes:
+            return 'bytes'
+        if self.max_segundos is not None and time.monotonic() - self._inicio >= self.max_segundos:
+            return 'tiempo'
+        if self._memoria_inicial is not None:
+            memoria = _memoria_residente_mb()
+            if memoria is not None and memoria - self._memoria_inicial >= self.max_memoria_mb:
+                return 'memoria'
+        return None
+
+
+def _paginas_a_procesar(numero_paginas, max_paginas=MAX_PAGINAS_DOCUMENTO):
+    """
+    Retorna los números de página a procesar: todas, o si son más de 'max_paginas',
+    las primeras y la última (donde suelen estar los totales).
+    """
+    if max_paginas is None or numero_paginas <= max_paginas:
+        return list(range(numero_paginas))
+    return list(range(max(max_paginas - 1, 0))) + [numero_paginas - 1]
+
+
+def iterar_textos_paginas(documento, nombre_base_archivo, umbral_caracteres, tesseract_cmd=None,
+                          presupuesto=None, max_paginas=MAX_PAGINAS_DOCUMENTO, dpi=DPI_OCR,
+                          trabajadores=None, parada_temprana=PARADA_TEMPRANA_OCR):
+    """
+    Genera (número de página, texto, método) para las páginas de un DocumentoPDF,
+    en orden. Cada página usa el primer extractor de EXTRACTORES_NATIVOS que
+    obtenga al menos 'umbral_caracteres' caracteres; las demás (escaneadas) se
+    renderizan y se procesan con OCR en un pool de 'trabajadores' hilos (por
+    defecto, los asignados a este proceso por configurar_proceso_extraccion). Como
+    mucho hay 'trabajadores' imágenes en memoria, y cada pixmap se libera en
+    cuanto termina su OCR. Si se agota el 'presupuesto', deja de leer páginas
+    y guarda el motivo en 'presupuesto.motivo_truncado'.
+    """
+    presupuesto = presupuesto or PresupuestoDocumento()
+    trabajadores = trabajadores or _hilos_ocr_paginas
+    extractores = list(EXTRACTORES_NATIVOS)
+    ocr_disponible = None # Se comprueba con la primera página que lo necesita
+    encabezado_encontrado = total_encontrado = False
+    pendientes = collections.deque() # (pagina_num, texto nativo, futuro del OCR o None, segundos de render)
+    en_vuelo = set() # OCR sin terminar: cada uno retiene el pixmap de su página
+
+    def _texto_nativo(pagina_num):
+        mejor = ""
+        for nombre_extractor, extractor in list(extractores):
+            try:
+                with METRICAS.cronometrar('facturas_pagina_duracion_segundos', etapa=f'texto_nativo_{nombre_extractor}'):
+                    texto_pagina = extractor(documento, pagina_num)
+            except Exception as e_extractor:
+                # Un extractor que falla con una página no se vuelve a usar en este documento
+                log.error(f"Error al extraer texto nativo con {nombre_extractor} de {nombre_base_archivo}: {e_extractor}")
+                extractores.remove((nombre_extractor, extractor))
+                continue
+            if len(texto_pagina.strip()) > len(mejor.strip()):
+                mejor = texto_pagina
+            if len(mejor.strip()) >= umbral_caracteres:
+                break
+        return mejor
+
+    def _resolver(pagina_num, texto_nativo, futuro, segundos_render):
+        # Retorna el texto de la página: el del OCR si no es más corto que el nativo
+        nonlocal encabezado_encontrado, total_encontrado
+        if futuro is None:
+            return pagina_num, texto_nativo, 'nativo'
+        try:
+            texto_ocr, segundos_ocr = futuro.result()
+        except Exception as e_ocr_pagina:
+            log.error(f"Error durante OCR en página {pagina_num} de {nombre_base_archivo} (fitz+tesseract): {e_ocr_pagina}")
+            return pagina_num, texto_nativo, 'nativo'
+        METRICAS.observar('facturas_pagina_duracion_segundos', segundos_render, etapa='render')
+        METRICAS.observar('facturas_pagina_duracion_segundos', segundos_ocr, etapa='ocr')
+        log.info(f"OCR página {pagina_num + 1}/{documento.numero_paginas} de {nombre_base_archivo}: "
+                 f"render {segundos_render:.2f} s, OCR {segundos_ocr:.2f} s",
+                 extra={'archivo': nombre_base_archivo, 'pagina': pagina_num + 1,
+                        'segundos_render': round(segundos_render, 3), 'segundos_ocr': round(segundos_ocr, 3)})
+        encabezado_encontrado = encabezado_encontrado or bool(PATRON_ENCABEZADO_FACTURA.search(texto_ocr))
+        total_encontrado = total_encontrado or bool(PATRON_TOTAL_FACTURA.search(texto_ocr))
+        if len(texto_ocr.strip()) >= len(texto_nativo.strip()):
+            return pagina_num, texto_ocr, 'ocr'
+        return pagina_num, texto_nativo, 'nativo'
+
+    def _listas():
+        # Entrega, en orden, las páginas del principio de la cola que ya están resueltas
+        while pendientes and (pendientes[0][2] is None or pendientes[0][2].done()):
+            pagina = _resolver(*pendientes.popleft())
+            presupuesto.sumar_texto(pagina[1])
+            yield pagina
+
+    with ThreadPoolExecutor(max_workers=trabajadores) as pool:
+        for pagina_num in _paginas_a_procesar(documento.numero_paginas, max_paginas):
+            presupuesto.motivo_truncado = presupuesto.agotado()
+            if presupuesto.motivo_truncado:
+                break
+
+            texto_nativo = _texto_nativo(pagina_num)
+            futuro, segundos_render = None, 0.0
+            if len(texto_nativo.strip()) < umbral_caracteres:
+                if ocr_disponible is None:
+                    ocr_disponible = comprobar_tesseract(tesseract_cmd)
+                    if not ocr_disponible:
+                        log.warning(f"Se usa el texto nativo disponible para las páginas escaneadas de {nombre_base_archivo}.")
+                elif ocr_disponible and parada_temprana and encabezado_encontrado and total_encontrado:
+                    log.info(f"Encabezado y total encontrados en {nombre_base_archivo}. "
+                             f"Se omite el OCR de las páginas restantes.")
+                    ocr_disponible = False # Las páginas restantes conservan su texto nativo
+                if ocr_disponible:
+                    en_vuelo = {futuro for futuro in en_vuelo if not futuro.done()}
+                    if len(en_vuelo) >= trabajadores:
+                        wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    try:
+                        inicio_render = time.perf_counter()
+                        pix = renderizar_pagina_ocr(documento.doc_fitz.load_page(pagina_num), dpi)
+                        segundos_render = time.perf_counter() - inicio_render
+                        futuro = pool.submit(_ocr_pixmap, pix)
+                        del pix # El pixmap queda solo en manos del hilo de OCR
+                        en_vuelo.add(futuro)
+                    except Exception as e_render:
+                        log.error(f"Error al renderizar la página {pagina_num} de {nombre_base_archivo} para OCR: {e_render}")
+
+            pendientes.append((pagina_num, texto_nativo, futuro, segundos_render))
+            yield from _listas()
+
+        # Páginas que quedaron esperando el OCR
+        while pendientes:
+            if pendientes[0][2] is not None:
+                wait([pendientes[0][2]])
+            yield from _listas()
+
+
+def extraer_texto_de_pdf(ruta_archivo, umbral_caracteres, tesseract_cmd=None):
+    """
+    Extrae el texto de un PDF página por página (ver iterar_textos_paginas). Abre
+    el documento una sola vez con PyMuPDF; solo las páginas sin texto nativo
+    suficiente se procesan con OCR, por lo que en un documento mixto no se repite
+    el OCR de las páginas digitales. El texto se escribe a medida que se obtiene
+    cada página. Si el documento supera MAX_PAGINAS_DOCUMENTO o se agota su
+    presupuesto de texto, tiempo o memoria, se trunca y las páginas no procesadas
+    se indican con MARCA_PAGINAS_OMITIDAS.
+    Retorna el texto extraído o None si hay un error grave.
+    """
+    nombre_base_archivo = os.path.basename(ruta_archivo)
+
+    try:
+        documento = DocumentoPDF(ruta_archivo)
+    except Exception as e:
+        log.error(f"Error: No se pudo abrir {nombre_base_archivo} con fitz: {e}")
+        return None
+
+    try:
+        if documento.numero_paginas == 0:
+            log.warning(f"El documento {nombre_base_archivo} no contiene páginas.")
+            return None
+
+        inicio = time.perf_counter()
+        presupuesto = PresupuestoDocumento()
+        texto = io.StringIO()
+        paginas_por_metodo = {'nativo': 0, 'ocr': 0}
+        anterior = -1
+        for pagina_num, texto_pagina, metodo in iterar_textos_paginas(documento, nombre_base_archivo, umbral_caracteres,
+                                                                       tesseract_cmd, presupuesto):
+            if pagina_num != anterior + 1:
+                texto.write(MARCA_PAGINAS_OMITIDAS.format(paginas=pagina_num - anterior - 1))
+            texto.write(texto_pagina)
+            texto.write(SEPARADOR_PAGINA_OCR if metodo == 'ocr' else SEPARADOR_PAGINA_NATIVA)
+            paginas_por_metodo[metodo] += 1
+            anterior = pagina_num
+        if anterior != documento.numero_paginas - 1:
+            texto.write(MARCA_PAGINAS_OMITIDAS.format(paginas=documento.numero_paginas - 1 - anterior))
+
+        procesadas = sum(paginas_por_metodo.values())
+        METRICAS.incrementar('facturas_paginas_total', paginas_por_metodo['nativo'], metodo='nativo')
+        METRICAS.incrementar('facturas_paginas_total', paginas_por_metodo['ocr'], metodo='ocr')
+        log.info(f"{nombre_base_archivo}: {paginas_por_metodo['nativo']} de {documento.numero_paginas} páginas con texto nativo"
+                 + (f", {paginas_por_metodo['ocr']} con OCR" if paginas_por_metodo['ocr'] else "")
+                 + f" ({time.perf_counter() - inicio:.2f} s).",
+                 extra={'archivo': nombre_base_archivo, 'paginas': documento.numero_paginas,
+                        'paginas_nativas': paginas_por_metodo['nativo'], 'paginas_ocr': paginas_por_metodo['ocr']})
+        if procesadas < documento.numero_paginas:
+            motivo = presupuesto.motivo_truncado or 'paginas'
+            METRICAS.incrementar('facturas_documentos_truncados_total', motivo=motivo)
+            log.warning(f"{nombre_base_archivo} se truncó por el límite de {PresupuestoDocumento.DESCRIPCIONES[motivo]}: "
+                        f"se procesaron {procesadas} de {documento.numero_paginas} páginas.",
+                        extra={'archivo': nombre_base_archivo, 'motivo_truncado': motivo})
+        texto_completo = texto.getvalue()
+
+    except Exception as e_general:
+        log.error(f"Error general durante la extracción de texto de {nombre_base_archivo}: {e_general}")
+        return None
+    finally:
+        documento.cerrar()
+
+    # --- Verificación final del texto extraído ---
+    if not texto_completo.strip():
+         log.warning(f"No se pudo extraer ningún texto útil de {nombre_base_archivo} después de intentar todos los métodos.")
+         return None
+
+    return texto_completo.strip()
+
+
+def extraer_texto_con_metricas(ruta_archivo, umbral_caracteres, tesseract_cmd=None):
+    """
+    extraer_texto_de_pdf para los procesos de extracción: retorna el texto y la
+    instantánea de las métricas que el proceso registró durante la extracción
+    (incluida su duración), para que el proceso principal las combine.
+    """
+    METRICAS.reiniciar()
+    with METRICAS.cronometrar('facturas_archivo_duracion_segundos', etapa='extraccion'):
+        texto = extraer_texto_de_pdf(ruta_archivo, umbral_caracteres, tesseract_cmd)
+    return texto, METRICAS.instantanea()
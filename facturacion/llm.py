@@ -0,0 +1,952 @@
+"""
+Extracción de datos con OpenAI: prompts, compactación del texto, caché de
+respuestas, control de tasa y reintentos, y solicitudes individuales o por lotes.
+
+La biblioteca openai se importa solo cuando hace falta llamar a la API (ante un
+fallo de la caché), así que importar este módulo no la carga.
+"""
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import collections
+import hashlib
+import sqlite3
+import logging
+import threading
+
+from .configuracion import (ESPERA_BASE_REINTENTO, ESPERA_MAXIMA_REINTENTO, LIMITE_SOLICITUDES_POR_MINUTO,
+                            LIMITE_TOKENS_POR_MINUTO, MAX_SOLICITUDES_EN_VUELO, PRECIOS_MODELOS_USD,
+                            REINTENTOS_OPENAI, SEPARADOR_PAGINA_NATIVA, SEPARADOR_PAGINA_OCR,
+                            TOKENS_RESPUESTA_ESTIMADOS)
+from .registro import METRICAS
+from .normalizacion import normalizar_total
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['VERSION_PROMPT', 'CAMPOS_FACTURA', 'INSTRUCCIONES_CAMPOS', 'PLANTILLA_PROMPT',
+           'PLANTILLA_PROMPT_LOTE', 'BLOQUE_FACTURA_LOTE', 'PRESUPUESTO_TOKENS_LOTE',
+           'MAX_FACTURAS_POR_LOTE', 'ESPERA_LOTE_SEGUNDOS', 'CARACTERES_POR_TOKEN', 'CacheLLM',
+           'estimar_tokens', 'validar_datos_extraidos', 'MAX_TOKENS_TEXTO_LLM',
+           'LINEAS_ENCABEZADO_TEXTO_LLM', 'LINEAS_CONTEXTO_TEXTO_LLM', 'PATRON_PALABRAS_CLAVE',
+           'PATRON_LINEA_RUIDO', 'PATRON_SEPARADOR_PAGINA', 'LINEAS_BORDE_PAGINA', 'MARCA_OMISION',
+           'compactar_texto_factura', 'preparar_texto_para_llm', 'ERRORES_TRANSITORIOS_OPENAI',
+           'importar_openai', 'es_error_transitorio_openai', 'LimitadorTasa', 'LIMITADOR_OPENAI',
+           'espera_indicada_por_openai', 'calcular_espera_reintento', 'ClienteOpenAIAsync',
+           'extraer_datos_con_openai', 'extraer_datos_con_openai_async', 'extraer_datos_de_cache',
+           'agrupar_en_lotes', 'extraer_datos_con_openai_lote', 'extraer_datos_con_openai_lote_async']
+
+
+# Versión de las plantillas del prompt. Forma parte de la clave de la caché de
+# respuestas: increméntala cada vez que cambies INSTRUCCIONES_CAMPOS, las plantillas
+# o el formato esperado, para que no se reutilicen respuestas del prompt anterior.
+VERSION_PROMPT = "2"
+
+# Campos que se piden al modelo para cada factura
+CAMPOS_FACTURA = ('numero_factura', 'fecha_emision', 'proveedor', 'cliente', 'total', 'impuestos', 'moneda')
+
+# Descripción de los campos a extraer, compartida por el prompt individual y el de lotes.
+INSTRUCCIONES_CAMPOS = """- numero_factura: El número único de la factura.
+    - fecha_emision: La fecha en que se emitió la factura (intenta un formato ISO 8601 como YYYY-MM-DD si es posible).
+    - proveedor: El nombre de la empresa que emitió la factura.
+    - cliente: El nombre del cliente a quien se emitió la factura.
+    - total: El monto total de la factura. Extrae solo el valor numérico como un número (float), manejando correctamente los separadores de miles (coma o punto) y el separador decimal (punto o coma). Por ejemplo:
+      - '1.234,56' debe ser 1234.56
+      - '1,234.56' debe ser 1234.56
+      - '1234.56' debe ser 1234.56
+      - '1234,56' debe ser 1234.56
+      - '73,900.00' debe ser 73900.00
+      Si el total no se encuentra, usa null.
+    - impuestos: La suma de los impuestos de la factura (IVA u otros), como número con las mismas reglas que el total. Si no figuran, usa null.
+    - moneda: El código ISO 4217 de la moneda de la factura (por ejemplo 'ARS', 'USD' o 'EUR'). Si no se indica, usa null.
+
+    Si no encuentras algún otro campo específico, usa null como valor."""
+
+# Prompt para el modelo de OpenAI (una factura por solicitud).
+PLANTILLA_PROMPT = """Eres un experto en extraer información clave de facturas.
+    Analiza el siguiente texto de una factura y extrae la siguiente información en formato JSON:
+    {instrucciones}
+
+    Texto de la factura:
+    ---
+    {texto_factura}
+    ---
+
+    JSON con la información extraída:
+    """
+
+# Prompt para el modo por lotes: varias facturas por solicitud, cada una con su ID.
+PLANTILLA_PROMPT_LOTE = """Eres un experto en extraer información clave de facturas.
+    A continuación hay varias facturas, cada una precedida por su ID. De cada factura extrae la siguiente información:
+    {instrucciones}
+
+    Responde con un objeto JSON con la clave "facturas", cuyo valor es una lista con un objeto por factura.
+    Cada objeto debe incluir el campo "id" con el ID de la factura exactamente como aparece, más los campos anteriores.
+
+    {bloques}
+
+    JSON con la información extraída:
+    """
+
+BLOQUE_FACTURA_LOTE = """ID: {id_factura}
+    ---
+    {texto_factura}
+    ---
+"""
+
+# --- Modo por lotes ---
+
+# Tokens máximos estimados por solicitud (instrucciones + textos de las facturas)
+PRESUPUESTO_TOKENS_LOTE = 12000
+
+# Número máximo de facturas por solicitud
+MAX_FACTURAS_POR_LOTE = 10
+
+# Segundos que la etapa de OpenAI espera para completar un lote antes de enviarlo incompleto
+ESPERA_LOTE_SEGUNDOS = 0.5
+
+# Aproximación usada para estimar tokens sin depender de un tokenizador
+CARACTERES_POR_TOKEN = 4
+
+
+class CacheLLM:
+    """
+    Caché persistente (SQLite) de respuestas del LLM.
+
+    La clave es el hash de (modelo, versión del prompt, texto normalizado), por lo
+    que volver a procesar texto idéntico no consume tokens. El tamaño total de las
+    respuestas guardadas está acotado: al superarlo se eliminan las de acceso más
+    antiguo (LRU). Es segura para usarse desde varios hilos.
+    """
+
+    def __init__(self, ruta_bd, tamano_maximo_bytes):
+        self.tamano_maximo_bytes = tamano_maximo_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta_bd, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS respuestas (
+                clave TEXT PRIMARY KEY,
+                respuesta TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                ultimo_acceso REAL NOT NULL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_acceso ON respuestas (ultimo_acceso)")
+        self._conn.commit()
+        self._tamano_total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+
+    @staticmethod
+    def calcular_clave(modelo_openai, version_prompt, texto):
+        """
+        Calcula la clave de caché. El texto se normaliza (espacios colapsados) para
+        que diferencias de espaciado entre extracciones no produzcan fallos.
+        """
+        texto_normalizado = " ".join(texto.split())
+        contenido = "\x1f".join((modelo_openai, version_prompt, texto_normalizado))
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+    def obtener(self, clave):
+        """
+        Retorna la respuesta guardada para 'clave' (y la marca como usada) o None.
+        """
+        with self._lock:
+            fila = self._conn.execute("SELECT respuesta FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                self.fallos += 1
+                METRICAS.incrementar('facturas_cache_llm_consultas_total', resultado='fallo')
+                return None
+            self.aciertos += 1
+            METRICAS.incrementar('facturas_cache_llm_consultas_total', resultado='acierto')
+            self._conn.execute("UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave))
+            self._conn.commit()
+            return fila[0]
+
+    def guardar(self, clave, respuesta):
+        """
+        Guarda una respuesta y, si se supera el tamaño máximo, elimina las
+        entradas usadas hace más tiempo.
+        """
+        tamano = len(respuesta.encode('utf-8'))
+        with self._lock:
+            anterior = self._conn.execute("SELECT tamano FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            self._conn.execute('''
+                INSERT OR REPLACE INTO respuestas (clave, respuesta, tamano, ultimo_acceso) VALUES (?, ?, ?, ?)
+            ''', (clave, respuesta, tamano, time.time()))
+            self._tamano_total += tamano - (anterior[0] if anterior else 0)
+            self._desalojar()
+            self._conn.commit()
+
+    def _desalojar(self):
+        # Elimina por lotes las entradas menos usadas hasta quedar por debajo del límite
+        while self._tamano_total > self.tamano_maximo_bytes:
+            antiguas = self._conn.execute(
+                "SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso LIMIT 100").fetchall()
+            if not antiguas:
+                self._tamano_total = 0
+                break
+            for clave, tamano in antiguas:
+                self._conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self._tamano_total -= tamano
+                if self._tamano_total <= self.tamano_maximo_bytes:
+                    break
+
+    def resumen(self):
+        """
+        Retorna un texto con los aciertos, fallos y tamaño actual de la caché.
+        """
+        consultas = self.aciertos + self.fallos
+        tasa = (100.0 * self.aciertos / consultas) if consultas else 0.0
+        return (f"Caché LLM: {self.aciertos} aciertos, {self.fallos} fallos ({tasa:.1f}% de aciertos), "
+                f"{self._tamano_total / (1024 * 1024):.1f} MB de {self.tamano_maximo_bytes / (1024 * 1024):.0f} MB.")
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+
+def estimar_tokens(texto):
+    """
+    Estimación aproximada del número de tokens de un texto.
+    """
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
+
+def validar_datos_extraidos(datos_extraidos):
+    """
+    Comprueba que la respuesta para una factura es un objeto con todos los campos
+    esperados y que al menos uno de ellos tiene valor.
+    """
+    return (isinstance(datos_extraidos, dict)
+            and all(campo in datos_extraidos for campo in CAMPOS_FACTURA)
+            and any(datos_extraidos[campo] is not None for campo in CAMPOS_FACTURA))
+
+
+# --- Compactación del texto enviado a OpenAI ---
+
+# Tokens estimados máximos del texto de cada factura en el prompt (None = sin límite).
+# Los textos más largos se reducen a las regiones con datos clave (ver compactar_texto_factura).
+MAX_TOKENS_TEXTO_LLM = 1500
+
+# Líneas iniciales que se conservan siempre: suelen contener el bloque del proveedor
+LINEAS_ENCABEZADO_TEXTO_LLM = 12
+
+# Líneas de contexto que se conservan antes y después de cada línea con una palabra clave
+LINEAS_CONTEXTO_TEXTO_LLM = 2
+
+# Palabras que señalan las regiones con los campos que se piden al modelo
+PATRON_PALABRAS_CLAVE = re.compile(
+    r'factura|invoice|comprobante|n[°ºo]\.?\s*\d|nro|n[úu]mero|fecha|date|emisi[óo]n|vencimiento'
+    r'|total|subtotal|importe|iva|impuesto|tax|moneda|currency'
+    r'|cliente|se[ñn]or(?:es)?|bill\s+to|raz[óo]n\s+social|proveedor|emisor'
+    r'|\b(?:nif|cif|cuit|cuil|nit|ruc|rfc|rut|ein)\b', re.IGNORECASE)
+
+# Líneas sin información: numeración de páginas ('Página 2 de 5', 'Page 3 of 4', 'Pág. 1/2')
+# y filas de guiones, puntos o signos igual
+PATRON_LINEA_RUIDO = re.compile(
+    r'^(?:(?:p[áa]gina|page|hoja|p[áa]g\.?)\s*\d+(?:\s*(?:de|of|/)\s*\d+)?|[-=_.*\s]{3,})$', re.IGNORECASE)
+
+# Separadores entre las páginas del texto extraído (ver extraccion.extraer_texto_de_pdf)
+PATRON_SEPARADOR_PAGINA = re.compile(re.escape(SEPARADOR_PAGINA_OCR) + '|' + re.escape(SEPARADOR_PAGINA_NATIVA))
+
+# Líneas del principio y del final de cada página en las que se buscan encabezados y pies repetidos
+LINEAS_BORDE_PAGINA = 3
+
+# Marca que reemplaza las líneas omitidas en el texto compactado
+MARCA_OMISION = "[...]"
+
+
+def _limpiar_lineas(texto):
+    """
+    Retorna las líneas del texto con los espacios colapsados y sin líneas vacías.
+    """
+    return [linea for linea in (" ".join(linea.split()) for linea in texto.splitlines()) if linea]
+
+
+def _quitar_ruido(texto):
+    """
+    Retorna las líneas del texto (ver _limpiar_lineas) sin números de página,
+    separadores de página ni encabezados y pies repetidos. Una línea es un
+    encabezado o un pie si aparece igual (sin distinguir mayúsculas) en la misma
+    posición contada desde el principio o desde el final de varias páginas; se
+    conserva su primera aparición. Las líneas repetidas dentro de una página,
+    como dos artículos iguales, se mantienen.
+    """
+    paginas = [_limpiar_lineas(pagina) for pagina in PATRON_SEPARADOR_PAGINA.split(texto)]
+
+    def _bordes(lineas):
+        # (borde, posición, línea) de las líneas del principio y del final de la página, con su índice
+        for posicion in range(min(LINEAS_BORDE_PAGINA, len(lineas))):
+            yield ('inicio', posicion, lineas[posicion].casefold()), posicion
+            yield ('final', posicion, lineas[-1 - posicion].casefold()), len(lineas) - 1 - posicion
+
+    apariciones = collections.Counter(clave for lineas in paginas for clave, _ in _bordes(lineas))
+    vistas = set()
+    resultado = []
+    for lineas in paginas:
+        quitar = set()
+        for clave, indice in _bordes(lineas):
+            if apariciones[clave] > 1:
+                if clave in vistas:
+                    quitar.add(indice)
+                vistas.add(clave)
+        resultado.extend(linea for indice, linea in enumerate(lineas)
+                         if indice not in quitar and not PATRON_LINEA_RUIDO.match(linea))
+    return resultado
+
+
+def _seleccionar_regiones(lineas):
+    """
+    Retorna las líneas del encabezado y las cercanas a palabras clave, en su orden
+    original y con MARCA_OMISION en lugar de cada tramo descartado.
+    """
+    conservar = set(range(min(LINEAS_ENCABEZADO_TEXTO_LLM, len(lineas))))
+    for indice, linea in enumerate(lineas):
+        if PATRON_PALABRAS_CLAVE.search(linea):
+            conservar.update(range(max(0, indice - LINEAS_CONTEXTO_TEXTO_LLM),
+                                   min(len(lineas), indice + LINEAS_CONTEXTO_TEXTO_LLM + 1)))
+    seleccion = []
+    for indice, linea in enumerate(lineas):
+        if indice in conservar:
+            seleccion.append(linea)
+        elif not seleccion or seleccion[-1] != MARCA_OMISION:
+            seleccion.append(MARCA_OMISION)
+    return seleccion
+
+
+def _recortar(texto, max_tokens):
+    """
+    Recorta el texto a 'max_tokens' estimados conservando el principio (proveedor,
+    número y fecha) y el final (totales), con MARCA_OMISION entre ambos.
+    """
+    max_caracteres = max_tokens * CARACTERES_POR_TOKEN
+    if len(texto) <= max_caracteres:
+        return texto
+    caracteres_final = max_caracteres // 3
+    caracteres_inicio = max(0, max_caracteres - caracteres_final - len(MARCA_OMISION) - 2)
+    inicio = texto[:caracteres_inicio].rsplit("\n", 1)[0]
+    final = texto[len(texto) - caracteres_final:].split("\n", 1)[-1]
+    return f"{inicio}\n{MARCA_OMISION}\n{final}"
+
+
+def compactar_texto_factura(texto, max_tokens=MAX_TOKENS_TEXTO_LLM):
+    """
+    Reduce el texto de una factura antes de enviarlo a OpenAI: colapsa espacios y
+    quita las líneas vacías. Solo si supera 'max_tokens' estimados se quitan
+    también los números de página y los encabezados y pies repetidos en cada
+    página; si aún lo supera, se conservan solo el encabezado y las regiones
+    alrededor de las palabras clave (factura, fecha, total, CUIT/NIF, cliente...)
+    y, como último recurso, se recorta al límite. Con max_tokens=None solo se
+    colapsan los espacios.
+    """
+    compactado = "\n".join(_limpiar_lineas(texto))
+    if max_tokens is None or estimar_tokens(compactado) <= max_tokens:
+        return compactado
+    lineas = _quitar_ruido(texto)
+    compactado = "\n".join(lineas)
+    if estimar_tokens(compactado) <= max_tokens:
+        return compactado
+    return _recortar("\n".join(_seleccionar_regiones(lineas)), max_tokens)
+
+
+def preparar_texto_para_llm(archivo, max_tokens=MAX_TOKENS_TEXTO_LLM):
+    """
+    Guarda en archivo['texto_llm'] el texto compactado que se envía a OpenAI (el
+    texto completo se sigue guardando en la base de datos y usando en las
+    plantillas) y registra los tokens estimados ahorrados.
+    """
+    archivo['texto_llm'] = compactar_texto_factura(archivo['texto'], max_tokens)
+    tokens_originales = estimar_tokens(archivo['texto'])
+    tokens_enviados = estimar_tokens(archivo['texto_llm'])
+    METRICAS.incrementar('facturas_llm_tokens_texto_total', tokens_originales, texto='original')
+    METRICAS.incrementar('facturas_llm_tokens_texto_total', tokens_enviados, texto='compactado')
+    if tokens_enviados < tokens_originales:
+        log.info(f"Texto de {archivo['nombre_archivo']} compactado para OpenAI: {tokens_originales} -> "
+                 f"{tokens_enviados} tokens estimados ({tokens_originales - tokens_enviados} ahorrados).",
+                 extra={'archivo': archivo['nombre_archivo'], 'tokens_originales': tokens_originales,
+                        'tokens_enviados': tokens_enviados})
+
+
+# --- Control de tasa y reintentos de OpenAI ---
+
+# Errores de la biblioteca openai que suelen resolverse solos y justifican reintentar la solicitud
+ERRORES_TRANSITORIOS_OPENAI = ('RateLimitError', 'APITimeoutError', 'APIConnectionError', 'InternalServerError')
+
+
+def importar_openai():
+    """
+    Importa la biblioteca openai (la primera vez tarda, por eso no se hace al
+    importar este módulo) y desactiva sus reintentos internos: los reintentos,
+    con espera exponencial y respetando los límites de tasa, los gestiona este
+    módulo. La clave se toma de la variable de entorno OPENAI_API_KEY.
+    """
+    import openai
+    openai.max_retries = 0
+    return openai
+
+
+def _errores_transitorios():
+    openai = importar_openai()
+    return tuple(getattr(openai, nombre) for nombre in ERRORES_TRANSITORIOS_OPENAI)
+
+
+def _es_error_openai(error, nombre='APIError'):
+    # Si openai no se importó, el error no puede ser de la biblioteca (p. ej. JSON inválido en la caché)
+    openai = sys.modules.get('openai')
+    return openai is not None and isinstance(error, getattr(openai, nombre))
+
+
+def es_error_transitorio_openai(error):
+    """
+    Indica si 'error' es un error transitorio de OpenAI (429, timeout, 5xx o de
+    conexión), que justifica volver a procesar el archivo en otra ejecución. El
+    resto (JSON inválido, errores 4xx) se consideran permanentes.
+    """
+    return any(_es_error_openai(error, nombre) for nombre in ERRORES_TRANSITORIOS_OPENAI)
+
+
+def _parsear_duracion(valor):
+    """
+    Convierte duraciones de las cabeceras de OpenAI ('20ms', '1s', '6m0s') o un
+    número de segundos a float. Retorna None si no se puede interpretar.
+    """
+    if valor is None:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    partes = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', str(valor))
+    if not partes:
+        return None
+    factores = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(cantidad) * factores[unidad] for cantidad, unidad in partes)
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas (token bucket) para las solicitudes y los tokens por minuto
+    permitidos por OpenAI. Cada solicitud reserva capacidad antes de enviarse y
+    espera lo necesario para no superar el límite. Los límites se ajustan con las
+    cabeceras 'x-ratelimit-*' de cada respuesta, y un 429 pausa todas las
+    solicitudes. Es segura para hilos y sirve tanto al modo síncrono como al asíncrono.
+    """
+
+    def __init__(self, solicitudes_por_minuto=None, tokens_por_minuto=None):
+        self._lock = threading.Lock()
+        self._pausa_hasta = 0.0
+        self.configurar(solicitudes_por_minuto, tokens_por_minuto)
+
+    def configurar(self, solicitudes_por_minuto=None, tokens_por_minuto=None):
+        """
+        Fija los límites por minuto (None = sin límite) con la cubeta llena.
+        """
+        with self._lock:
+            self.solicitudes_por_minuto = solicitudes_por_minuto
+            self.tokens_por_minuto = tokens_por_minuto
+            self._solicitudes_disponibles = float(solicitudes_por_minuto or 0)
+            self._tokens_disponibles = float(tokens_por_minuto or 0)
+            self._ultima_recarga = time.monotonic()
+
+    def _recargar(self, ahora):
+        transcurrido = ahora - self._ultima_recarga
+        self._ultima_recarga = ahora
+        if self.solicitudes_por_minuto:
+            self._solicitudes_disponibles = min(float(self.solicitudes_por_minuto),
+                                                self._solicitudes_disponibles + transcurrido * self.solicitudes_por_minuto / 60)
+        if self.tokens_por_minuto:
+            self._tokens_disponibles = min(float(self.tokens_por_minuto),
+                                           self._tokens_disponibles + transcurrido * self.tokens_por_minuto / 60)
+
+    def reservar(self, tokens):
+        """
+        Reserva capacidad para una solicitud de 'tokens' tokens estimados.
+        Retorna los segundos que hay que esperar antes de enviarla (0 si puede enviarse ya).
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            self._recargar(ahora)
+            espera = max(0.0, self._pausa_hasta - ahora)
+            # La capacidad se descuenta aunque no alcance: el saldo negativo indica
+            # cuánto falta y hace que las solicitudes siguientes esperen en orden.
+            if self.solicitudes_por_minuto:
+                self._solicitudes_disponibles -= 1
+                if self._solicitudes_disponibles < 0:
+                    espera = max(espera, -self._solicitudes_disponibles * 60 / self.solicitudes_por_minuto)
+            if self.tokens_por_minuto:
+                self._tokens_disponibles -= tokens
+                if self._tokens_disponibles < 0:
+                    espera = max(espera, -self._tokens_disponibles * 60 / self.tokens_por_minuto)
+            return espera
+
+    def actualizar(self, cabeceras):
+        """
+        Ajusta los límites y la capacidad disponible con las cabeceras de una respuesta.
+        """
+        def _numero(nombre):
+            try:
+                return float(cabeceras.get(nombre))
+            except (TypeError, ValueError):
+                return None
+
+        limite_solicitudes = _numero('x-ratelimit-limit-requests')
+        limite_tokens = _numero('x-ratelimit-limit-tokens')
+        restantes_solicitudes = _numero('x-ratelimit-remaining-requests')
+        restantes_tokens = _numero('x-ratelimit-remaining-tokens')
+        with self._lock:
+            self._recargar(time.monotonic())
+            if limite_solicitudes:
+                if not self.solicitudes_por_minuto:
+                    self._solicitudes_disponibles = limite_solicitudes
+                self.solicitudes_por_minuto = limite_solicitudes
+            if limite_tokens:
+                if not self.tokens_por_minuto:
+                    self._tokens_disponibles = limite_tokens
+                self.tokens_por_minuto = limite_tokens
+            if restantes_solicitudes is not None and self.solicitudes_por_minuto:
+                self._solicitudes_disponibles = min(self._solicitudes_disponibles, restantes_solicitudes)
+            if restantes_tokens is not None and self.tokens_por_minuto:
+                self._tokens_disponibles = min(self._tokens_disponibles, restantes_tokens)
+
+    def pausar(self, segundos):
+        """
+        Detiene el envío de nuevas solicitudes durante 'segundos' (tras un 429).
+        """
+        with self._lock:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+
+
+# Limitador compartido por todas las solicitudes del proceso
+LIMITADOR_OPENAI = LimitadorTasa(LIMITE_SOLICITUDES_POR_MINUTO, LIMITE_TOKENS_POR_MINUTO)
+
+
+def espera_indicada_por_openai(error):
+    """
+    Segundos de espera que indica la respuesta de un error de OpenAI (cabeceras
+    Retry-After o, en un 429, las de reinicio de los límites), o None si no indica.
+    """
+    respuesta = getattr(error, 'response', None)
+    if respuesta is None:
+        return None
+    cabeceras = respuesta.headers
+    espera = _parsear_duracion(cabeceras.get('retry-after'))
+    if espera is None and cabeceras.get('retry-after-ms'):
+        espera = (_parsear_duracion(cabeceras.get('retry-after-ms')) or 0) / 1000
+    if espera is None and _es_error_openai(error, 'RateLimitError'):
+        espera = max(_parsear_duracion(cabeceras.get('x-ratelimit-reset-requests')) or 0,
+                     _parsear_duracion(cabeceras.get('x-ratelimit-reset-tokens')) or 0) or None
+    return espera
+
+
+def calcular_espera_reintento(intento, error=None):
+    """
+    Segundos a esperar antes del reintento número 'intento' (desde 0). Respeta la
+    cabecera Retry-After del error si existe; si no, usa espera exponencial con
+    jitter completo para que los reintentos simultáneos no coincidan.
+    """
+    espera = espera_indicada_por_openai(error)
+    if espera is not None:
+        return min(espera, ESPERA_MAXIMA_REINTENTO)
+    return random.uniform(0, min(ESPERA_MAXIMA_REINTENTO, ESPERA_BASE_REINTENTO * 2 ** intento))
+
+
+def _registrar_error_transitorio(error, intento, reintentos):
+    espera = calcular_espera_reintento(intento, error)
+    METRICAS.incrementar('facturas_llm_reintentos_total', error=type(error).__name__)
+    if _es_error_openai(error, 'RateLimitError'):
+        LIMITADOR_OPENAI.pausar(espera)
+    log.warning(f"Error transitorio de OpenAI ({type(error).__name__}). "
+                f"Reintento {intento + 1}/{reintentos} en {espera:.1f} s...")
+    return espera
+
+
+def _parametros_solicitud(modelo_openai, prompt):
+    return dict(
+        model=modelo_openai, 
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0 # Usa temperatura baja para resultados más precisos (reduce las alucionaciones del modelo al mínimo y devuelve una salida determinista)
+    )
+
+
+def _registrar_respuesta(modelo_openai, respuesta):
+    # Registra los tokens que informa la API en 'usage' y su costo estimado, y retorna el contenido
+    uso = getattr(respuesta, 'usage', None)
+    if uso is not None:
+        tokens_prompt = uso.prompt_tokens or 0
+        tokens_respuesta = uso.completion_tokens or 0
+        METRICAS.incrementar('facturas_llm_tokens_total', tokens_prompt, tipo='prompt')
+        METRICAS.incrementar('facturas_llm_tokens_total', tokens_respuesta, tipo='completion')
+        precios = PRECIOS_MODELOS_USD.get(modelo_openai)
+        if precios:
+            METRICAS.incrementar('facturas_llm_costo_usd_total',
+                                 (tokens_prompt * precios[0] + tokens_respuesta * precios[1]) / 1_000_000)
+    return respuesta.choices[0].message.content
+
+
+def _registrar_solicitud(modo, resultado, inicio):
+    # Duración (con reintentos) y resultado de una solicitud a OpenAI
+    METRICAS.observar('facturas_llm_duracion_segundos', time.perf_counter() - inicio, modo=modo)
+    METRICAS.incrementar('facturas_llm_solicitudes_total', modo=modo, resultado=resultado)
+
+
+def _llamar_openai(modelo_openai, prompt, reintentos=REINTENTOS_OPENAI, modo='individual'):
+    """
+    Realiza la solicitud a OpenAI en modo JSON y retorna el contenido de la respuesta.
+    Respeta el limitador de tasa y reintenta los errores transitorios. La duración,
+    los tokens y el costo se registran en METRICAS con el 'modo' indicado.
+    """
+    openai = importar_openai()
+    tokens = estimar_tokens(prompt) + TOKENS_RESPUESTA_ESTIMADOS
+    inicio = time.perf_counter()
+    resultado = 'error'
+    try:
+        for intento in range(reintentos + 1):
+            espera = LIMITADOR_OPENAI.reservar(tokens)
+            if espera:
+                time.sleep(espera)
+            try:
+                respuesta_cruda = openai.chat.completions.with_raw_response.create(**_parametros_solicitud(modelo_openai, prompt))
+                LIMITADOR_OPENAI.actualizar(respuesta_cruda.headers)
+                contenido = _registrar_respuesta(modelo_openai, respuesta_cruda.parse())
+                resultado = 'ok'
+                return contenido
+            except _errores_transitorios() as e:
+                if intento == reintentos:
+                    raise
+                time.sleep(_registrar_error_transitorio(e, intento, reintentos))
+    finally:
+        _registrar_solicitud(modo, resultado, inicio)
+
+
+class ClienteOpenAIAsync:
+    """
+    Cliente asíncrono de OpenAI que limita las solicitudes en vuelo con un
+    semáforo y comparte el limitador de tasa y la política de reintentos del
+    modo síncrono. Debe crearse dentro del bucle de eventos que lo usa. El
+    cliente de openai se crea con la primera solicitud, así una ejecución que
+    se resuelve con la caché no importa la biblioteca.
+    """
+
+    def __init__(self, max_en_vuelo=MAX_SOLICITUDES_EN_VUELO, reintentos=REINTENTOS_OPENAI):
+        self._cliente = None
+        self._semaforo = asyncio.Semaphore(max_en_vuelo)
+        self.reintentos = reintentos
+
+    async def completar(self, modelo_openai, prompt, modo='individual'):
+        """
+        Equivalente asíncrono de _llamar_openai.
+        """
+        if self._cliente is None:
+            self._cliente = importar_openai().AsyncOpenAI(max_retries=0)
+        tokens = estimar_tokens(prompt) + TOKENS_RESPUESTA_ESTIMADOS
+        inicio = time.perf_counter()
+        resultado = 'error'
+        try:
+            for intento in range(self.reintentos + 1):
+                espera = LIMITADOR_OPENAI.reservar(tokens)
+                if espera:
+                    await asyncio.sleep(espera)
+                try:
+                    async with self._semaforo:
+                        respuesta_cruda = await self._cliente.chat.completions.with_raw_response.create(
+                            **_parametros_solicitud(modelo_openai, prompt))
+                    LIMITADOR_OPENAI.actualizar(respuesta_cruda.headers)
+                    contenido = _registrar_respuesta(modelo_openai, respuesta_cruda.parse())
+                    resultado = 'ok'
+                    return contenido
+                except _errores_transitorios() as e:
+                    if intento == self.reintentos:
+                        raise
+                    await asyncio.sleep(_registrar_error_transitorio(e, intento, self.reintentos))
+        finally:
+            _registrar_solicitud(modo, resultado, inicio)
+
+    async def cerrar(self):
+        if self._cliente is not None:
+            await self._cliente.close()
+
+
+# --- Extracción de datos con OpenAI ---
+
+def _consultar_cache(cache, modelo_openai, texto_factura):
+    # Retorna (clave, respuesta guardada o None)
+    if cache is None:
+        return None, None
+    clave_cache = cache.calcular_clave(modelo_openai, VERSION_PROMPT, texto_factura)
+    return clave_cache, cache.obtener(clave_cache)
+
+
+def _interpretar_respuesta(json_respuesta):
+    # Convierte la respuesta JSON del modelo en el diccionario de datos, con el total normalizado
+    datos_extraidos = json.loads(json_respuesta)
+
+    # Lógica de limpieza de total mejorada para convertir a float 
+    if datos_extraidos.get('total') is not None:
+        datos_extraidos['total'] = normalizar_total(datos_extraidos['total'])
+    if datos_extraidos.get('impuestos') is not None:
+        datos_extraidos['impuestos'] = normalizar_total(datos_extraidos['impuestos'])
+    return datos_extraidos
+
+
+def _informar_error_openai(error, json_respuesta, errores=None):
+    # Registra el error y, si se indica, lo agrega a la lista 'errores' del llamador
+    if errores is not None:
+        errores.append(error)
+    if _es_error_openai(error):
+        log.error(f"Error de la API de OpenAI: {error}")
+    elif isinstance(error, json.JSONDecodeError):
+        log.error(f"Error al parsear la respuesta JSON de OpenAI. Respuesta recibida: {(json_respuesta or '')[:500]}...") # Registra parte de la respuesta para depurar
+    else:
+        log.error(f"Error desconocido al llamar a OpenAI: {error}")
+    return None
+
+
+def extraer_datos_con_openai(texto_factura, modelo_openai, cache=None, errores=None):
+    """
+    Envía el texto de la factura a la API de OpenAI para extraer datos clave.
+    Si se indica una 'cache' (CacheLLM), reutiliza la respuesta guardada para el
+    mismo modelo, versión de prompt y texto, y guarda las respuestas nuevas.
+    Retorna un diccionario con los datos extraídos o None si falla; en ese caso
+    la excepción se agrega a la lista 'errores', si se indica.
+    """
+    clave_cache, json_respuesta = _consultar_cache(cache, modelo_openai, texto_factura)
+    try:
+        if json_respuesta is not None:
+            return _interpretar_respuesta(json_respuesta)
+
+        prompt = PLANTILLA_PROMPT.format(instrucciones=INSTRUCCIONES_CAMPOS, texto_factura=texto_factura)
+        json_respuesta = _llamar_openai(modelo_openai, prompt)
+        datos_extraidos = _interpretar_respuesta(json_respuesta)
+
+        # Solo se guardan respuestas que son JSON válido
+        if cache is not None:
+            cache.guardar(clave_cache, json_respuesta)
+        return datos_extraidos
+
+    except Exception as e:
+        return _informar_error_openai(e, json_respuesta, errores)
+
+
+async def extraer_datos_con_openai_async(cliente, texto_factura, modelo_openai, cache=None, errores=None):
+    """
+    Versión asíncrona de extraer_datos_con_openai usando un ClienteOpenAIAsync.
+    """
+    clave_cache, json_respuesta = _consultar_cache(cache, modelo_openai, texto_factura)
+    try:
+        if json_respuesta is not None:
+            return _interpretar_respuesta(json_respuesta)
+
+        prompt = PLANTILLA_PROMPT.format(instrucciones=INSTRUCCIONES_CAMPOS, texto_factura=texto_factura)
+        json_respuesta = await cliente.completar(modelo_openai, prompt)
+        datos_extraidos = _interpretar_respuesta(json_respuesta)
+
+        if cache is not None:
+            cache.guardar(clave_cache, json_respuesta)
+        return datos_extraidos
+
+    except Exception as e:
+        return _informar_error_openai(e, json_respuesta, errores)
+
+
+def extraer_datos_de_cache(texto_factura, modelo_openai, cache):
+    """
+    Retorna los datos guardados en la 'cache' (CacheLLM) para el texto de la
+    factura, sin llamar a OpenAI, o None si no están o no se pueden interpretar.
+    """
+    _, json_respuesta = _consultar_cache(cache, modelo_openai, texto_factura)
+    if json_respuesta is None:
+        return None
+    try:
+        return _interpretar_respuesta(json_respuesta)
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+def agrupar_en_lotes(textos, presupuesto_tokens, max_por_lote):
+    """
+    Agrupa pares (clave, texto) en lotes cuyo tamaño estimado en tokens, incluyendo
+    las instrucciones, no supera 'presupuesto_tokens'. Un texto que por sí solo
+    supera el presupuesto forma su propio lote.
+    """
+    tokens_base = estimar_tokens(PLANTILLA_PROMPT_LOTE) + estimar_tokens(INSTRUCCIONES_CAMPOS)
+    lote = []
+    tokens_lote = tokens_base
+    for clave, texto in textos:
+        tokens_texto = estimar_tokens(texto) + estimar_tokens(BLOQUE_FACTURA_LOTE)
+        if lote and (tokens_lote + tokens_texto > presupuesto_tokens or len(lote) >= max_por_lote):
+            yield lote
+            lote = []
+            tokens_lote = tokens_base
+        lote.append((clave, texto))
+        tokens_lote += tokens_texto
+    if lote:
+        yield lote
+
+
+def _prompt_lote(lote):
+    # IDs cortos y seguros dentro del prompt; se traducen de vuelta a las claves originales
+    claves_por_id = {f"F{indice}": clave for indice, (clave, _) in enumerate(lote, start=1)}
+    bloques = "\n".join(BLOQUE_FACTURA_LOTE.format(id_factura=id_factura, texto_factura=texto)
+                        for id_factura, (_, texto) in zip(claves_por_id, lote))
+    return PLANTILLA_PROMPT_LOTE.format(instrucciones=INSTRUCCIONES_CAMPOS, bloques=bloques), claves_por_id
+
+
+def _interpretar_respuesta_lote(json_respuesta, claves_por_id):
+    """
+    Retorna un diccionario clave -> datos crudos (sin validar) con las facturas
+    presentes en la respuesta de un lote.
+    """
+    respuesta = json.loads(json_respuesta)
+    facturas = respuesta.get('facturas') if isinstance(respuesta, dict) else respuesta
+    if not isinstance(facturas, list):
+        log.warning("La respuesta del lote no contiene la lista 'facturas'.")
+        return {}
+
+    resultados = {}
+    for datos in facturas:
+        if isinstance(datos, dict) and str(datos.get('id')) in claves_por_id:
+            clave = claves_por_id[str(datos.pop('id'))]
+            resultados[clave] = datos
+    return resultados
+
+
+def _informar_error_lote(error, json_respuesta):
+    if _es_error_openai(error):
+        log.error(f"Error de la API de OpenAI en la solicitud por lotes: {error}")
+    elif isinstance(error, json.JSONDecodeError):
+        log.error(f"Error al parsear la respuesta JSON del lote. Respuesta recibida: {(json_respuesta or '')[:500]}...")
+    else:
+        log.error(f"Error desconocido en la solicitud por lotes a OpenAI: {error}")
+    return {}
+
+
+def _solicitar_lote(lote, modelo_openai):
+    """
+    Envía un lote de facturas en una sola solicitud. Retorna un diccionario
+    clave -> datos crudos (sin validar) con las facturas presentes en la respuesta.
+    """
+    prompt, claves_por_id = _prompt_lote(lote)
+    json_respuesta = None
+    try:
+        json_respuesta = _llamar_openai(modelo_openai, prompt, modo='lote')
+        return _interpretar_respuesta_lote(json_respuesta, claves_por_id)
+    except Exception as e:
+        return _informar_error_lote(e, json_respuesta)
+
+
+async def _solicitar_lote_async(cliente, lote, modelo_openai):
+    """
+    Versión asíncrona de _solicitar_lote.
+    """
+    prompt, claves_por_id = _prompt_lote(lote)
+    json_respuesta = None
+    try:
+        json_respuesta = await cliente.completar(modelo_openai, prompt, modo='lote')
+        return _interpretar_respuesta_lote(json_respuesta, claves_por_id)
+    except Exception as e:
+        return _informar_error_lote(e, json_respuesta)
+
+
+def _separar_cacheados(textos, modelo_openai, cache):
+    # Retorna los resultados ya guardados en la caché y la lista (clave, texto) de pendientes
+    resultados = {}
+    pendientes = []
+    for clave, texto in textos.items():
+        _, json_respuesta = _consultar_cache(cache, modelo_openai, texto)
+        if json_respuesta is None:
+            pendientes.append((clave, texto))
+            continue
+        try:
+            resultados[clave] = _interpretar_respuesta(json_respuesta)
+        except (json.JSONDecodeError, AttributeError):
+            pendientes.append((clave, texto))
+    return resultados, pendientes
+
+
+def _registrar_resultado(resultados, clave, texto, datos_extraidos, modelo_openai, cache):
+    # Guarda en la caché (la respuesta individual de cada factura) y en 'resultados'
+    if datos_extraidos is None:
+        resultados[clave] = None
+        return
+    if cache is not None:
+        cache.guardar(cache.calcular_clave(modelo_openai, VERSION_PROMPT, texto),
+                      json.dumps(datos_extraidos, ensure_ascii=False))
+    datos_extraidos['total'] = normalizar_total(datos_extraidos.get('total'))
+    datos_extraidos['impuestos'] = normalizar_total(datos_extraidos.get('impuestos'))
+    resultados[clave] = datos_extraidos
+
+
+def _registrar_errores(errores, clave, errores_factura):
+    # Conserva el último error de la factura en el diccionario 'errores' del llamador
+    if errores is not None and errores_factura:
+        errores[clave] = errores_factura[-1]
+
+
+def _respuestas_invalidas(lote, respuestas):
+    # Pares (clave, texto) del lote cuya respuesta falta o no pasa la validación
+    if len(lote) > 1:
+        log.info(f"Lote de {len(lote)} facturas enviado a OpenAI: {len(respuestas)} respuestas recibidas.")
+    invalidas = [(clave, texto) for clave, texto in lote if not validar_datos_extraidos(respuestas.get(clave))]
+    if len(lote) > 1:
+        for clave, _ in invalidas:
+            log.warning(f"Respuesta inválida o ausente para {clave} en el lote. Reintentando individualmente...")
+    return invalidas
+
+
+def extraer_datos_con_openai_lote(textos, modelo_openai, cache=None,
+                                  presupuesto_tokens=PRESUPUESTO_TOKENS_LOTE,
+                                  max_por_lote=MAX_FACTURAS_POR_LOTE, errores=None):
+    """
+    Extrae los datos de varias facturas agrupándolas en solicitudes bajo un
+    presupuesto de tokens. 'textos' es un diccionario clave -> texto de la factura.
+    Las facturas cuya respuesta falta o no pasa la validación se reintentan con
+    extraer_datos_con_openai. Retorna un diccionario clave -> datos (o None).
+    Si se indica el diccionario 'errores', guarda en él clave -> excepción de las
+    facturas que fallaron.
+    """
+    resultados, pendientes = _separar_cacheados(textos, modelo_openai, cache)
+
+    for lote in agrupar_en_lotes(pendientes, presupuesto_tokens, max_por_lote):
+        respuestas = _solicitar_lote(lote, modelo_openai) if len(lote) > 1 else {}
+        invalidas = _respuestas_invalidas(lote, respuestas)
+        for clave, texto in lote:
+            if (clave, texto) in invalidas:
+                # La caché ya se consultó arriba: se llama sin ella y se guarda el resultado aquí
+                errores_factura = []
+                respuestas[clave] = extraer_datos_con_openai(texto, modelo_openai, errores=errores_factura)
+                _registrar_errores(errores, clave, errores_factura)
+            _registrar_resultado(resultados, clave, texto, respuestas[clave], modelo_openai, cache)
+
+    return resultados
+
+
+async def extraer_datos_con_openai_lote_async(cliente, textos, modelo_openai, cache=None,
+                                              presupuesto_tokens=PRESUPUESTO_TOKENS_LOTE,
+                                              max_por_lote=MAX_FACTURAS_POR_LOTE, errores=None):
+    """
+    Versión asíncrona de extraer_datos_con_openai_lote: los lotes se envían de forma concurrente.
+    """
+    resultados, pendientes = _separar_cacheados(textos, modelo_openai, cache)
+
+    async def _procesar(lote):
+        respuestas = await _solicitar_lote_async(cliente, lote, modelo_openai) if len(lote) > 1 else {}
+        invalidas = _respuestas_invalidas(lote, respuestas)
+        for clave, texto in lote:
+            if (clave, texto) in invalidas:
+                errores_factura = []
+                respuestas[clave] = await extraer_datos_con_openai_async(cliente, texto, modelo_openai,
+                                                                         errores=errores_factura)
+                _registrar_errores(errores, clave, errores_factura)
+            _registrar_resultado(resultados, clave, texto, respuestas[clave], modelo_openai, cache)
+
+    await asyncio.gather(*(_procesar(lote) for lote in agrupar_en_lotes(pendientes, presupuesto_tokens, max_por_lote)))
+    return resultados
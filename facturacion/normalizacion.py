@@ -0,0 +1,148 @@
+"""
+Normalización de los datos extraídos: montos, fechas, monedas, nombres de proveedor
+y números de factura.
+"""
+import re
+import decimal
+import datetime
+import logging
+import unicodedata
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['normalizar_total', 'MESES', 'PATRON_FECHA', 'normalizar_fecha', 'a_centavos',
+           'normalizar_moneda', 'normalizar_proveedor', 'PATRON_ETIQUETA_NUMERO',
+           'normalizar_numero_factura']
+
+
+def normalizar_total(valor, avisar_errores=True):
+    """
+    Convierte un monto (número o texto con símbolos y separadores de miles/decimales
+    en cualquier convención) a float. Retorna None si no se puede interpretar.
+    """
+    if valor is None:
+        return None
+
+    total_str = str(valor).strip()
+    total_limpio = total_str
+    try:
+        # Elimina símbolos de moneda y otros caracteres no numéricos excepto puntos y comas
+        total_limpio = re.sub(r'[^\d.,]', '', total_str)
+
+        # Maneja la ambigüedad del punto y coma como separadores de miles/decimales
+        if ',' in total_limpio and '.' in total_limpio:
+            
+            if total_limpio.rfind(',') > total_limpio.rfind('.'):
+                # Elimina puntos de miles, reemplazar coma decimal por punto.
+                total_limpio = total_limpio.replace('.', '').replace(',', '.')
+            else:
+                # Eliminar comas de miles, el punto decimal está bien.
+                total_limpio = total_limpio.replace(',', '')
+        elif ',' in total_limpio:
+            # Solo coma presente. Asumir decimal si está al final y hay 1 o 2 dígitos después.
+            # Si no son centavos al final, asume que es una coma de miles y la elimina.
+            if re.search(r',\d{1,2}$', total_limpio):
+                 total_limpio = total_limpio.replace(',', '.')
+            else:
+                 total_limpio = total_limpio.replace(',', '') # Eliminar coma de miles
+
+        elif total_limpio.count('.') > 1:
+            # Varios puntos y ninguna coma: son separadores de miles (p. ej. '11.210.000').
+            total_limpio = total_limpio.replace('.', '')
+
+        # Si solo hay un punto, asumimos que es decimal y no se necesita reemplazar nada.
+        # Si no hay ni punto ni coma, se trata como un entero.
+
+        # Convertir a float
+        return float(total_limpio)
+
+    except (ValueError, TypeError, re.error) as e:
+         if avisar_errores:
+             log.error(f"Error al convertir total a float: {e}. String original: '{total_str}', String limpio tras limpieza inicial: '{total_limpio}'")
+         return None
+
+
+MESES = {'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+         'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12}
+
+# Fechas numéricas (día primero o ISO) y fechas en texto como '01 de febrero de 2014'
+PATRON_FECHA = (r'\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'
+                r'|\d{1,2}\s+de\s+[a-záéíóú]+\s+(?:del?\s+)?\d{4}')
+
+
+def normalizar_fecha(valor):
+    """
+    Convierte una fecha en texto a formato ISO (YYYY-MM-DD). Acepta ISO, formatos
+    numéricos con el día primero (05-05-2025, 05/05/25, 05.05.2025) y fechas en
+    español ('01 de febrero de 2014'). Retorna None si no se puede interpretar.
+    """
+    if not valor:
+        return None
+    texto = " ".join(str(valor).split()).lower()
+
+    coincidencia = re.fullmatch(r'(\d{1,2})\s+de\s+([a-záéíóú]+)\s+(?:del?\s+)?(\d{4})', texto)
+    if coincidencia:
+        mes = MESES.get(coincidencia.group(2))
+        if mes is None:
+            return None
+        try:
+            return datetime.date(int(coincidencia.group(3)), mes, int(coincidencia.group(1))).isoformat()
+        except ValueError:
+            return None
+
+    for formato in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d-%m-%y', '%d/%m/%y', '%d.%m.%y'):
+        try:
+            return datetime.datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def a_centavos(valor):
+    """
+    Convierte un monto (número o texto, ver normalizar_total) a centavos enteros,
+    redondeando la mitad hacia arriba. Retorna None si no se puede interpretar.
+    """
+    if not isinstance(valor, (int, float)):
+        valor = normalizar_total(valor, avisar_errores=False)
+        if valor is None:
+            return None
+    return int((decimal.Decimal(str(valor)) * 100).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+
+def normalizar_moneda(valor):
+    """
+    Retorna el código de moneda ISO 4217 en mayúsculas ('ARS', 'USD'...), o None
+    si el valor no tiene esa forma.
+    """
+    codigo = str(valor or "").strip().upper()
+    return codigo if re.fullmatch(r'[A-Z]{3}', codigo) else None
+
+
+def normalizar_proveedor(nombre):
+    """
+    Clave con la que se agrupan las variantes de escritura de un mismo proveedor:
+    sin acentos, mayúsculas, signos de puntuación ni espacios repetidos
+    ('Ácme, S.A.' y 'ACME SA' dan 'acme sa'). Retorna None si el nombre queda vacío.
+    """
+    descompuesto = unicodedata.normalize('NFKD', str(nombre or ""))
+    sin_acentos = "".join(caracter for caracter in descompuesto if not unicodedata.combining(caracter))
+    sin_abreviaturas = sin_acentos.casefold().replace('.', '') # 'S.A.' -> 'sa'
+    return " ".join(re.sub(r'[\W_]+', ' ', sin_abreviaturas).split()) or None
+
+
+# Etiqueta que a veces acompaña al número de factura ('Nº', 'No.', 'Nro.', '#'...)
+PATRON_ETIQUETA_NUMERO = re.compile(r'^\s*(?:n(?:[º°o]|ro|um|úm)?\.?(?=[\s\d.#-])|#)[\s.#:-]*', re.IGNORECASE)
+
+
+def normalizar_numero_factura(numero):
+    """
+    Clave para comparar números de factura escritos de distinta forma: sin
+    etiqueta, con los grupos de letras y de dígitos en mayúsculas separados por
+    '-' y sin ceros a la izquierda en cada grupo de dígitos ('Nº 0001-00012345'
+    y '1 12345' dan '1-12345'; '11-2345' da '11-2345'). Retorna None si queda vacío.
+    """
+    sin_etiqueta = PATRON_ETIQUETA_NUMERO.sub('', str(numero or ""))
+    grupos = re.findall(r'[^\W\d_]+|\d+', sin_etiqueta.upper())
+    return "-".join(grupo.lstrip('0') or '0' if grupo.isdigit() else grupo for grupo in grupos) or None
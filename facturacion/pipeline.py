@@ -0,0 +1,716 @@
+"""
+Pipeline por etapas (extracción, OpenAI y escritura) y modo vigilancia.
+"""
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .configuracion import (ESPERA_ESTABILIDAD_SEGUNDOS, ESPERA_REINTENTABLE_SEGUNDOS, FILAS_POR_BLOQUE,
+                            INTERVALO_SONDEO_SEGUNDOS,
+                            MAX_ARCHIVOS_POR_CICLO, MAX_INTENTOS_TRANSITORIOS, MAX_SOLICITUDES_EN_VUELO,
+                            MODELO_OPENAI, SEGUNDOS_POR_BLOQUE, TAMANO_COLA, TRABAJADORES_EXTRACCION,
+                            TRABAJADORES_LLM, UMBRAL_CARACTERES_POR_PAGINA)
+from .registro import METRICAS, configurar_registro, configuracion_registro
+from .base_datos import EscritorSQLite, planificar_archivos
+from .extraccion import configurar_proceso_extraccion, extraer_texto_con_metricas
+from .llm import (ClienteOpenAIAsync, ESPERA_LOTE_SEGUNDOS, MAX_FACTURAS_POR_LOTE, MAX_TOKENS_TEXTO_LLM,
+                  PRESUPUESTO_TOKENS_LOTE, es_error_transitorio_openai, espera_indicada_por_openai, estimar_tokens,
+                  extraer_datos_con_openai, extraer_datos_con_openai_async, extraer_datos_con_openai_lote,
+                  extraer_datos_con_openai_lote_async, extraer_datos_de_cache, preparar_texto_para_llm)
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['etapa_extraccion', 'etapa_llm', 'etapa_llm_async', 'etapa_escritura', 'crear_pool_extraccion',
+           'ejecutar_pipeline', 'VigilanteCarpeta', 'vigilar_carpeta']
+
+
+# Paso 4: Pipeline por Etapas
+#
+# El procesamiento se divide en tres etapas conectadas por colas acotadas:
+#   1. Extracción de texto/OCR en un pool de procesos (CPU).
+#   2. Llamadas a OpenAI en un grupo acotado de hilos (red).
+#   3. Un único escritor que es dueño de la conexión SQLite.
+# Así la CPU y la red trabajan en paralelo en lugar de esperar una a la otra.
+
+# Marca de fin de cola: indica a la etapa siguiente que no llegarán más elementos.
+_FIN_DE_COLA = None
+
+
+def _evento_trabajo(archivo, estado, error=None, etapa='extraccion'):
+    # Aviso al escritor de que un archivo completó (o no) una etapa intermedia
+    return {'evento': estado, 'nombre_archivo': archivo['nombre_archivo'],
+            'hash_contenido': archivo['hash_contenido'], 'texto': archivo['texto'],
+            'datos': archivo.get('datos'), 'origen': archivo.get('origen'), 'error': error, 'etapa': etapa}
+
+
+def _eventos_lote_fallido(lote, error):
+    # Un error inesperado en la etapa de OpenAI deja 'fallido' todo el lote, sin detener el hilo
+    log.error(f"Error inesperado en la etapa de OpenAI con un lote de {len(lote)} archivos: {error}",
+              exc_info=error)
+    return [_evento_trabajo(archivo, 'fallido', f"Error en la etapa de OpenAI: {error}", etapa='llm')
+            for archivo in lote]
+
+
+def _consumir_restantes(cola_textos, cola_resultados, error):
+    # Si el hilo de OpenAI no puede seguir, consume el resto de 'cola_textos' hasta su marca de
+    # fin (para que la extracción no quede bloqueada) y marca esos archivos como fallidos
+    log.error(f"La etapa de OpenAI se detuvo por un error inesperado: {error}", exc_info=error)
+    while True:
+        archivo = cola_textos.get()
+        if archivo is _FIN_DE_COLA:
+            return
+        cola_resultados.put(_evento_trabajo(archivo, 'fallido', f"Error en la etapa de OpenAI: {error}",
+                                            etapa='llm'))
+
+
+def etapa_extraccion(pool, archivos, cola_textos, consumidores, tesseract_cmd, max_pendientes,
+                     cola_eventos=None):
+    """
+    Etapa 1: envía los PDFs al pool de procesos para extraer su texto y deja
+    cada archivo (con su texto) en 'cola_textos'. Los archivos cuyo texto ya está
+    guardado para su hash pasan directamente. Como mucho mantiene 'max_pendientes'
+    archivos en vuelo, y al terminar envía una marca de fin por cada consumidor.
+    Si se indica 'cola_eventos', avisa en ella al escritor de cada texto extraído
+    (para guardarlo como punto de control) y de cada extracción fallida.
+    """
+    pendientes = {}
+
+    def _despachar(completados):
+        for futuro in completados:
+            archivo = pendientes.pop(futuro)
+            error = "No se pudo extraer texto útil del PDF."
+            try:
+                archivo['texto'], metricas_extraccion = futuro.result()
+                METRICAS.combinar(metricas_extraccion)
+            except Exception as e:
+                log.error(f"Error en el proceso de extracción de {archivo['nombre_archivo']}: {e}")
+                archivo['texto'] = None
+                error = f"Error en el proceso de extracción: {e}"
+
+            if archivo['texto']:
+                if cola_eventos is not None:
+                    cola_eventos.put(_evento_trabajo(archivo, 'texto_extraido'))
+                # put() bloquea si la cola está llena, frenando la extracción
+                cola_textos.put(archivo)
+            else:
+                log.warning(f"No se pudo extraer texto útil de {archivo['nombre_archivo']}. Saltando.")
+                if cola_eventos is not None:
+                    cola_eventos.put(_evento_trabajo(archivo, 'fallido', error))
+
+    try:
+        for archivo in archivos:
+            log.info(f"--- Procesando: {archivo['nombre_archivo']} ---")
+            if archivo['texto']:
+                log.info(f"Texto de {archivo['nombre_archivo']} recuperado de la base de datos (mismo hash).")
+                cola_textos.put(archivo)
+                continue
+
+            if len(pendientes) >= max_pendientes:
+                completados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                _despachar(completados)
+
+            futuro = pool.submit(extraer_texto_con_metricas, archivo['ruta'], UMBRAL_CARACTERES_POR_PAGINA, tesseract_cmd)
+            pendientes[futuro] = archivo
+
+        while pendientes:
+            completados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            _despachar(completados)
+    finally:
+        # Siempre avisa a los consumidores, incluso si algo falló, para que no queden bloqueados
+        for _ in range(consumidores):
+            cola_textos.put(_FIN_DE_COLA)
+
+
+def _tokens_para_lote(archivo, max_tokens_texto):
+    # Cota de los tokens que ocupará el archivo en el lote, sin compactarlo todavía
+    tokens = estimar_tokens(archivo['texto'])
+    return tokens if max_tokens_texto is None else min(tokens, max_tokens_texto)
+
+
+def _completar_lote(cola_textos, lote, presupuesto_tokens, max_por_lote, max_tokens_texto=MAX_TOKENS_TEXTO_LLM):
+    """
+    Añade a 'lote' más archivos de la cola mientras haya disponibles (esperando como
+    mucho ESPERA_LOTE_SEGUNDOS) y quepan en el presupuesto de tokens.
+    Retorna True si se recibió la marca de fin de cola.
+    """
+    tokens = sum(_tokens_para_lote(archivo, max_tokens_texto) for archivo in lote if not archivo['datos'])
+    while len(lote) < max_por_lote and tokens < presupuesto_tokens:
+        try:
+            archivo = cola_textos.get(timeout=ESPERA_LOTE_SEGUNDOS)
+        except queue.Empty:
+            return False
+        if archivo is _FIN_DE_COLA:
+            return True
+        lote.append(archivo)
+        if not archivo['datos']:
+            tokens += _tokens_para_lote(archivo, max_tokens_texto)
+    return False
+
+
+def _archivos_para_llm(lote, plantillas, max_tokens_texto=MAX_TOKENS_TEXTO_LLM, solo_cache=False):
+    """
+    Resuelve los archivos del lote que no necesitan OpenAI (datos ya guardados o
+    extraídos con una plantilla) y retorna los que sí lo necesitan, con su texto
+    compactado en 'texto_llm' (ver preparar_texto_para_llm).
+    """
+    sin_datos = []
+    for archivo in lote:
+        if archivo['datos']:
+            log.info(f"Datos de {archivo['nombre_archivo']} recuperados de la base de datos (mismo hash).")
+            continue
+        if plantillas is not None:
+            archivo['datos'] = plantillas.extraer_si_confiable(archivo['texto'])
+            if archivo['datos']:
+                archivo['origen'] = 'plantilla'
+                log.info(f"Datos de {archivo['nombre_archivo']} extraídos localmente con la plantilla "
+                         f"de {archivo['datos']['proveedor']}.")
+                continue
+        archivo['origen'] = 'llm'
+        preparar_texto_para_llm(archivo, max_tokens_texto)
+        sin_datos.append(archivo)
+
+    if solo_cache:
+        return sin_datos
+    if len(sin_datos) > 1:
+        log.info(f"Enviando {len(sin_datos)} facturas a OpenAI en modo por lotes...")
+    elif sin_datos:
+        log.info(f"Enviando texto de {sin_datos[0]['nombre_archivo']} a OpenAI para extracción de datos...")
+    return sin_datos
+
+
+def _informar_resultados_llm(sin_datos, errores=None):
+    # Guarda en 'error' el error de OpenAI de los archivos sin datos (ver etapa_escritura)
+    for archivo in sin_datos:
+        archivo['error'] = (errores or {}).get(archivo['nombre_archivo'])
+        if archivo['origen'] == 'pendiente':
+            log.info(f"Sin respuesta en la caché de OpenAI para {archivo['nombre_archivo']}: queda pendiente.")
+        elif archivo['datos']:
+            log.info(f"Extracción con OpenAI exitosa para {archivo['nombre_archivo']}.")
+        else:
+            log.warning(f"No se pudieron extraer datos clave de {archivo['nombre_archivo']} usando OpenAI.")
+
+
+def _eventos_datos_extraidos(lote):
+    # Archivos del lote cuyos datos se obtuvieron en esta etapa (OpenAI o plantilla)
+    return [_evento_trabajo(archivo, 'llm_completado') for archivo in lote
+            if archivo['datos'] and archivo['origen'] in ('llm', 'plantilla')]
+
+
+def _resolver_desde_cache(sin_datos, modelo_openai, cache_llm):
+    # Modo solo caché: los archivos sin respuesta guardada quedan pendientes, no fallidos
+    for archivo in sin_datos:
+        archivo['datos'] = extraer_datos_de_cache(archivo['texto_llm'], modelo_openai, cache_llm)
+        if not archivo['datos']:
+            archivo['origen'] = 'pendiente'
+
+
+def etapa_llm(cola_textos, cola_resultados, modelo_openai, cache_llm=None, modo_lote=False,
+              presupuesto_tokens=PRESUPUESTO_TOKENS_LOTE, max_por_lote=MAX_FACTURAS_POR_LOTE,
+              plantillas=None, max_tokens_texto=MAX_TOKENS_TEXTO_LLM, solo_cache=False):
+    """
+    Etapa 2: toma archivos de 'cola_textos', extrae los datos clave con OpenAI y
+    los deja en 'cola_resultados'. Los archivos sin datos también se envían, para
+    que el escritor guarde su texto. Cada hilo de esta etapa ejecuta esta función.
+    En 'modo_lote' agrupa los archivos disponibles en solicitudes de varias facturas.
+    Si se indican 'plantillas' (PlantillasProveedor), se prueban antes que OpenAI.
+    El texto enviado a OpenAI se compacta a 'max_tokens_texto' tokens estimados
+    (ver compactar_texto_factura); con None solo se limpia.
+    Con 'solo_cache' no se llama a OpenAI: los datos salen de 'cache_llm' y los
+    archivos que no están en ella quedan pendientes para otra ejecución.
+    Un error inesperado en un lote (p. ej. al aplicar una plantilla) deja sus
+    archivos como 'fallido' y el hilo sigue con los siguientes.
+    """
+    try:
+        fin_de_cola = False
+        while not fin_de_cola:
+            archivo = cola_textos.get()
+            if archivo is _FIN_DE_COLA:
+                fin_de_cola = True
+                break
+
+            lote = [archivo]
+            if modo_lote:
+                fin_de_cola = _completar_lote(cola_textos, lote, presupuesto_tokens, max_por_lote, max_tokens_texto)
+
+            try:
+                sin_datos = _archivos_para_llm(lote, plantillas, max_tokens_texto, solo_cache)
+                errores = {}
+                if solo_cache:
+                    _resolver_desde_cache(sin_datos, modelo_openai, cache_llm)
+                elif len(sin_datos) > 1:
+                    resultados = extraer_datos_con_openai_lote(
+                        {archivo['nombre_archivo']: archivo['texto_llm'] for archivo in sin_datos},
+                        modelo_openai, cache_llm, presupuesto_tokens, max_por_lote, errores)
+                    for archivo in sin_datos:
+                        archivo['datos'] = resultados.get(archivo['nombre_archivo'])
+                elif sin_datos:
+                    errores_archivo = []
+                    sin_datos[0]['datos'] = extraer_datos_con_openai(sin_datos[0]['texto_llm'], modelo_openai,
+                                                                     cache_llm, errores_archivo)
+                    errores = {sin_datos[0]['nombre_archivo']: errores_archivo[-1]} if errores_archivo else {}
+                _informar_resultados_llm(sin_datos, errores)
+                salida = _eventos_datos_extraidos(lote) + lote
+            except Exception as e:
+                salida = _eventos_lote_fallido(lote, e)
+
+            for elemento in salida:
+                cola_resultados.put(elemento)
+    except Exception as e:
+        if not fin_de_cola:
+            _consumir_restantes(cola_textos, cola_resultados, e)
+    finally:
+        cola_resultados.put(_FIN_DE_COLA)
+
+
+def etapa_llm_async(cola_textos, cola_resultados, modelo_openai, cache_llm=None, modo_lote=False,
+                    presupuesto_tokens=PRESUPUESTO_TOKENS_LOTE, max_por_lote=MAX_FACTURAS_POR_LOTE,
+                    plantillas=None, max_tokens_texto=MAX_TOKENS_TEXTO_LLM, max_en_vuelo=MAX_SOLICITUDES_EN_VUELO):
+    """
+    Etapa 2 en modo asíncrono: un único hilo con un bucle de eventos atiende todos
+    los archivos, con hasta 'max_en_vuelo' solicitudes simultáneas a OpenAI.
+    Recibe los mismos argumentos que etapa_llm.
+    """
+    try:
+        asyncio.run(_etapa_llm_async(cola_textos, cola_resultados, modelo_openai, cache_llm, modo_lote,
+                                     presupuesto_tokens, max_por_lote, plantillas, max_tokens_texto, max_en_vuelo))
+    finally:
+        cola_resultados.put(_FIN_DE_COLA)
+
+
+async def _etapa_llm_async(cola_textos, cola_resultados, modelo_openai, cache_llm, modo_lote,
+                           presupuesto_tokens, max_por_lote, plantillas, max_tokens_texto, max_en_vuelo):
+    bucle = asyncio.get_running_loop()
+    cliente = ClienteOpenAIAsync(max_en_vuelo)
+    # Limita los lotes en curso para que la cola de entrada siga frenando a la extracción
+    lotes_en_curso = asyncio.Semaphore(max_en_vuelo)
+    tareas = set()
+
+    async def _procesar(lote):
+        try:
+            try:
+                sin_datos = _archivos_para_llm(lote, plantillas, max_tokens_texto)
+                errores = {}
+                if len(sin_datos) > 1:
+                    resultados = await extraer_datos_con_openai_lote_async(
+                        cliente, {archivo['nombre_archivo']: archivo['texto_llm'] for archivo in sin_datos},
+                        modelo_openai, cache_llm, presupuesto_tokens, max_por_lote, errores)
+                    for archivo in sin_datos:
+                        archivo['datos'] = resultados.get(archivo['nombre_archivo'])
+                elif sin_datos:
+                    errores_archivo = []
+                    sin_datos[0]['datos'] = await extraer_datos_con_openai_async(
+                        cliente, sin_datos[0]['texto_llm'], modelo_openai, cache_llm, errores_archivo)
+                    errores = {sin_datos[0]['nombre_archivo']: errores_archivo[-1]} if errores_archivo else {}
+                _informar_resultados_llm(sin_datos, errores)
+                salida = _eventos_datos_extraidos(lote) + lote
+            except Exception as e:
+                salida = _eventos_lote_fallido(lote, e)
+
+            for elemento in salida:
+                await bucle.run_in_executor(None, cola_resultados.put, elemento)
+        finally:
+            lotes_en_curso.release()
+
+    try:
+        fin_de_cola = False
+        while not fin_de_cola:
+            # Las colas son de hilos: las esperas bloqueantes se delegan a un ejecutor
+            archivo = await bucle.run_in_executor(None, cola_textos.get)
+            if archivo is _FIN_DE_COLA:
+                fin_de_cola = True
+                break
+
+            lote = [archivo]
+            if modo_lote:
+                fin_de_cola = await bucle.run_in_executor(None, _completar_lote, cola_textos, lote,
+                                                          presupuesto_tokens, max_por_lote, max_tokens_texto)
+
+            await lotes_en_curso.acquire()
+            tarea = asyncio.create_task(_procesar(lote))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+
+        await asyncio.gather(*tareas)
+    except Exception as e:
+        if not fin_de_cola:
+            await bucle.run_in_executor(None, _consumir_restantes, cola_textos, cola_resultados, e)
+    finally:
+        await cliente.cerrar()
+
+
+def etapa_escritura(conn, cursor, cola_resultados, productores, plantillas=None,
+                    filas_por_bloque=FILAS_POR_BLOQUE, segundos_por_bloque=SEGUNDOS_POR_BLOQUE):
+    """
+    Etapa 3: único escritor de la base de datos. Guarda el texto y los datos de
+    cada archivo por su hash e inserta la factura, hasta recibir una marca de fin
+    de cada productor. Los resultados del LLM se usan para aprender 'plantillas'.
+    Las filas se guardan por bloques con EscritorSQLite, junto con la etapa que
+    alcanzó cada archivo en la tabla 'trabajos' (ver _evento_trabajo). Si OpenAI
+    falló por un error transitorio, el archivo queda 'reintentable' hasta agotar
+    MAX_INTENTOS_TRANSITORIOS y no se vuelve a planificar hasta que pasa su espera
+    (ESPERA_REINTENTABLE_SEGUNDOS, duplicada en cada intento, o el Retry-After de
+    OpenAI si es mayor); los errores permanentes (JSON inválido, errores 4xx salvo
+    429) lo dejan 'fallido'.
+    """
+    escritor = EscritorSQLite(conn, filas_por_bloque, segundos_por_bloque)
+    productores_activos = productores
+    while productores_activos:
+        try:
+            # Despierta al vencer el plazo del bloque aunque no lleguen resultados
+            archivo = cola_resultados.get(timeout=max(escritor.segundos_hasta_vaciado(), 0.05))
+        except queue.Empty:
+            escritor.vaciar_si_corresponde()
+            continue
+        if archivo is _FIN_DE_COLA:
+            productores_activos -= 1
+            continue
+
+        if 'evento' in archivo:
+            if archivo['evento'] in ('texto_extraido', 'llm_completado'):
+                escritor.agregar_documento(archivo['hash_contenido'], archivo['texto'], archivo['datos'],
+                                           archivo['origen'] if archivo['evento'] == 'llm_completado' else None)
+            escritor.actualizar_trabajo(archivo['nombre_archivo'], archivo['evento'], archivo['error'])
+            if archivo['evento'] == 'fallido':
+                METRICAS.incrementar('facturas_archivos_total', resultado='fallido', origen=archivo['etapa'])
+            escritor.vaciar_si_corresponde()
+            continue
+
+        if archivo['origen'] not in ('llm', 'plantilla') or not archivo['datos']:
+            # Los datos nuevos ya se guardaron con el evento 'llm_completado'
+            escritor.agregar_documento(archivo['hash_contenido'], archivo['texto'], archivo['datos'])
+        if archivo['datos']:
+            escritor.agregar_factura(archivo['nombre_archivo'], archivo['datos'], archivo['hash_contenido'])
+            escritor.actualizar_trabajo(archivo['nombre_archivo'], 'guardado')
+            METRICAS.incrementar('facturas_archivos_total', resultado='guardado', origen=archivo['origen'])
+            if plantillas is not None and archivo['origen'] == 'llm':
+                plantillas.aprender(cursor, archivo['texto'], archivo['datos'])
+        elif archivo['origen'] == 'pendiente':
+            # Sin respuesta en la caché (modo solo caché): conserva su etapa para la próxima ejecución
+            METRICAS.incrementar('facturas_archivos_total', resultado='pendiente', origen='llm')
+        elif es_error_transitorio_openai(archivo['error']) and archivo['intentos'] < MAX_INTENTOS_TRANSITORIOS:
+            espera = max(ESPERA_REINTENTABLE_SEGUNDOS * 2 ** (archivo['intentos'] - 1),
+                         espera_indicada_por_openai(archivo['error']) or 0)
+            escritor.actualizar_trabajo(archivo['nombre_archivo'], 'reintentable',
+                                        f"Error transitorio de OpenAI (intento {archivo['intentos']}/"
+                                        f"{MAX_INTENTOS_TRANSITORIOS}): {archivo['error']}", espera)
+            METRICAS.incrementar('facturas_archivos_total', resultado='reintentable', origen='llm')
+        else:
+            motivo = f": {archivo['error']}" if archivo['error'] is not None else "."
+            escritor.actualizar_trabajo(archivo['nombre_archivo'], 'fallido',
+                                        f"No se pudieron extraer los datos clave (OpenAI ni plantilla){motivo}")
+            METRICAS.incrementar('facturas_archivos_total', resultado='fallido', origen='llm')
+        escritor.vaciar_si_corresponde()
+
+    escritor.vaciar()
+    log.info(f"Facturas guardadas en la base de datos: {escritor.facturas_guardadas}.")
+
+
+def _inicializar_trabajador_extraccion(configuracion_registro=None, trabajadores=1):
+    # Ctrl+C llega a todo el grupo de procesos: los trabajadores lo ignoran y es
+    # el proceso principal el que decide cómo terminar (ver vigilar_carpeta)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Los procesos hijos no heredan la configuración del registro
+    if configuracion_registro is not None:
+        configurar_registro(*configuracion_registro)
+    # Los núcleos para el OCR de páginas se reparten entre los 'trabajadores' procesos
+    configurar_proceso_extraccion(trabajadores)
+
+
+def crear_pool_extraccion(trabajadores):
+    """
+    Crea el pool de procesos de la etapa de extracción de texto y OCR. Cada proceso
+    usa TRABAJADORES_OCR_PAGINAS / 'trabajadores' hilos de OCR (al menos uno).
+    """
+    # 'spawn' evita heredar el estado de los hilos ya iniciados (locks, colas) en los procesos hijos
+    contexto = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto,
+                               initializer=_inicializar_trabajador_extraccion,
+                               initargs=(configuracion_registro(), trabajadores))
+
+
+def ejecutar_pipeline(conn, cursor, archivos, tesseract_cmd,
+                      trabajadores_extraccion=TRABAJADORES_EXTRACCION,
+                      trabajadores_llm=TRABAJADORES_LLM,
+                      tamano_cola=TAMANO_COLA,
+                      cache_llm=None,
+                      modo_lote=False,
+                      presupuesto_tokens=PRESUPUESTO_TOKENS_LOTE,
+                      max_por_lote=MAX_FACTURAS_POR_LOTE,
+                      plantillas=None,
+                      max_tokens_texto=MAX_TOKENS_TEXTO_LLM,
+                      cliente_async=False,
+                      max_en_vuelo=MAX_SOLICITUDES_EN_VUELO,
+                      filas_por_bloque=FILAS_POR_BLOQUE,
+                      segundos_por_bloque=SEGUNDOS_POR_BLOQUE,
+                      solo_cache=False,
+                      pool=None):
+    """
+    Procesa 'archivos' (ver planificar_archivos) con el pipeline de tres etapas.
+    Si se indica 'pool' (ver crear_pool_extraccion), se reutiliza en lugar de crear uno nuevo.
+    Si se indica 'cache_llm' (CacheLLM), la etapa de OpenAI la consulta antes de cada llamada.
+    Con 'modo_lote', la etapa de OpenAI agrupa varias facturas por solicitud.
+    Con 'plantillas' (PlantillasProveedor), las facturas de proveedores conocidos
+    se extraen localmente y los resultados del LLM alimentan las plantillas.
+    El texto de cada factura se compacta a 'max_tokens_texto' tokens estimados
+    antes de enviarlo a OpenAI (None = solo limpiarlo).
+    Con 'cliente_async', la etapa de OpenAI es un único hilo asíncrono con hasta
+    'max_en_vuelo' solicitudes simultáneas, en lugar de 'trabajadores_llm' hilos.
+    Con 'solo_cache' no se llama a OpenAI (ver etapa_llm).
+    La etapa de escritura corre en el hilo actual, que es el dueño de 'conn', y
+    guarda las filas cada 'filas_por_bloque' filas o 'segundos_por_bloque' segundos.
+    """
+    cola_textos = queue.Queue(maxsize=tamano_cola)
+    cola_resultados = queue.Queue(maxsize=tamano_cola)
+
+    argumentos_llm = (MODELO_OPENAI, cache_llm, modo_lote, presupuesto_tokens, max_por_lote, plantillas,
+                      max_tokens_texto)
+    if cliente_async and not solo_cache:
+        consumidores_llm = 1
+        hilos_llm = [threading.Thread(target=etapa_llm_async,
+                                      args=(cola_textos, cola_resultados) + argumentos_llm + (max_en_vuelo,),
+                                      name="llm-async", daemon=True)]
+    else:
+        consumidores_llm = trabajadores_llm
+        hilos_llm = [threading.Thread(target=etapa_llm,
+                                      args=(cola_textos, cola_resultados) + argumentos_llm,
+                                      kwargs={'solo_cache': solo_cache}, name=f"llm-{i}", daemon=True)
+                     for i in range(trabajadores_llm)]
+
+
+    pool_propio = pool is None
+    if pool_propio:
+        pool = crear_pool_extraccion(trabajadores_extraccion)
+    try:
+        hilos = [threading.Thread(target=etapa_extraccion,
+                                  args=(pool, archivos, cola_textos, consumidores_llm,
+                                        tesseract_cmd, trabajadores_extraccion * 2, cola_resultados),
+                                  name="extraccion", daemon=True)]
+        hilos += hilos_llm
+
+        for hilo in hilos:
+            hilo.start()
+
+        etapa_escritura(conn, cursor, cola_resultados, consumidores_llm, plantillas,
+                        filas_por_bloque, segundos_por_bloque)
+
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        if pool_propio:
+            pool.shutdown()
+
+
+# --- Modo vigilancia ---
+
+class VigilanteCarpeta:
+    """
+    Detecta PDFs nuevos o modificados en una carpeta y los entrega cuando su
+    tamaño y fecha de modificación no cambiaron durante 'espera_estabilidad'
+    segundos, para no leer archivos que todavía se están copiando.
+
+    Usa las notificaciones del sistema (inotify en Linux) a través de watchdog si
+    está instalado; si no, revisa la carpeta cada 'intervalo_sondeo' segundos.
+    'conocidos' ({nombre: (tamano, mtime)}) son los archivos ya vistos, que no se
+    vuelven a entregar mientras no cambien.
+    """
+
+    def __init__(self, carpeta, conocidos=None, espera_estabilidad=ESPERA_ESTABILIDAD_SEGUNDOS,
+                 intervalo_sondeo=INTERVALO_SONDEO_SEGUNDOS):
+        self.carpeta = carpeta
+        self.espera_estabilidad = espera_estabilidad
+        self.intervalo_sondeo = intervalo_sondeo
+        self.usa_eventos = False
+        self._conocidos = dict(conocidos or {})
+        self._candidatos = {} # nombre -> ((tamano, mtime), instante en que se observó) o None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._observador = None
+
+    def iniciar(self):
+        """
+        Comienza a recibir notificaciones de la carpeta si watchdog está disponible.
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return
+
+        vigilante = self
+
+        class _Manejador(FileSystemEventHandler):
+            def on_any_event(self, evento):
+                if evento.is_directory:
+                    return
+                for ruta in (evento.src_path, getattr(evento, 'dest_path', None)):
+                    if ruta:
+                        vigilante.notificar(os.path.basename(ruta))
+
+        self._observador = Observer()
+        self._observador.schedule(_Manejador(), self.carpeta, recursive=False)
+        self._observador.start()
+        self.usa_eventos = True
+
+    def detener(self):
+        if self._observador is not None:
+            self._observador.stop()
+            self._observador.join()
+
+    def notificar(self, nombre_archivo):
+        """
+        Marca un archivo como posiblemente modificado.
+        """
+        if not nombre_archivo.lower().endswith('.pdf'):
+            return
+        with self._lock:
+            self._candidatos[nombre_archivo] = None
+        self._despertar.set()
+
+    def despertar(self):
+        self._despertar.set()
+
+    def sondear(self):
+        """
+        Revisa el tamaño y la fecha de modificación de los PDFs de la carpeta (sin
+        leerlos) y marca los que no coinciden con los conocidos.
+        """
+        try:
+            entradas = list(os.scandir(self.carpeta))
+        except OSError as e:
+            log.error(f"Error al revisar la carpeta '{self.carpeta}': {e}")
+            return
+        for entrada in entradas:
+            if not entrada.name.lower().endswith('.pdf') or not entrada.is_file():
+                continue
+            estado = entrada.stat()
+            if self._conocidos.get(entrada.name) != (estado.st_size, estado.st_mtime):
+                with self._lock:
+                    self._candidatos.setdefault(entrada.name, None)
+
+    def listos(self):
+        """
+        Retorna los archivos marcados que ya no cambian, en orden de nombre.
+        """
+        ahora = time.monotonic()
+        listos = []
+        with self._lock:
+            for nombre_archivo, observado in list(self._candidatos.items()):
+                try:
+                    estado = os.stat(os.path.join(self.carpeta, nombre_archivo))
+                except OSError:
+                    del self._candidatos[nombre_archivo] # Se borró o se movió
+                    continue
+                firma = (estado.st_size, estado.st_mtime)
+                if observado is None or observado[0] != firma:
+                    self._candidatos[nombre_archivo] = (firma, ahora) # Sigue cambiando: se vuelve a esperar
+                elif ahora - observado[1] >= self.espera_estabilidad:
+                    del self._candidatos[nombre_archivo]
+                    if self._conocidos.get(nombre_archivo) != firma: # Un evento sin cambios reales no cuenta
+                        self._conocidos[nombre_archivo] = firma
+                        listos.append(nombre_archivo)
+        return sorted(listos)
+
+    def esperar(self):
+        """
+        Espera hasta la próxima revisión o hasta recibir una notificación.
+        """
+        with self._lock:
+            hay_candidatos = bool(self._candidatos)
+        if hay_candidatos:
+            espera = max(self.espera_estabilidad / 2, 0.1)
+        else:
+            espera = self.intervalo_sondeo
+        self._despertar.wait(espera)
+        self._despertar.clear()
+
+
+def vigilar_carpeta(conn, cursor, carpeta, tesseract_cmd, opciones_pipeline,
+                    espera_estabilidad=ESPERA_ESTABILIDAD_SEGUNDOS,
+                    intervalo_sondeo=INTERVALO_SONDEO_SEGUNDOS,
+                    max_por_ciclo=MAX_ARCHIVOS_POR_CICLO,
+                    al_terminar_ciclo=None):
+    """
+    Modo vigilancia: procesa de forma continua los PDFs nuevos o modificados de
+    'carpeta' con ejecutar_pipeline ('opciones_pipeline' son sus argumentos con nombre).
+    Los archivos detectados se guardan en la tabla 'cola_vigilancia' y se quitan
+    solo después de procesarlos, así que al reiniciar se retoman los pendientes.
+    Los que quedan 'reintentable' (ver etapa_escritura) siguen en 'cola_vigilancia'
+    y vuelven a procesarse cuando pasa su espera.
+    Al arrancar solo se compara el tamaño y la fecha de cada PDF con 'archivos_vistos'.
+    SIGINT (Ctrl+C) y SIGTERM terminan el ciclo en curso y cierran ordenadamente.
+    Si se indica, 'al_terminar_ciclo' se llama sin argumentos después de cada ciclo
+    (por ejemplo, para exportar las métricas).
+    """
+    detener = threading.Event()
+    cursor.execute("SELECT nombre_archivo, tamano, mtime FROM archivos_vistos")
+    conocidos = {nombre_archivo: (tamano, mtime) for nombre_archivo, tamano, mtime in cursor.fetchall()}
+    vigilante = VigilanteCarpeta(carpeta, conocidos, espera_estabilidad, intervalo_sondeo)
+
+    cursor.execute("SELECT nombre_archivo FROM cola_vigilancia ORDER BY fecha_deteccion, nombre_archivo")
+    pendientes = [fila[0] for fila in cursor.fetchall()]
+    if pendientes:
+        log.info(f"Se retoman {len(pendientes)} archivos pendientes de la ejecución anterior.")
+
+    def al_recibir_senal(numero, marco):
+        log.info("Detención solicitada: se termina el ciclo en curso y se cierra.")
+        detener.set()
+        vigilante.despertar()
+
+    senales_anteriores = {senal: signal.signal(senal, al_recibir_senal) for senal in (signal.SIGINT, signal.SIGTERM)}
+    pool = crear_pool_extraccion(opciones_pipeline.get('trabajadores_extraccion', TRABAJADORES_EXTRACCION))
+    try:
+        vigilante.iniciar()
+        vigilante.sondear() # Cambios ocurridos mientras el script no estaba en ejecución
+        if vigilante.usa_eventos:
+            log.info(f"Vigilando '{carpeta}' con notificaciones del sistema. Ctrl+C para detener.")
+        else:
+            log.info(f"Vigilando '{carpeta}' cada {intervalo_sondeo} s (instala watchdog para usar notificaciones). "
+                     "Ctrl+C para detener.")
+
+        while not detener.is_set():
+            if not vigilante.usa_eventos:
+                vigilante.sondear()
+            # Archivos que esperaban tras un error transitorio de OpenAI y ya pueden reintentarse
+            cursor.execute('''
+                SELECT c.nombre_archivo FROM cola_vigilancia c JOIN trabajos t USING (nombre_archivo)
+                WHERE t.estado = 'reintentable'
+                  AND (t.reintentar_desde IS NULL OR t.reintentar_desde <= CURRENT_TIMESTAMP)
+                ORDER BY c.fecha_deteccion, c.nombre_archivo
+            ''')
+            pendientes.extend(fila[0] for fila in cursor.fetchall() if fila[0] not in pendientes)
+            nuevos = [nombre_archivo for nombre_archivo in vigilante.listos() if nombre_archivo not in pendientes]
+            if nuevos:
+                cursor.executemany("INSERT OR IGNORE INTO cola_vigilancia (nombre_archivo) VALUES (?)",
+                                   [(nombre_archivo,) for nombre_archivo in nuevos])
+                conn.commit()
+                pendientes.extend(nuevos)
+
+            if not pendientes:
+                vigilante.esperar()
+                continue
+
+            lote, pendientes = pendientes[:max_por_ciclo], pendientes[max_por_ciclo:]
+            log.info(f"{len(lote)} archivos nuevos o modificados en '{carpeta}'.")
+            archivos = planificar_archivos(conn, cursor, lote, carpeta=carpeta)
+            if archivos:
+                ejecutar_pipeline(conn, cursor, archivos, tesseract_cmd, pool=pool, **opciones_pipeline)
+            # Los que esperan para reintentarse tras un error transitorio de OpenAI siguen en la cola
+            cursor.execute("SELECT nombre_archivo FROM trabajos WHERE estado = 'reintentable'")
+            reintentables = {fila[0] for fila in cursor.fetchall()}.intersection(lote)
+            cursor.executemany("DELETE FROM cola_vigilancia WHERE nombre_archivo = ?",
+                               [(nombre_archivo,) for nombre_archivo in lote if nombre_archivo not in reintentables])
+            conn.commit()
+            if al_terminar_ciclo is not None:
+                al_terminar_ciclo()
+    finally:
+        vigilante.detener()
+        pool.shutdown()
+        for senal, manejador in senales_anteriores.items():
+            signal.signal(senal, manejador)
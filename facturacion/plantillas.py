@@ -0,0 +1,295 @@
+"""
+Extracción local con plantillas por proveedor, aprendidas de las respuestas del LLM.
+"""
+import re
+import json
+import sqlite3
+import logging
+import threading
+
+from .configuracion import UMBRAL_CONFIANZA_PLANTILLA
+from .normalizacion import PATRON_FECHA, normalizar_fecha, normalizar_numero_factura, normalizar_total
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['PlantillasProveedor']
+
+
+def _patron_etiqueta(etiqueta):
+    # Escapa la etiqueta permitiendo cualquier espacio en blanco entre sus palabras
+    return r'\s+'.join(re.escape(palabra) for palabra in etiqueta.split())
+
+
+def _patron_ancla(etiqueta):
+    # La etiqueta no puede empezar dentro de otra palabra: 'TOTAL' no coincide con 'SUBTOTAL'
+    return r'(?<!\w)' + _patron_etiqueta(etiqueta)
+
+
+def _normalizar_para_busqueda(texto):
+    return " ".join(texto.split()).casefold()
+
+
+class PlantillasProveedor:
+    """
+    Extracción local de datos para proveedores con formato de factura fijo.
+
+    Para cada proveedor se aprende, a partir de un resultado del LLM y del texto
+    de la factura, una expresión regular por campo anclada en la etiqueta que
+    precede al valor (p. ej. 'Nº' o 'TOTAL FACTURA'). Cuando el nombre del
+    proveedor aparece en el texto de una factura nueva, se aplican sus patrones y,
+    si la confianza es suficiente, se evita la llamada a OpenAI.
+    Es segura para usarse desde varios hilos.
+    """
+
+    # Expresión que captura el valor de cada campo después de su etiqueta. Un número
+    # de factura impreso en partes (p. ej. 'Punto de Venta: 00012  Comp. Nro: 00000001')
+    # se captura con un grupo por parte, y las partes se unen con '-'.
+    CAPTURAS = {
+        'numero_factura': r'([A-Za-z0-9][\w\-/.]*)',
+        'fecha_emision': r'(' + PATRON_FECHA + r')',
+        'total': r'(\d[\d.,]*\d|\d)',
+        'cliente': r'([^\n]*[^\s:])',
+    }
+
+    # Campos sin los que una plantilla no se puede usar
+    CAMPOS_OBLIGATORIOS = ('numero_factura', 'fecha_emision', 'total')
+
+    # Longitud máxima de la etiqueta usada como ancla
+    LONGITUD_MAXIMA_ETIQUETA = 40
+
+    def __init__(self, umbral_confianza=UMBRAL_CONFIANZA_PLANTILLA):
+        self.umbral_confianza = umbral_confianza
+        self.usos = 0
+        self._plantillas = {}
+        self._lock = threading.Lock()
+
+    def cargar(self, cursor):
+        """
+        Carga las plantillas guardadas en la tabla 'plantillas_proveedor'.
+        """
+        cursor.execute("SELECT proveedor, patrones_json, aciertos, fallos FROM plantillas_proveedor")
+        with self._lock:
+            for proveedor, patrones_json, aciertos, fallos in cursor.fetchall():
+                self._plantillas[proveedor] = self._crear(proveedor, json.loads(patrones_json), aciertos, fallos)
+        return len(self._plantillas)
+
+    def __len__(self):
+        return len(self._plantillas)
+
+    def _crear(self, proveedor, patrones, aciertos=0, fallos=0):
+        return {
+            'identificador': _normalizar_para_busqueda(proveedor),
+            'patrones': patrones,
+            'compilados': {campo: re.compile(patron, re.IGNORECASE) for campo, patron in patrones.items()},
+            'aciertos': aciertos,
+            'fallos': fallos,
+        }
+
+    @staticmethod
+    def _convertir(campo, valor):
+        # Convierte el texto capturado al formato que produce el LLM
+        if campo == 'fecha_emision':
+            return normalizar_fecha(valor)
+        if campo == 'total':
+            return normalizar_total(valor, avisar_errores=False)
+        return valor.strip() or None
+
+    @staticmethod
+    def _coinciden(campo, valor_plantilla, valor_llm):
+        if valor_plantilla is None or valor_llm is None:
+            return False
+        if campo == 'total':
+            total_llm = normalizar_total(valor_llm)
+            return total_llm is not None and abs(valor_plantilla - total_llm) < 0.01
+        if campo == 'fecha_emision':
+            return valor_plantilla == normalizar_fecha(valor_llm)
+        if campo == 'numero_factura':
+            return normalizar_numero_factura(valor_plantilla) == normalizar_numero_factura(valor_llm)
+        return _normalizar_para_busqueda(str(valor_plantilla)) == _normalizar_para_busqueda(str(valor_llm))
+
+    def _capturar(self, campo, patron, texto):
+        # Valor de la primera coincidencia del patrón que se puede convertir (la etiqueta
+        # puede aparecer antes sin el valor, p. ej. en el encabezado de la tabla)
+        for coincidencia in patron.finditer(texto):
+            valor = self._convertir(campo, "-".join(coincidencia.groups()))
+            if valor is not None:
+                return valor
+        return None
+
+    def _aplicar(self, plantilla, texto):
+        return {campo: self._capturar(campo, patron, texto) for campo, patron in plantilla['compilados'].items()}
+
+    def _buscar_plantilla(self, texto):
+        # Si varios proveedores aparecen en el texto, se usa el nombre más largo (más específico)
+        texto_normalizado = _normalizar_para_busqueda(texto)
+        candidatos = [(proveedor, plantilla) for proveedor, plantilla in self._plantillas.items()
+                      if plantilla['identificador'] in texto_normalizado]
+        if not candidatos:
+            return None, None
+        return max(candidatos, key=lambda candidato: len(candidato[1]['identificador']))
+
+    def extraer(self, texto):
+        """
+        Intenta extraer los datos de la factura con la plantilla de su proveedor.
+        Retorna (datos, confianza); datos es None si ningún proveedor conocido aparece en el texto.
+        """
+        with self._lock:
+            proveedor, plantilla = self._buscar_plantilla(texto)
+            if plantilla is None:
+                return None, 0.0
+
+            datos = self._aplicar(plantilla, texto)
+            encontrados = sum(1 for campo in self.CAMPOS_OBLIGATORIOS if datos.get(campo) is not None)
+            # Estimación de la fiabilidad de la plantilla con su historial (regla de Laplace)
+            fiabilidad = (plantilla['aciertos'] + 1) / (plantilla['aciertos'] + plantilla['fallos'] + 2)
+            confianza = encontrados / len(self.CAMPOS_OBLIGATORIOS) * fiabilidad
+
+        datos['proveedor'] = proveedor
+        datos.setdefault('cliente', None)
+        return datos, confianza
+
+    def extraer_si_confiable(self, texto):
+        """
+        Retorna los datos extraídos con la plantilla si su confianza alcanza el umbral, o None.
+        """
+        datos, confianza = self.extraer(texto)
+        if datos is None or confianza < self.umbral_confianza:
+            return None
+        with self._lock:
+            self.usos += 1
+        return datos
+
+    def _ocurrencias(self, campo, valor, texto):
+        # Apariciones en el texto del valor devuelto por el LLM: cada una es una tupla con
+        # la posición (inicio, fin) de cada parte del valor (una sola, salvo en los números
+        # de factura impresos en partes)
+        if campo == 'fecha_emision':
+            fecha = normalizar_fecha(valor)
+            return [(c.span(),) for c in re.finditer(PATRON_FECHA, texto, re.IGNORECASE)
+                    if fecha and normalizar_fecha(c.group()) == fecha]
+        if campo == 'total':
+            total = normalizar_total(valor)
+            if total is None:
+                return []
+            ocurrencias = []
+            for coincidencia in re.finditer(r'\d[\d.,]*\d|\d', texto):
+                candidato = normalizar_total(coincidencia.group(), avisar_errores=False)
+                if candidato is not None and abs(candidato - total) < 0.01:
+                    ocurrencias.append((coincidencia.span(),))
+            # El total suele estar al final del documento: se prueban primero las últimas apariciones
+            return ocurrencias[::-1]
+        ocurrencias = [(c.span(),) for c in re.finditer(_patron_etiqueta(str(valor)), texto, re.IGNORECASE)]
+        partes = re.findall(r'[^\W_]+', str(valor))
+        if campo == 'numero_factura' and not ocurrencias and len(partes) > 1:
+            # Las partes del número en orden, en una misma línea y cada una con su etiqueta
+            patron = r'[^\n]*?'.join(r'(?<!\w)(' + re.escape(parte) + r')(?!\w)' for parte in partes)
+            ocurrencias = [tuple(c.span(grupo) for grupo in range(1, len(partes) + 1))
+                           for c in re.finditer(patron, texto, re.IGNORECASE)]
+        return ocurrencias
+
+    def _etiqueta(self, texto, inicio, desde=None):
+        # Texto que precede al valor en su línea o, si no tiene letras, la línea no vacía
+        # anterior. Con 'desde' (el fin de la parte anterior de un número de factura) solo
+        # se usa el texto entre ambas partes.
+        inicio_linea = max(texto.rfind('\n', 0, inicio) + 1, desde or 0)
+        etiqueta = texto[inicio_linea:inicio]
+        if desde is None and not re.search(r'[^\W\d_]', etiqueta):
+            lineas_previas = [linea for linea in texto[:inicio_linea].splitlines() if linea.strip()]
+            etiqueta = lineas_previas[-1] if lineas_previas else ""
+        etiqueta = etiqueta.strip().rstrip(':$ ').strip()
+        if len(etiqueta) > self.LONGITUD_MAXIMA_ETIQUETA:
+            etiqueta = etiqueta[-self.LONGITUD_MAXIMA_ETIQUETA:].split(None, 1)[-1]
+        return etiqueta if re.search(r'[^\W\d_]', etiqueta) else None
+
+    def _patron_campo(self, campo, texto, partes):
+        # Patrón con la etiqueta y la captura de cada parte del valor, o None si alguna no tiene etiqueta
+        patron = ""
+        fin_anterior = None
+        for inicio, fin in partes:
+            etiqueta = self._etiqueta(texto, inicio, fin_anterior)
+            if not etiqueta:
+                return None
+            if fin_anterior is not None:
+                patron += r'[^\n]*?'
+            patron += _patron_ancla(etiqueta) + r'[\s:$]*' + self.CAPTURAS[campo]
+            fin_anterior = fin
+        return patron
+
+    def _aprender_patrones(self, texto, datos_extraidos):
+        patrones = {}
+        for campo in self.CAPTURAS:
+            valor = datos_extraidos.get(campo)
+            if valor is None or str(valor).strip() == "":
+                continue
+            for partes in self._ocurrencias(campo, valor, texto):
+                patron = self._patron_campo(campo, texto, partes)
+                # El patrón solo sirve si aplicado al texto (como en _aplicar) da el valor esperado
+                if patron and self._coinciden(campo, self._capturar(campo, re.compile(patron, re.IGNORECASE), texto), valor):
+                    patrones[campo] = patron
+                    break
+        if all(campo in patrones for campo in self.CAMPOS_OBLIGATORIOS):
+            return patrones
+        return None
+
+    def aprender(self, cursor, texto, datos_extraidos):
+        """
+        Actualiza la plantilla del proveedor con un resultado obtenido del LLM.
+        Si ya existe una plantilla, suma un acierto o un fallo según coincida con
+        el LLM; si falla (o no existe) intenta aprender los patrones de este texto.
+        No confirma la transacción: lo hace quien llama (ver EscritorSQLite).
+        """
+        proveedor = (datos_extraidos.get('proveedor') or "").strip()
+        if not texto or not proveedor:
+            return
+        if _normalizar_para_busqueda(proveedor) not in _normalizar_para_busqueda(texto):
+            return # El nombre no aparece literalmente: no serviría para reconocer al proveedor
+
+        with self._lock:
+            plantilla = self._plantillas.get(proveedor)
+            if plantilla is not None:
+                datos_plantilla = self._aplicar(plantilla, texto)
+                if all(self._coinciden(campo, datos_plantilla.get(campo), datos_extraidos.get(campo))
+                       for campo in self.CAMPOS_OBLIGATORIOS):
+                    plantilla['aciertos'] += 1
+                else:
+                    plantilla['fallos'] += 1
+                    patrones = self._aprender_patrones(texto, datos_extraidos)
+                    if patrones is not None and patrones != plantilla['patrones']:
+                        # El formato cambió: la nueva plantilla empieza sin historial
+                        plantilla = self._plantillas[proveedor] = self._crear(proveedor, patrones)
+            else:
+                patrones = self._aprender_patrones(texto, datos_extraidos)
+                if patrones is None:
+                    return
+                plantilla = self._plantillas[proveedor] = self._crear(proveedor, patrones)
+
+            valores = (json.dumps(plantilla['patrones'], ensure_ascii=False), plantilla['aciertos'], plantilla['fallos'])
+
+        try:
+            cursor.execute('''
+                INSERT INTO plantillas_proveedor (proveedor, patrones_json, aciertos, fallos) VALUES (?, ?, ?, ?)
+                ON CONFLICT(proveedor) DO UPDATE SET
+                    patrones_json = excluded.patrones_json, aciertos = excluded.aciertos,
+                    fallos = excluded.fallos, fecha_actualizacion = CURRENT_TIMESTAMP
+            ''', (proveedor,) + valores)
+        except sqlite3.Error as e:
+            log.error(f"Error al guardar la plantilla del proveedor {proveedor}: {e}")
+
+    def aprender_de_historial(self, conn, cursor):
+        """
+        Aprende plantillas a partir de las facturas ya guardadas cuyo texto está en 'documentos'.
+        Como en el aprendizaje en línea, solo usa datos extraídos por el LLM: los de
+        una plantilla coinciden con ella por construcción e inflarían su fiabilidad.
+        Retorna el número de plantillas resultante.
+        """
+        cursor.execute('''
+            SELECT d.texto, d.datos_json FROM facturas f
+            JOIN documentos d ON d.hash_contenido = f.hash_contenido
+            WHERE d.texto IS NOT NULL AND d.datos_json IS NOT NULL AND d.origen_datos = 'llm'
+            ORDER BY f.fecha_procesamiento
+        ''')
+        for texto, datos_json in cursor.fetchall():
+            self.aprender(cursor, texto, json.loads(datos_json))
+        conn.commit()
+        return len(self._plantillas)
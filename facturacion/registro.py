@@ -0,0 +1,295 @@
+"""
+Registro de mensajes (texto o JSON) y métricas del procesamiento, con
+exportación a JSON y al formato de texto de Prometheus.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+from .configuracion import FORMATO_REGISTRO, LIMITES_HISTOGRAMA_SEGUNDOS, NIVEL_REGISTRO
+
+log = logging.getLogger(__name__)
+
+# API pública del módulo (la que reexporta procesar_facturas.py)
+__all__ = ['FormateadorJSON', 'configurar_registro', 'configuracion_registro', 'Metricas', 'METRICAS',
+           'exportar_metricas']
+
+
+# --- Registro y métricas ---
+
+class FormateadorJSON(logging.Formatter):
+    """
+    Escribe cada mensaje como una línea JSON con la fecha, el nivel, el proceso y
+    el hilo (la etapa del pipeline) y los campos pasados con 'extra'.
+    """
+    _CAMPOS_ESTANDAR = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, registro):
+        datos = {
+            'fecha': self.formatTime(registro, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': registro.levelname,
+            'proceso': registro.processName,
+            'hilo': registro.threadName,
+            'mensaje': registro.getMessage(),
+        }
+        datos.update((clave, valor) for clave, valor in vars(registro).items() if clave not in self._CAMPOS_ESTANDAR)
+        if registro.exc_info:
+            datos['excepcion'] = self.formatException(registro.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+# Configuración actual del registro, que se pasa a los procesos de extracción
+_configuracion_registro = None
+
+
+def configurar_registro(nivel=NIVEL_REGISTRO, formato_json=False):
+    """
+    Configura el registro del paquete en la salida de errores, en texto o en JSON.
+    """
+    global _configuracion_registro
+    manejador = logging.StreamHandler()
+    manejador.setFormatter(FormateadorJSON() if formato_json else logging.Formatter(FORMATO_REGISTRO))
+    log_paquete = logging.getLogger(__package__)
+    log_paquete.handlers[:] = [manejador]
+    log_paquete.setLevel(nivel)
+    log_paquete.propagate = False
+    _configuracion_registro = (nivel, formato_json)
+
+
+def configuracion_registro():
+    """
+    Retorna los argumentos de la última llamada a configurar_registro (o None),
+    para repetirla en los procesos de extracción.
+    """
+    return _configuracion_registro
+
+
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas:
+        return ""
+    escapar = lambda valor: str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{nombre}="{escapar(valor)}"' for nombre, valor in etiquetas) + "}"
+
+
+class Metricas:
+    """
+    Contadores e histogramas con etiquetas, al estilo de Prometheus, seguros
+    entre hilos. Los procesos de extracción envían su instantánea al proceso
+    principal, que la combina con la suya (ver extraer_texto_con_metricas).
+    """
+
+    # Descripción de cada métrica para la exportación a Prometheus
+    DESCRIPCIONES = {
+        'facturas_archivo_duracion_segundos': "Duración de cada archivo por etapa.",
+        'facturas_pagina_duracion_segundos': "Duración de cada página por etapa (texto nativo, render y OCR).",
+        'facturas_paginas_total': "Páginas procesadas por método de extracción.",
+        'facturas_documentos_truncados_total': "Documentos truncados por límite alcanzado (páginas, texto, tiempo o memoria).",
+        'facturas_llm_duracion_segundos': "Duración de cada solicitud a OpenAI, con reintentos.",
+        'facturas_llm_solicitudes_total': "Solicitudes a OpenAI por modo y resultado.",
+        'facturas_llm_reintentos_total': "Reintentos de OpenAI por tipo de error.",
+        'facturas_llm_tokens_total': "Tokens informados por OpenAI en 'usage'.",
+        'facturas_llm_costo_usd_total': "Costo estimado de OpenAI en USD.",
+        'facturas_llm_tokens_texto_total': "Tokens estimados del texto de las facturas antes y después de compactarlo.",
+        'facturas_cache_llm_consultas_total': "Consultas a la caché de respuestas de OpenAI.",
+        'facturas_escritura_bloque_duracion_segundos': "Duración de cada bloque guardado en SQLite.",
+        'facturas_escritura_filas_total': "Filas guardadas en SQLite por tabla.",
+        'facturas_escritura_errores_total': "Bloques de SQLite que fallaron y se reintentaron fila por fila.",
+        'facturas_archivos_total': "Archivos que terminaron el pipeline por resultado y origen de los datos.",
+        'facturas_duplicados_total': "Posibles facturas duplicadas detectadas al guardar, por motivo.",
+    }
+
+    def __init__(self, limites=LIMITES_HISTOGRAMA_SEGUNDOS):
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._contadores = {}  # (nombre, etiquetas) -> valor
+            self._histogramas = {} # (nombre, etiquetas) -> {'cubetas', 'suma', 'cantidad', 'maximo'}
+
+    @staticmethod
+    def _clave(nombre, etiquetas):
+        return nombre, tuple(sorted((clave, str(valor)) for clave, valor in etiquetas.items()))
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        """
+        Registra una medición (en segundos) en el histograma 'nombre'.
+        """
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = {'cubetas': [0] * len(self.limites), 'suma': 0.0,
+                                                         'cantidad': 0, 'maximo': 0.0}
+            for indice, limite in enumerate(self.limites):
+                if valor <= limite:
+                    histograma['cubetas'][indice] += 1
+                    break
+            histograma['suma'] += valor
+            histograma['cantidad'] += 1
+            histograma['maximo'] = max(histograma['maximo'], valor)
+
+    @contextlib.contextmanager
+    def cronometrar(self, nombre, **etiquetas):
+        """
+        Registra en el histograma 'nombre' la duración del bloque 'with'.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+    def contador(self, nombre, **etiquetas):
+        """
+        Retorna la suma del contador 'nombre' en las series que tienen las etiquetas indicadas.
+        """
+        buscadas = set(self._clave(nombre, etiquetas)[1])
+        with self._lock:
+            return sum(valor for (nombre_serie, serie), valor in self._contadores.items()
+                       if nombre_serie == nombre and buscadas <= set(serie))
+
+    def instantanea(self):
+        """
+        Retorna todas las series en un diccionario serializable (y combinable).
+        """
+        with self._lock:
+            return {
+                'contadores': [{'nombre': nombre, 'etiquetas': dict(etiquetas), 'valor': valor}
+                               for (nombre, etiquetas), valor in sorted(self._contadores.items())],
+                'histogramas': [dict(histograma, nombre=nombre, etiquetas=dict(etiquetas), cubetas=list(histograma['cubetas']))
+                                for (nombre, etiquetas), histograma in sorted(self._histogramas.items())],
+            }
+
+    def combinar(self, instantanea):
+        """
+        Suma a este registro las series de una instantánea de otro proceso.
+        """
+        for serie in instantanea['contadores']:
+            self.incrementar(serie['nombre'], serie['valor'], **serie['etiquetas'])
+        with self._lock:
+            for serie in instantanea['histogramas']:
+                clave = self._clave(serie['nombre'], serie['etiquetas'])
+                histograma = self._histogramas.setdefault(clave, {'cubetas': [0] * len(self.limites), 'suma': 0.0,
+                                                                  'cantidad': 0, 'maximo': 0.0})
+                histograma['cubetas'] = [a + b for a, b in zip(histograma['cubetas'], serie['cubetas'])]
+                histograma['suma'] += serie['suma']
+                histograma['cantidad'] += serie['cantidad']
+                histograma['maximo'] = max(histograma['maximo'], serie['maximo'])
+
+    def indicadores(self):
+        """
+        Retorna los indicadores derivados: tasa de OCR, aciertos de la caché,
+        tokens, costo, tokens ahorrados al compactar el texto, posibles duplicados y
+        duración media y máxima de cada etapa.
+        """
+        paginas = self.contador('facturas_paginas_total')
+        consultas_cache = self.contador('facturas_cache_llm_consultas_total')
+        duraciones = {}
+        for histograma in self.instantanea()['histogramas']:
+            etiqueta = ",".join(f"{clave}={valor}" for clave, valor in histograma['etiquetas'].items())
+            nombre = histograma['nombre'] + (f"{{{etiqueta}}}" if etiqueta else "")
+            duraciones[nombre] = {'cantidad': histograma['cantidad'],
+                                  'media_segundos': round(histograma['suma'] / histograma['cantidad'], 4),
+                                  'maximo_segundos': round(histograma['maximo'], 4)}
+        return {
+            'paginas': paginas,
+            'tasa_ocr': round(self.contador('facturas_paginas_total', metodo='ocr') / paginas, 4) if paginas else None,
+            'tasa_aciertos_cache_llm': (round(self.contador('facturas_cache_llm_consultas_total', resultado='acierto')
+                                              / consultas_cache, 4) if consultas_cache else None),
+            'tokens_prompt': self.contador('facturas_llm_tokens_total', tipo='prompt'),
+            'tokens_respuesta': self.contador('facturas_llm_tokens_total', tipo='completion'),
+            'costo_usd': round(self.contador('facturas_llm_costo_usd_total'), 6),
+            'tokens_texto_ahorrados': (self.contador('facturas_llm_tokens_texto_total', texto='original')
+                                       - self.contador('facturas_llm_tokens_texto_total', texto='compactado')),
+            'posibles_duplicados': self.contador('facturas_duplicados_total'),
+            'duraciones': duraciones,
+        }
+
+    def a_json(self):
+        return dict(self.instantanea(), indicadores=self.indicadores(), limites_cubetas=list(self.limites))
+
+    def a_prometheus(self):
+        """
+        Retorna las métricas en el formato de texto de Prometheus (para el
+        recolector de archivos de texto de node_exporter, por ejemplo).
+        """
+        instantanea = self.instantanea()
+        lineas = []
+        declaradas = set()
+
+        def _declarar(nombre, tipo):
+            if nombre not in declaradas:
+                declaradas.add(nombre)
+                lineas.append(f"# HELP {nombre} {self.DESCRIPCIONES.get(nombre, nombre)}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for serie in instantanea['contadores']:
+            _declarar(serie['nombre'], 'counter')
+            lineas.append(f"{serie['nombre']}{_etiquetas_prometheus(sorted(serie['etiquetas'].items()))} {serie['valor']}")
+        for serie in instantanea['histogramas']:
+            nombre, etiquetas = serie['nombre'], sorted(serie['etiquetas'].items())
+            _declarar(nombre, 'histogram')
+            acumulado = 0
+            for limite, cantidad in zip(self.limites, serie['cubetas']):
+                acumulado += cantidad
+                lineas.append(f"{nombre}_bucket{_etiquetas_prometheus(etiquetas + [('le', limite)])} {acumulado}")
+            lineas.append(f"{nombre}_bucket{_etiquetas_prometheus(etiquetas + [('le', '+Inf')])} {serie['cantidad']}")
+            lineas.append(f"{nombre}_sum{_etiquetas_prometheus(etiquetas)} {serie['suma']}")
+            lineas.append(f"{nombre}_count{_etiquetas_prometheus(etiquetas)} {serie['cantidad']}")
+        return "\n".join(lineas) + "\n"
+
+    def resumen(self):
+        """
+        Retorna un texto con los indicadores principales, para el final de la ejecución.
+        """
+        indicadores = self.indicadores()
+        lineas = ["Resumen de métricas:"]
+        if indicadores['paginas']:
+            lineas.append(f"  Páginas: {indicadores['paginas']}, {indicadores['tasa_ocr']:.1%} con OCR.")
+        if indicadores['tasa_aciertos_cache_llm'] is not None:
+            lineas.append(f"  Caché LLM: {indicadores['tasa_aciertos_cache_llm']:.1%} de aciertos.")
+        lineas.append(f"  Tokens: {indicadores['tokens_prompt']} de prompt, {indicadores['tokens_respuesta']} de respuesta; "
+                      f"costo estimado {indicadores['costo_usd']:.4f} USD.")
+        if indicadores['tokens_texto_ahorrados']:
+            lineas.append(f"  Compactación del texto: {indicadores['tokens_texto_ahorrados']} tokens estimados ahorrados.")
+        if indicadores['posibles_duplicados']:
+            lineas.append(f"  Posibles duplicados: {indicadores['posibles_duplicados']} (ver la tabla posibles_duplicados).")
+        for nombre, duracion in indicadores['duraciones'].items():
+            lineas.append(f"  {nombre}: {duracion['cantidad']} mediciones, media {duracion['media_segundos']:.3f} s, "
+                          f"máxima {duracion['maximo_segundos']:.3f} s.")
+        return "\n".join(lineas)
+
+
+# Registro de métricas del proceso
+METRICAS = Metricas()
+
+
+def _escribir_atomico(ruta, contenido):
+    # Escribe en un archivo temporal y lo reemplaza, para que los lectores nunca vean un archivo a medias
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def exportar_metricas(ruta_json=None, ruta_prometheus=None):
+    """
+    Guarda las métricas actuales en JSON y/o en el formato de texto de Prometheus.
+    """
+    try:
+        if ruta_json:
+            _escribir_atomico(ruta_json, json.dumps(METRICAS.a_json(), ensure_ascii=False, indent=2))
+        if ruta_prometheus:
+            _escribir_atomico(ruta_prometheus, METRICAS.a_prometheus())
+    except OSError as e:
+        log.error(f"Error al guardar las métricas: {e}")
@@ -1,6 +1,10 @@
 import sqlite3
 import json # Para convertir la lista de diccionarios a JSON
 import os
+import pathlib
+import argparse
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from jinja2 import Environment, FileSystemLoader 
 
 
@@ -13,6 +17,36 @@ HTML_TEMPLATE = 'reporte_facturas_template.html'
 # Reporte HTML 
 OUTPUT_HTML = 'reporte_facturas.html'
 
+# Filas que se leen de la base de datos por vez al generar el reporte estático
+TAMANO_BLOQUE_LECTURA = 1000
+
+# Proveedores y clientes que se muestran en los paneles de resumen
+MAX_FILAS_RESUMEN = 10
+
+# Días con facturas que se muestran en el gráfico diario
+DIAS_RESUMEN = 30
+
+# --- Modo servidor (--servir) ---
+
+# Dirección y puerto del servidor HTTP local
+HOST_SERVIDOR = '127.0.0.1'
+PUERTO_SERVIDOR = 8000
+
+# Ruta de la API que implementa el procesamiento en el servidor de DataTables
+RUTA_API_FACTURAS = '/api/facturas'
+
+# Columnas de la tabla del reporte, en el orden del template. DataTables
+# indica la columna a ordenar por su posición en esta lista.
+COLUMNAS_REPORTE = ('id', 'nombre_archivo', 'numero_factura', 'fecha_emision',
+                    'proveedor', 'cliente', 'total', 'fecha_procesamiento')
+
+# Columnas en las que busca el cuadro de búsqueda: por prefijo y sin distinguir
+# mayúsculas, con los índices NOCASE que crea procesar_facturas.py
+COLUMNAS_BUSQUEDA = ('nombre_archivo', 'numero_factura', 'proveedor', 'cliente')
+
+# Filas máximas por página (también cuando DataTables pide "Todos")
+MAX_FILAS_POR_PAGINA = 1000
+
 # Configuración del entorno para cargar templates desde la carpeta actual
 directorio_actual = os.path.dirname(os.path.abspath(__file__))
 loader = FileSystemLoader(directorio_actual)
@@ -21,58 +55,132 @@ env = Environment(loader=loader)
 
 # Funciones
 
-def fetch_invoice_data(db_name):
+def conectar_solo_lectura(db_name):
     """
-    Conecta a la base de datos SQLite y recupera todos los datos de la tabla 'facturas'.
-    Retorna una lista de diccionarios, donde cada diccionario representa una fila de la tabla.
+    Retorna la URI para abrir la base de datos SQLite en modo de solo lectura.
+    """
+    return pathlib.Path(db_name).resolve().as_uri() + "?mode=ro"
+
+
+def open_read_only(db_name):
+    """
+    Abre la base de datos en modo de solo lectura, con filas accesibles por nombre.
+    Con la base en modo WAL, puede leerse mientras procesar_facturas.py sigue
+    insertando facturas. Lanza FileNotFoundError si la base no existe.
+    """
+    if not os.path.exists(db_name):
+        raise FileNotFoundError(db_name)
+    conn = sqlite3.connect(conectar_solo_lectura(db_name), uri=True)
+    conn.row_factory = sqlite3.Row # Permite acceder a las columnas por nombre
+    return conn
+
+
+def fetch_summary_data(db_name):
+    """
+    Recupera los paneles de resumen del reporte desde las tablas de resumen que
+    mantiene procesar_facturas.py, con un costo proporcional al número de grupos
+    y no al de facturas. Los importes están en centavos y separados por moneda.
+    Retorna un diccionario, o None si la base no tiene tablas de resumen.
     """
     conn = None
-    data = []
     try:
-        conn = sqlite3.connect(db_name)
-        conn.row_factory = sqlite3.Row # Permite acceder a las columnas por nombre
-        cursor = conn.cursor()
+        conn = open_read_only(db_name)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resumen_diario'").fetchone() is None:
+            print("La base de datos no tiene tablas de resumen: ejecuta procesar_facturas.py para crearlas.")
+            return None
 
-        
-        cursor.execute("SELECT * FROM facturas")
+        def consultar(sql, params=()):
+            return [dict(row) for row in conn.execute(sql, params)]
 
-        
-        rows = cursor.fetchall()
+        return {
+            'totales': consultar('''
+                SELECT moneda, SUM(cantidad) AS cantidad, SUM(total_centavos) AS total_centavos,
+                       SUM(impuestos_centavos) AS impuestos_centavos
+                FROM resumen_diario GROUP BY moneda ORDER BY total_centavos DESC
+            '''),
+            'por_mes': consultar('''
+                SELECT mes, moneda, SUM(cantidad) AS cantidad, SUM(total_centavos) AS total_centavos
+                FROM resumen_proveedor_mes WHERE mes != '' GROUP BY mes, moneda ORDER BY mes
+            '''),
+            'por_dia': consultar('''
+                SELECT fecha, moneda, cantidad, total_centavos FROM resumen_diario
+                WHERE fecha IN (SELECT DISTINCT fecha FROM resumen_diario WHERE fecha != ''
+                                ORDER BY fecha DESC LIMIT ?)
+                ORDER BY fecha
+            ''', (DIAS_RESUMEN,)),
+            'proveedores': consultar('''
+                SELECT IFNULL(p.nombre, '') AS nombre, r.moneda, SUM(r.cantidad) AS cantidad,
+                       SUM(r.total_centavos) AS total_centavos
+                FROM resumen_proveedor_mes r LEFT JOIN proveedores p ON p.id = r.proveedor_id
+                GROUP BY r.proveedor_id, r.moneda ORDER BY total_centavos DESC LIMIT ?
+            ''', (MAX_FILAS_RESUMEN,)),
+            'clientes': consultar('''
+                SELECT cliente AS nombre, moneda, SUM(cantidad) AS cantidad, SUM(total_centavos) AS total_centavos
+                FROM resumen_cliente_mes GROUP BY cliente, moneda ORDER BY total_centavos DESC LIMIT ?
+            ''', (MAX_FILAS_RESUMEN,)),
+        }
 
-        # Convierte las filas a una lista de diccionarios
-        # Esto es necesario para pasar los datos a Jinja2 y luego a JSON para DataTables
-        data = [dict(row) for row in rows]
+    except FileNotFoundError:
+        print(f"Error: La base de datos '{db_name}' no fue encontrada.")
+        return None
+    except Exception as e:
+        print(f"Error al recuperar el resumen de la base de datos: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
 
-        print(f"Recuperados {len(data)} registros de la base de datos.")
-        return data
 
+def stream_invoice_data(db_name, chunk_size=TAMANO_BLOQUE_LECTURA):
+    """
+    Recupera las columnas del reporte de la tabla 'facturas' como un generador de
+    diccionarios que lee las filas de a 'chunk_size' con fetchmany, para no cargar
+    toda la tabla en memoria.
+    La conexión se cierra al agotar el generador. Retorna None si la consulta falla.
+    """
+    try:
+        conn = open_read_only(db_name)
     except FileNotFoundError:
         print(f"Error: La base de datos '{db_name}' no fue encontrada.")
         return None
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(COLUMNAS_REPORTE)} FROM facturas ORDER BY id")
     except Exception as e:
         print(f"Error al recuperar datos de la base de datos: {e}")
+        conn.close()
         return None
-    finally:
-        
-        if conn:
+
+    def rows():
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield dict(row)
+        finally:
             conn.close()
 
+    return rows()
 
-def render_report_html(template_name, output_filename, data_to_render):
+
+def render_report_html(template_name, output_filename, data_to_render, summary_data=None):
     """
     Carga el template HTML, renderiza los datos en él y guarda el resultado en un archivo.
+    'data_to_render' puede ser una lista o un generador (ver stream_invoice_data): el
+    HTML se escribe en el archivo a medida que se genera, sin armarlo entero en memoria.
+    'summary_data' (ver fetch_summary_data) agrega los paneles de resumen.
     """
+    archivo_temporal = output_filename + ".tmp"
     try:
         # Cargar el template
         template = env.get_template(template_name)
 
-        # Pasamos la lista de diccionarios a una variable llamada 'facturas_data' en el template.
-        # El filtro 'tojson' de Jinja2 es crucial para convertir la lista a una cadena JSON válida para JavaScript.
-        rendered_html = template.render(facturas_data=data_to_render)
-
-        # Guarda el HTML renderizado en el archivo de salida
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(rendered_html)
+        # Pasamos las facturas a una variable llamada 'facturas_data' en el template, que
+        # las convierte una por una a JSON válido para JavaScript con el filtro 'tojson'.
+        # Se escribe en un archivo temporal para no dejar un reporte a medias si algo falla.
+        template.stream(facturas_data=data_to_render, resumen=summary_data).dump(archivo_temporal, encoding='utf-8')
+        os.replace(archivo_temporal, output_filename)
 
         print(f"Reporte HTML generado exitosamente en '{output_filename}'.")
 
@@ -80,17 +188,162 @@ def render_report_html(template_name, output_filename, data_to_render):
         print(f"Error: El archivo de template '{template_name}' no fue encontrado.")
     except Exception as e:
         print(f"Error al renderizar o guardar el reporte HTML: {e}")
+    finally:
+        if os.path.exists(archivo_temporal):
+            os.remove(archivo_temporal)
+
+
+
+# Modo Servidor
 
+def _escape_like(texto):
+    # Escapa los comodines de LIKE para buscar el texto literalmente
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def fetch_invoice_page(conn, start, length, search, order):
+    """
+    Recupera una página de facturas. 'search' filtra por prefijo en COLUMNAS_BUSQUEDA
+    y 'order' es una lista de pares (columna, ascendente).
+    Retorna (total de facturas, facturas que cumplen el filtro, lista de diccionarios).
+    """
+    where, params = "", []
+    if search:
+        where = "WHERE " + " OR ".join(f"{columna} LIKE ? ESCAPE '\\'" for columna in COLUMNAS_BUSQUEDA)
+        params = [_escape_like(search) + '%'] * len(COLUMNAS_BUSQUEDA)
+
+    total = conn.execute("SELECT COUNT(*) FROM facturas").fetchone()[0]
+    filtradas = conn.execute(f"SELECT COUNT(*) FROM facturas {where}", params).fetchone()[0] if where else total
+
+    # Las columnas vienen de COLUMNAS_REPORTE, nunca del texto de la solicitud.
+    # 'id' desempata para que las páginas no repitan ni salteen filas.
+    orden = [f"{columna} {'ASC' if ascendente else 'DESC'}" for columna, ascendente in order]
+    orden.append("id ASC")
+    rows = conn.execute(f"SELECT {', '.join(COLUMNAS_REPORTE)} FROM facturas {where} "
+                        f"ORDER BY {', '.join(orden)} LIMIT ? OFFSET ?", params + [length, start])
+    return total, filtradas, [dict(row) for row in rows]
+
+
+def build_datatables_response(db_name, params):
+    """
+    Atiende una solicitud del procesamiento en el servidor de DataTables.
+    'params' son los parámetros de la URL (urllib.parse.parse_qs). Retorna el
+    diccionario de respuesta; lanza ValueError si los parámetros no son válidos.
+    """
+    def param(nombre, valor_por_defecto):
+        return params.get(nombre, [valor_por_defecto])[0]
+
+    draw = int(param('draw', 0))
+    start = max(int(param('start', 0)), 0)
+    length = int(param('length', 10))
+    if length < 0 or length > MAX_FILAS_POR_PAGINA: # -1 significa "Todos"
+        length = MAX_FILAS_POR_PAGINA
+    search = param('search[value]', '').strip()
+
+    order = []
+    i = 0
+    while f'order[{i}][column]' in params:
+        indice = int(param(f'order[{i}][column]', 0))
+        if not 0 <= indice < len(COLUMNAS_REPORTE):
+            raise ValueError(f"Columna de ordenamiento no válida: {indice}")
+        order.append((COLUMNAS_REPORTE[indice], param(f'order[{i}][dir]', 'asc') != 'desc'))
+        i += 1
+
+    conn = open_read_only(db_name)
+    try:
+        total, filtradas, data = fetch_invoice_page(conn, start, length, search, order)
+    finally:
+        conn.close()
+    return {'draw': draw, 'recordsTotal': total, 'recordsFiltered': filtradas, 'data': data}
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """
+    Sirve la página del reporte en '/' y la API de DataTables en RUTA_API_FACTURAS.
+    Cada solicitud abre su propia conexión de solo lectura a la base de datos.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/':
+            # La página se genera en cada visita para que el resumen esté al día
+            pagina = env.get_template(self.server.template_name).render(
+                url_datos=RUTA_API_FACTURAS, resumen=fetch_summary_data(self.server.db_name))
+            self._send(200, 'text/html; charset=utf-8', pagina.encode('utf-8'))
+        elif url.path == RUTA_API_FACTURAS:
+            try:
+                respuesta = build_datatables_response(self.server.db_name, urllib.parse.parse_qs(url.query))
+            except ValueError as e:
+                self._send_json(400, {'error': f"Parámetros no válidos: {e}"})
+            except Exception as e:
+                print(f"Error al consultar la base de datos: {e}")
+                self._send_json(500, {'error': "Error al consultar la base de datos."})
+            else:
+                self._send_json(200, respuesta)
+        else:
+            self._send(404, 'text/plain; charset=utf-8', "No encontrado".encode('utf-8'))
+
+    def _send_json(self, status, data):
+        self._send(status, 'application/json; charset=utf-8', json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_report(db_name, template_name, host=HOST_SERVIDOR, port=PUERTO_SERVIDOR):
+    """
+    Sirve el reporte en un servidor HTTP local. La página no incluye los datos:
+    DataTables pide al servidor solo la página visible, ordenada y filtrada con SQL.
+    """
+    if not os.path.exists(db_name):
+        print(f"Error: La base de datos '{db_name}' no fue encontrada.")
+        return
+
+    servidor = ThreadingHTTPServer((host, port), ReportRequestHandler)
+    servidor.db_name = db_name
+    servidor.template_name = template_name
+    print(f"Reporte disponible en http://{host}:{servidor.server_port}/ (Ctrl+C para detener).")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        print("Servidor detenido.")
 
 
 # Ejecución Principal
 
-if __name__ == "__main__":
-    # 1. Recupera los datos de la base de datos
-    invoice_data = fetch_invoice_data(NOMBRE_BD)
+def main(argv=None):
+    """
+    Genera el reporte HTML estático o, con --servir, lo sirve con paginación en el servidor.
+    """
+    parser = argparse.ArgumentParser(description="Genera el reporte HTML de las facturas analizadas.")
+    parser.add_argument("--servir", action="store_true",
+                        help="Servir el reporte en un servidor HTTP local que envía al navegador solo la página visible.")
+    parser.add_argument("--host", default=HOST_SERVIDOR,
+                        help=f"Dirección del servidor (por defecto: {HOST_SERVIDOR}).")
+    parser.add_argument("--puerto", type=int, default=PUERTO_SERVIDOR,
+                        help=f"Puerto del servidor (por defecto: {PUERTO_SERVIDOR}).")
+    args = parser.parse_args(argv)
+
+    if args.servir:
+        serve_report(NOMBRE_BD, HTML_TEMPLATE, args.host, args.puerto)
+        return
+
+    # 1. Prepara la lectura de los datos de la base de datos (por bloques) y su resumen
+    invoice_data = stream_invoice_data(NOMBRE_BD)
 
     if invoice_data is not None: # Procede solo si se recuperaron datos (incluso si la lista está vacía)
         # 2. Genera el reporte HTML
-        render_report_html(HTML_TEMPLATE, OUTPUT_HTML, invoice_data)
+        render_report_html(HTML_TEMPLATE, OUTPUT_HTML, invoice_data, fetch_summary_data(NOMBRE_BD))
     else:
-        print("No se pudieron recuperar datos de la base de datos. No se generará el reporte.")
\ No newline at end of file
+        print("No se pudieron recuperar datos de la base de datos. No se generará el reporte.")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,4 @@
+"""
+Pruebas del paquete facturacion. No necesitan PyMuPDF, Tesseract ni openai:
+usan bases SQLite temporales y textos de ejemplo (python -m pytest tests).
+"""
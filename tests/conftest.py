@@ -0,0 +1,34 @@
+import pytest
+
+from facturacion.base_datos import EscritorSQLite, configurar_base_datos
+
+
+@pytest.fixture
+def base_datos(tmp_path):
+    """
+    Conexión y cursor de una base de datos nueva con el esquema actual.
+    """
+    conn, cursor = configurar_base_datos(str(tmp_path / "facturas.db"))
+    yield conn, cursor
+    conn.close()
+
+
+@pytest.fixture
+def guardar_facturas(base_datos):
+    """
+    Guarda facturas con EscritorSQLite, como la etapa de escritura del pipeline.
+    Recibe tuplas (nombre_archivo, datos, texto); el hash del contenido se deriva
+    del nombre y el texto se guarda en 'documentos' si no es None.
+    """
+    conn, _ = base_datos
+
+    def _guardar(*facturas):
+        escritor = EscritorSQLite(conn)
+        for nombre_archivo, datos, texto in facturas:
+            hash_contenido = f"hash-{nombre_archivo}"
+            if texto is not None:
+                escritor.agregar_documento(hash_contenido, texto, datos, 'llm')
+            escritor.agregar_factura(nombre_archivo, datos, hash_contenido)
+        escritor.vaciar()
+
+    return _guardar
@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+
+from facturacion.base_datos import TABLAS_RESUMEN, VERSION_ESQUEMA, EscritorSQLite, configurar_base_datos
+
+
+# --- Migraciones ---
+
+def test_migracion_desde_version_0(tmp_path):
+    ruta = str(tmp_path / "v0.db")
+    conn = sqlite3.connect(ruta)
+    conn.execute('''
+        CREATE TABLE facturas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, nombre_archivo TEXT UNIQUE, numero_factura TEXT,
+            fecha_emision TEXT, proveedor TEXT, cliente TEXT, total REAL,
+            fecha_procesamiento DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany("INSERT INTO facturas (nombre_archivo, numero_factura, fecha_emision, proveedor, cliente, total) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", [
+                         ('a.pdf', 'Nº 0001-00012345', '05/05/2025', 'Ácme, S.A.', 'Cliente', 1234.565),
+                         ('b.pdf', 'F-2', '01 de febrero de 2014', 'ACME SA', 'Cliente', 10),
+                         ('c.pdf', 'F-3', '12/2024', None, None, None),
+                     ])
+    conn.commit()
+    conn.close()
+
+    conn, cursor = configurar_base_datos(ruta)
+    try:
+        assert cursor.execute("PRAGMA user_version").fetchone()[0] == VERSION_ESQUEMA
+        filas = cursor.execute('''
+            SELECT nombre_archivo, fecha_emision, total_centavos, numero_normalizado, proveedor_id
+            FROM facturas ORDER BY nombre_archivo
+        ''').fetchall()
+        proveedores = cursor.execute("SELECT id, nombre_normalizado FROM proveedores").fetchall()
+        assert proveedores == [(1, 'acme sa')] # Las dos variantes quedan como un solo proveedor
+        assert filas == [('a.pdf', '2025-05-05', 123457, '1-12345', 1),
+                         ('b.pdf', '2014-02-01', 1000, 'F-2', 1),
+                         ('c.pdf', None, None, 'F-3', None)]
+        assert cursor.execute("SELECT cantidad, total_centavos FROM resumen_proveedor_mes "
+                              "WHERE proveedor_id = 1 AND mes = '2025-05'").fetchone() == (1, 123457)
+        columnas = [fila[1] for fila in cursor.execute("PRAGMA table_info(trabajos)")]
+        assert 'reintentar_desde' in columnas
+    finally:
+        conn.close()
+
+
+def test_configurar_base_datos_es_idempotente(tmp_path):
+    ruta = str(tmp_path / "facturas.db")
+    for _ in range(2):
+        conn, cursor = configurar_base_datos(ruta)
+        assert cursor.execute("PRAGMA user_version").fetchone()[0] == VERSION_ESQUEMA
+        conn.close()
+
+
+# --- Tablas de resumen ---
+
+def _resumenes(cursor):
+    return {tabla: sorted(cursor.execute(f"SELECT * FROM {tabla}").fetchall()) for tabla in TABLAS_RESUMEN}
+
+
+def _resumenes_calculados(cursor):
+    # Las mismas tablas calculadas con GROUP BY sobre 'facturas'
+    resultado = {}
+    for tabla, columnas in TABLAS_RESUMEN.items():
+        expresiones = ", ".join(expresion.format(fila='facturas') for _, expresion in columnas)
+        resultado[tabla] = sorted(cursor.execute(f'''
+            SELECT {expresiones}, COUNT(*), IFNULL(SUM(total_centavos), 0), IFNULL(SUM(impuestos_centavos), 0)
+            FROM facturas GROUP BY {expresiones}
+        ''').fetchall())
+    return resultado
+
+
+def _datos(proveedor, fecha, total, cliente='Cliente', moneda='ARS'):
+    return {'numero_factura': None, 'fecha_emision': fecha, 'proveedor': proveedor, 'cliente': cliente,
+            'total': total, 'impuestos': total / 10 if total else None, 'moneda': moneda}
+
+
+def test_resumenes_coinciden_con_group_by(base_datos):
+    conn, cursor = base_datos
+    escritor = EscritorSQLite(conn)
+    for indice, (proveedor, fecha, total, moneda) in enumerate([
+            ('ACME', '2024-01-05', 100, 'ARS'), ('ACME', '2024-01-20', 50.5, 'ARS'),
+            ('ACME', '2024-01-20', 10, 'USD'), ('Globex', '2024-02-01', 7, 'ARS'),
+            (None, None, None, None)]):
+        escritor.agregar_factura(f"{indice}.pdf", _datos(proveedor, fecha, total, moneda=moneda), f"hash-{indice}")
+    escritor.vaciar()
+    assert _resumenes(cursor) == _resumenes_calculados(cursor)
+    assert _resumenes(cursor)['resumen_diario'][0] == ('', '', 1, 0, 0) # Factura sin fecha ni moneda
+
+    # Reprocesar un archivo actualiza la fila: su importe pasa de un grupo a otro
+    escritor.agregar_factura("0.pdf", _datos('Globex', '2024-03-01', 30), "hash-0")
+    escritor.agregar_factura("3.pdf", _datos('Globex', '2024-02-01', 8), "hash-3")
+    escritor.vaciar()
+    assert _resumenes(cursor) == _resumenes_calculados(cursor)
+
+    # Los grupos que se quedan sin facturas desaparecen
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE nombre_archivo IN ('2.pdf', '4.pdf')")
+    assert _resumenes(cursor) == _resumenes_calculados(cursor)
+    assert ('2024-01-20', 'USD') not in [fila[:2] for fila in _resumenes(cursor)['resumen_diario']]
+
+
+def test_resumenes_sin_facturas_quedan_vacios(base_datos):
+    conn, cursor = base_datos
+    escritor = EscritorSQLite(conn)
+    escritor.agregar_factura("a.pdf", _datos('ACME', '2024-01-05', 100), "hash-a")
+    escritor.vaciar()
+    with conn:
+        conn.execute("DELETE FROM facturas")
+    assert all(not filas for filas in _resumenes(cursor).values())
+
+
+@pytest.mark.parametrize("origen, esperado", [('llm', 'llm'), (None, None)])
+def test_documento_conserva_origen_de_los_datos(base_datos, origen, esperado):
+    conn, cursor = base_datos
+    escritor = EscritorSQLite(conn)
+    escritor.agregar_documento("hash-a", "texto", {'total': 1}, origen)
+    escritor.agregar_documento("hash-a", "texto", {'total': 1}) # Datos reutilizados: no cambia el origen
+    escritor.vaciar()
+    assert cursor.execute("SELECT origen_datos FROM documentos").fetchone() == (esperado,)
@@ -0,0 +1,79 @@
+from facturacion.duplicados import firma_texto, similitud_firmas
+
+TEXTO_FACTURA = """ACME S.A.  CUIT 30-12345678-9
+Factura Nº 0001-00012345   Fecha: 05/03/2024
+Cliente: Globex
+2 x Tornillo 6 mm   $ 20,00
+1 x Arandela        $ 5,00
+TOTAL $ 25,00"""
+
+# El mismo documento escaneado: algunos caracteres cambiados por el OCR
+TEXTO_ESCANEADO = TEXTO_FACTURA.replace("Tornillo", "Tornil1o").replace("Arandela", "Arande1a")
+
+TEXTO_OTRA_FACTURA = """ACME S.A.  CUIT 30-12345678-9
+Factura Nº 0001-00012345   Fecha: 05/03/2024
+Cliente: Initech
+10 x Cable de red cat 6   $ 250,00
+3 x Conector RJ45 blindado $ 12,00
+TOTAL $ 262,00"""
+
+
+def _datos(numero, total, fecha='05/03/2024', proveedor='ACME S.A.'):
+    return {'numero_factura': numero, 'fecha_emision': fecha, 'proveedor': proveedor, 'cliente': 'Globex',
+            'total': total, 'impuestos': None, 'moneda': 'ARS'}
+
+
+def _duplicados(cursor):
+    return cursor.execute('''
+        SELECT f.nombre_archivo, o.nombre_archivo, d.motivo FROM posibles_duplicados d
+        JOIN facturas f ON f.id = d.factura_id JOIN facturas o ON o.id = d.original_id
+    ''').fetchall()
+
+
+def test_similitud_de_firmas():
+    assert similitud_firmas(firma_texto(TEXTO_FACTURA), firma_texto(TEXTO_FACTURA)) == 1
+    assert similitud_firmas(firma_texto(TEXTO_FACTURA), firma_texto(TEXTO_ESCANEADO)) > 0.6
+    assert similitud_firmas(firma_texto(TEXTO_FACTURA), firma_texto(TEXTO_OTRA_FACTURA)) < 0.6
+
+
+def test_mismo_numero_con_otro_formato_es_duplicado(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    guardar_facturas(("original.pdf", _datos('Nº 0001-00012345', 25), TEXTO_FACTURA))
+    guardar_facturas(("escaneo.pdf", _datos('1-12345', 25, proveedor='Acme SA'), TEXTO_ESCANEADO))
+    assert _duplicados(cursor) == [('escaneo.pdf', 'original.pdf', 'numero')]
+
+
+def test_mismo_importe_con_fecha_cercana_es_duplicado(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    guardar_facturas(("original.pdf", _datos('Nº 0001-00012345', 25), TEXTO_FACTURA),
+                     ("escaneo.pdf", _datos(None, 25, fecha='06/03/2024'), TEXTO_ESCANEADO))
+    assert _duplicados(cursor) == [('escaneo.pdf', 'original.pdf', 'importe_fecha')]
+
+
+def test_mismo_numero_con_otro_texto_no_es_duplicado(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    guardar_facturas(("a.pdf", _datos('Nº 0001-00012345', 25), TEXTO_FACTURA),
+                     ("b.pdf", _datos('Nº 0001-00012345', 262), TEXTO_OTRA_FACTURA))
+    assert _duplicados(cursor) == []
+
+
+def test_numeros_con_los_mismos_digitos_no_son_duplicado(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    # Sin textos que comparar basta el número y el total, y '1 12345' no es '11-2345'
+    guardar_facturas(("a.pdf", _datos('1 12345', 25), None),
+                     ("b.pdf", _datos('11-2345', 25, fecha='05/03/2023'), None))
+    assert _duplicados(cursor) == []
+
+
+def test_sin_texto_exige_el_mismo_total(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    guardar_facturas(("a.pdf", _datos('F-1', 25), None), ("b.pdf", _datos('F-1', 25), None),
+                     ("c.pdf", _datos('F-1', 30, fecha='01/01/2020'), None))
+    assert _duplicados(cursor) == [('b.pdf', 'a.pdf', 'numero')]
+
+
+def test_proveedores_distintos_no_son_duplicado(base_datos, guardar_facturas):
+    _, cursor = base_datos
+    guardar_facturas(("a.pdf", _datos('F-1', 25), TEXTO_FACTURA),
+                     ("b.pdf", _datos('F-1', 25, proveedor='Globex'), TEXTO_FACTURA))
+    assert _duplicados(cursor) == []
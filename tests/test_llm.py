@@ -0,0 +1,130 @@
+import json
+
+import pytest
+
+from facturacion import llm
+from facturacion.configuracion import SEPARADOR_PAGINA_NATIVA
+from facturacion.llm import (MARCA_OMISION, LimitadorTasa, _interpretar_respuesta_lote, agrupar_en_lotes,
+                             compactar_texto_factura, estimar_tokens)
+
+
+# --- Compactación del texto ---
+
+def _pagina(numero, articulos):
+    return "\n".join(["ACME S.A.  CUIT 30-12345678-9", "Factura Nº 0001-00012345"]
+                     + articulos + [f"Página {numero} de 2"])
+
+
+def test_compactar_conserva_articulos_repetidos_bajo_el_limite():
+    articulos = ["1 x Tornillo 6 mm    $ 10,00"] * 3
+    texto = SEPARADOR_PAGINA_NATIVA.join([_pagina(1, articulos), _pagina(2, articulos)])
+
+    compactado = compactar_texto_factura(texto)
+
+    # Bajo el límite solo se colapsan espacios: nada se quita, tampoco encabezados ni páginas
+    assert compactado.count("1 x Tornillo 6 mm $ 10,00") == 6
+    assert compactado.count("Factura Nº 0001-00012345") == 2
+    assert "Página 2 de 2" in compactado
+
+
+def test_compactar_sobre_el_limite_quita_encabezados_repetidos_y_no_articulos():
+    texto = SEPARADOR_PAGINA_NATIVA.join([_pagina(1, ["1 x Tornillo 6 mm    $ 10,00"] * 5),
+                                          _pagina(2, ["1 x Tuerca 6 mm    $ 5,00"] * 5)])
+    max_tokens = estimar_tokens(texto) - 10
+
+    compactado = compactar_texto_factura(texto, max_tokens)
+
+    assert estimar_tokens(compactado) <= max_tokens
+    # El encabezado repetido en cada página queda una vez; los artículos iguales de una página, todos
+    assert compactado.count("Factura Nº 0001-00012345") == 1
+    assert compactado.count("1 x Tornillo 6 mm $ 10,00") == 5
+    assert compactado.count("1 x Tuerca 6 mm $ 5,00") == 5
+    assert "Página" not in compactado
+
+
+def test_compactar_recorta_al_limite_conservando_principio_y_final():
+    lineas = ["ACME S.A."] + [f"Artículo {i:04d} sin datos clave" for i in range(2000)] + ["TOTAL $ 1.234,56"]
+
+    compactado = compactar_texto_factura("\n".join(lineas), max_tokens=200)
+
+    assert estimar_tokens(compactado) <= 200
+    assert compactado.startswith("ACME S.A.")
+    assert compactado.endswith("TOTAL $ 1.234,56")
+    assert MARCA_OMISION in compactado
+
+
+# --- Lotes ---
+
+def test_agrupar_en_lotes_respeta_maximo_y_presupuesto():
+    textos = [(f"f{i}", "x" * 400) for i in range(5)]
+    assert [len(lote) for lote in agrupar_en_lotes(textos, presupuesto_tokens=10**6, max_por_lote=2)] == [2, 2, 1]
+
+    base = estimar_tokens(llm.PLANTILLA_PROMPT_LOTE) + estimar_tokens(llm.INSTRUCCIONES_CAMPOS)
+    por_texto = estimar_tokens("x" * 400) + estimar_tokens(llm.BLOQUE_FACTURA_LOTE)
+    lotes = list(agrupar_en_lotes(textos, presupuesto_tokens=base + 2 * por_texto, max_por_lote=10))
+    assert [len(lote) for lote in lotes] == [2, 2, 1]
+    assert [clave for lote in lotes for clave, _ in lote] == [clave for clave, _ in textos]
+
+
+def test_agrupar_en_lotes_texto_mayor_que_el_presupuesto_va_solo():
+    textos = [("chico", "x" * 40), ("grande", "x" * 40000), ("otro", "x" * 40)]
+    lotes = list(agrupar_en_lotes(textos, presupuesto_tokens=2000, max_por_lote=10))
+    assert [[clave for clave, _ in lote] for lote in lotes] == [["chico"], ["grande"], ["otro"]]
+
+
+def test_interpretar_respuesta_lote_traduce_ids_e_ignora_desconocidos():
+    respuesta = json.dumps({'facturas': [{'id': 'F2', 'total': 10}, {'id': 'F9', 'total': 1}, 'basura']})
+    assert _interpretar_respuesta_lote(respuesta, {'F1': 'a.pdf', 'F2': 'b.pdf'}) == {'b.pdf': {'total': 10}}
+    assert _interpretar_respuesta_lote(json.dumps({'otra': 1}), {'F1': 'a.pdf'}) == {}
+
+
+# --- Control de tasa ---
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """
+    Reloj manual para LimitadorTasa: reloj.avanzar(segundos) mueve time.monotonic.
+    """
+    class Reloj:
+        ahora = 1000.0
+
+        def avanzar(self, segundos):
+            self.ahora += segundos
+
+    reloj = Reloj()
+    monkeypatch.setattr(llm.time, 'monotonic', lambda: reloj.ahora)
+    return reloj
+
+
+def test_limitador_sin_limites_no_espera(reloj):
+    limitador = LimitadorTasa()
+    assert all(limitador.reservar(10**6) == 0 for _ in range(100))
+
+
+def test_limitador_solicitudes_por_minuto(reloj):
+    limitador = LimitadorTasa(solicitudes_por_minuto=60)
+    assert all(limitador.reservar(1) == 0 for _ in range(60))
+    assert limitador.reservar(1) == pytest.approx(1.0)
+    assert limitador.reservar(1) == pytest.approx(2.0) # Las siguientes esperan en orden
+    reloj.avanzar(2)
+    assert limitador.reservar(1) == pytest.approx(1.0)
+
+
+def test_limitador_tokens_por_minuto(reloj):
+    limitador = LimitadorTasa(tokens_por_minuto=600)
+    assert limitador.reservar(600) == 0
+    assert limitador.reservar(300) == pytest.approx(30.0)
+    reloj.avanzar(60)
+    assert limitador.reservar(100) == 0
+
+
+def test_limitador_pausa_y_cabeceras(reloj):
+    limitador = LimitadorTasa()
+    limitador.pausar(5)
+    assert limitador.reservar(1) == pytest.approx(5.0)
+    reloj.avanzar(5)
+
+    # Las cabeceras fijan los límites y la capacidad restante informada por OpenAI
+    limitador.actualizar({'x-ratelimit-limit-requests': '120', 'x-ratelimit-remaining-requests': '0'})
+    assert limitador.solicitudes_por_minuto == 120
+    assert limitador.reservar(1) == pytest.approx(0.5)
@@ -0,0 +1,55 @@
+import pytest
+
+from facturacion.normalizacion import (a_centavos, normalizar_fecha, normalizar_numero_factura,
+                                       normalizar_proveedor, normalizar_total)
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ('1.234.567', 1234567.0),       # Varios puntos sin coma: separadores de miles
+    ('$ 1.234.567,89', 1234567.89),
+    ('1,234.50', 1234.5),
+    ('12,5', 12.5),
+    ('1,234', 1234.0),              # Coma sin 1 o 2 decimales: separador de miles
+    (150, 150.0),
+    ('sin monto', None),
+    (None, None),
+])
+def test_normalizar_total(valor, esperado):
+    assert normalizar_total(valor, avisar_errores=False) == esperado
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ('2024-03-05', '2024-03-05'),
+    ('05/03/2024', '2024-03-05'),   # Día primero
+    ('05.03.24', '2024-03-05'),
+    ('01 de febrero de 2014', '2014-02-01'),
+    ('12/2024', None),              # Mes y año, sin día
+    ('31/02/2024', None),
+    ('30 de febrero de 2024', None),
+    ('', None),
+])
+def test_normalizar_fecha(valor, esperado):
+    assert normalizar_fecha(valor) == esperado
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ('Nº 0001-00012345', '1-12345'),
+    ('1 12345', '1-12345'),
+    ('11-2345', '11-2345'),         # No coincide con '1 12345' aunque los dígitos sean los mismos
+    ('No. A-0001', 'A-1'),
+    ('#000', '0'),
+    ('Nº -', None),
+])
+def test_normalizar_numero_factura(valor, esperado):
+    assert normalizar_numero_factura(valor) == esperado
+
+
+def test_a_centavos_redondea_la_mitad_hacia_arriba():
+    assert a_centavos(2.675) == 268
+    assert a_centavos('1.234,565') == 123457
+    assert a_centavos('sin monto') is None
+
+
+def test_normalizar_proveedor_agrupa_variantes():
+    assert normalizar_proveedor('Ácme, S.A.') == normalizar_proveedor('ACME SA') == 'acme sa'
+    assert normalizar_proveedor('  ') is None